@@ -114,6 +114,7 @@ CREATE TABLE Dim_Location (
 -- 2.2. Bảng Fact
 CREATE TABLE Fact_Spending (
     Transaction_Key BIGINT PRIMARY KEY IDENTITY(1,1),
+    TransactionID_Source BIGINT NOT NULL, -- Khóa tự nhiên: chống nạp trùng khi chạy lại ETL
     
     -- Khóa ngoại
     Date_Key INT,
@@ -134,4 +135,84 @@ CREATE TABLE Fact_Spending (
     CONSTRAINT FK_Fact_Location FOREIGN KEY (Location_Key) REFERENCES Dim_Location(Location_Key)
 );
 
+-- 2.3. Chỉ mục UNIQUE trên khóa tự nhiên (phục vụ MERGE khi nạp lại, không sinh dòng trùng)
+CREATE UNIQUE INDEX UX_Dim_Customer_Source ON Dim_Customer(CustomerID_Source);
+CREATE UNIQUE INDEX UX_Dim_Account_Source ON Dim_Account(AccountID_Source);
+CREATE UNIQUE INDEX UX_Dim_Merchant_Source ON Dim_Merchant(MerchantName_Source);
+CREATE UNIQUE INDEX UX_Dim_Location_Country ON Dim_Location(Transaction_Country);
+CREATE UNIQUE INDEX UX_Fact_TransactionID ON Fact_Spending(TransactionID_Source);
+
+-- 2.4. Bảng tổng hợp (Aggregate) cho dashboard
+-- ETL cộng dồn từ các dòng Fact mới (Transaction_Key > Agg_Watermark) sau mỗi lần chạy,
+-- dashboard đọc các bảng này thay vì GROUP BY trên toàn bộ Fact_Spending.
+IF OBJECT_ID('Agg_Monthly_Spending', 'U') IS NOT NULL DROP TABLE Agg_Monthly_Spending;
+IF OBJECT_ID('Agg_Category_Monthly', 'U') IS NOT NULL DROP TABLE Agg_Category_Monthly;
+IF OBJECT_ID('Agg_AgeGroup_Monthly', 'U') IS NOT NULL DROP TABLE Agg_AgeGroup_Monthly;
+IF OBJECT_ID('Agg_Watermark', 'U') IS NOT NULL DROP TABLE Agg_Watermark;
+
+CREATE TABLE Agg_Monthly_Spending (
+    Year INT NOT NULL,
+    Month INT NOT NULL,
+    Total_Spent DECIMAL(18, 2),
+    Transaction_Count INT,
+    PRIMARY KEY (Year, Month)
+);
+
+CREATE TABLE Agg_Category_Monthly (
+    Category NVARCHAR(50) NOT NULL,
+    Year INT NOT NULL,
+    Month INT NOT NULL,
+    Total_Spent DECIMAL(18, 2),
+    Transaction_Count INT,
+    PRIMARY KEY (Category, Year, Month)
+);
+
+CREATE TABLE Agg_AgeGroup_Monthly (
+    Age_Group NVARCHAR(20) NOT NULL,
+    Year INT NOT NULL,
+    Month INT NOT NULL,
+    Total_Spent DECIMAL(18, 2),
+    Transaction_Count INT,
+    PRIMARY KEY (Age_Group, Year, Month)
+);
+
+-- Transaction_Key lớn nhất đã được cộng vào các bảng tổng hợp
+-- Rebuild_Count tăng sau mỗi lần --rebuild-aggregates (cache của dashboard dựa vào đó để biết Agg_* đã đổi)
+CREATE TABLE Agg_Watermark (
+    Last_Transaction_Key BIGINT NOT NULL,
+    Rebuild_Count INT NOT NULL DEFAULT 0
+);
+INSERT INTO Agg_Watermark (Last_Transaction_Key) VALUES (0);
+
+-- 2.5. Feature mart theo khách hàng (CRM: RFM, cơ cấu hạng mục, tỉ lệ chi tiêu nước ngoài)
+-- Trạng thái cộng dồn: ETL chỉ gộp các dòng Fact mới (Transaction_Key > Mart_Watermark).
+-- Recency = ngày đọc - Last_Date_Key, tỉ lệ = Foreign_Spent / Total_Spent: tính lúc đọc, không lưu.
+IF OBJECT_ID('Mart_Customer_Features', 'U') IS NOT NULL DROP TABLE Mart_Customer_Features;
+IF OBJECT_ID('Mart_Customer_Category', 'U') IS NOT NULL DROP TABLE Mart_Customer_Category;
+IF OBJECT_ID('Mart_Watermark', 'U') IS NOT NULL DROP TABLE Mart_Watermark;
+
+CREATE TABLE Mart_Customer_Features (
+    Customer_Key INT PRIMARY KEY,
+    First_Date_Key INT,         -- Giao dịch đầu tiên (gộp bằng MIN)
+    Last_Date_Key INT,          -- Giao dịch gần nhất (gộp bằng MAX) -> Recency
+    Transaction_Count INT,      -- Frequency
+    Total_Spent DECIMAL(18, 2), -- Monetary
+    Foreign_Count INT,
+    Foreign_Spent DECIMAL(18, 2)
+);
+
+CREATE TABLE Mart_Customer_Category (
+    Customer_Key INT NOT NULL,
+    Category NVARCHAR(50) NOT NULL,
+    Transaction_Count INT,
+    Total_Spent DECIMAL(18, 2),
+    PRIMARY KEY (Customer_Key, Category)
+);
+
+-- Transaction_Key lớn nhất đã được gộp vào feature mart
+CREATE TABLE Mart_Watermark (
+    Last_Transaction_Key BIGINT NOT NULL
+);
+INSERT INTO Mart_Watermark (Last_Transaction_Key) VALUES (0);
+
 PRINT '--- Tao cau truc KHO DU LIEU (Star Schema) thanh cong! ---';
\ No newline at end of file
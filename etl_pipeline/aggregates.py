@@ -0,0 +1,96 @@
+import sqlalchemy
+
+from loader import merge_sql, upsert_sql
+
+# ==============================================================================
+# Bảng tổng hợp (Aggregate) cho dashboard, cập nhật tăng dần
+# ==============================================================================
+# Sau mỗi lần nạp Fact, chỉ các dòng Fact MỚI (Transaction_Key > Agg_Watermark) được
+# GROUP BY rồi CỘNG DỒN vào các bảng tổng hợp (MERGE ... t.x = t.x + s.x).
+# Chi phí mỗi lần chạy tỉ lệ với số giao dịch mới, dashboard chỉ đọc vài trăm dòng.
+#
+# Lưu ý: Category / Age_Group được lấy tại thời điểm nạp. Dim bị sửa sau đó không làm
+# thay đổi số liệu đã cộng dồn -> chạy etl.py --rebuild-aggregates để tính lại từ đầu.
+
+WATERMARK_TABLE = 'Agg_Watermark'
+# Số lần tính lại từ đầu: rebuild ghi lại Agg_* mà không đổi Transaction_Key nào
+REBUILD_COLUMN = 'Rebuild_Count'
+
+MEASURES = ['Total_Spent', 'Transaction_Count']
+
+# Bảng tổng hợp -> (cột nhóm, truy vấn tính phần chênh lệch từ các dòng Fact mới)
+AGGREGATES = {
+    'Agg_Monthly_Spending': (['Year', 'Month'], """
+        SELECT d.Year, d.Month,
+               SUM(f.Amount_Spent) AS Total_Spent, SUM(f.Transaction_Count) AS Transaction_Count
+        FROM Fact_Spending f
+        JOIN Dim_Date d ON f.Date_Key = d.Date_Key
+        WHERE f.Transaction_Key > :last_key AND f.Transaction_Key <= :max_key
+        GROUP BY d.Year, d.Month
+    """),
+    'Agg_Category_Monthly': (['Category', 'Year', 'Month'], """
+        SELECT m.Category, d.Year, d.Month,
+               SUM(f.Amount_Spent) AS Total_Spent, SUM(f.Transaction_Count) AS Transaction_Count
+        FROM Fact_Spending f
+        JOIN Dim_Date d ON f.Date_Key = d.Date_Key
+        JOIN Dim_Merchant m ON f.Merchant_Key = m.Merchant_Key
+        WHERE f.Transaction_Key > :last_key AND f.Transaction_Key <= :max_key
+        GROUP BY m.Category, d.Year, d.Month
+    """),
+    'Agg_AgeGroup_Monthly': (['Age_Group', 'Year', 'Month'], """
+        SELECT c.Age_Group, d.Year, d.Month,
+               SUM(f.Amount_Spent) AS Total_Spent, SUM(f.Transaction_Count) AS Transaction_Count
+        FROM Fact_Spending f
+        JOIN Dim_Date d ON f.Date_Key = d.Date_Key
+        JOIN Dim_Customer c ON f.Customer_Key = c.Customer_Key
+        WHERE f.Transaction_Key > :last_key AND f.Transaction_Key <= :max_key
+        GROUP BY c.Age_Group, d.Year, d.Month
+    """),
+}
+
+
+def available(engine):
+    # Kho tạo bằng schema.sql cũ (chưa có mục 2.4) -> không có bảng tổng hợp
+    return sqlalchemy.inspect(engine).has_table(WATERMARK_TABLE)
+
+
+def has_rebuild_counter(conn):
+    # Đọc tên cột qua 1 SELECT rỗng (inspector của duckdb_engine không đọc được cột)
+    columns = conn.execute(sqlalchemy.text(f"SELECT * FROM {WATERMARK_TABLE} WHERE 1 = 0")).keys()
+    return REBUILD_COLUMN in columns
+
+
+def ensure_rebuild_counter(conn):
+    # Kho tạo bằng schema.sql cũ chưa có cột Rebuild_Count -> thêm vào
+    if not has_rebuild_counter(conn):
+        conn.execute(sqlalchemy.text(f"ALTER TABLE {WATERMARK_TABLE} ADD {REBUILD_COLUMN} INT DEFAULT 0"))
+
+
+def refresh_aggregates(engine, rebuild=False):
+    # Cộng dồn các dòng Fact mới vào bảng tổng hợp, trả về (Key cũ, Key mới) đã tổng hợp.
+    # Tất cả trong 1 transaction: lỗi giữa chừng thì không bảng nào bị cộng thiếu / cộng 2 lần.
+    statement_sql = merge_sql if engine.dialect.name == 'mssql' else upsert_sql
+
+    with engine.begin() as conn:
+        if rebuild:
+            ensure_rebuild_counter(conn)
+            for table_name in AGGREGATES:
+                conn.execute(sqlalchemy.text(f"DELETE FROM {table_name}"))
+            conn.execute(sqlalchemy.text(
+                f"UPDATE {WATERMARK_TABLE} SET Last_Transaction_Key = 0, "
+                f"{REBUILD_COLUMN} = COALESCE({REBUILD_COLUMN}, 0) + 1"))
+
+        last_key = int(conn.execute(sqlalchemy.text(
+            f"SELECT MAX(Last_Transaction_Key) FROM {WATERMARK_TABLE}")).scalar() or 0)
+        max_key = conn.execute(sqlalchemy.text("SELECT MAX(Transaction_Key) FROM Fact_Spending")).scalar()
+        if max_key is None or int(max_key) <= last_key:
+            return last_key, last_key
+        max_key = int(max_key)
+
+        params = {'last_key': last_key, 'max_key': max_key}
+        for table_name, (key_cols, delta_sql) in AGGREGATES.items():
+            sql = statement_sql(table_name, f"({delta_sql})", key_cols + MEASURES, key_cols, accumulate=True)
+            conn.execute(sqlalchemy.text(sql), params)
+
+        conn.execute(sqlalchemy.text(f"UPDATE {WATERMARK_TABLE} SET Last_Transaction_Key = :max_key"), params)
+    return last_key, max_key
@@ -0,0 +1,137 @@
+import os
+import re
+import sqlite3
+from decimal import Decimal
+
+import sqlalchemy
+from sqlalchemy import event
+
+# ==============================================================================
+# Backend kho dữ liệu: SQL Server (mặc định) hoặc engine nhúng SQLite / DuckDB
+# ==============================================================================
+# Engine nhúng cho phép chạy toàn bộ Extract -> Transform -> Load và dashboard
+# trên 1 file cục bộ (không cần SQL Server) để đo hiệu năng / kiểm thử hồi quy.
+# schema.sql và các truy vấn T-SQL được dịch sang phương ngữ tương ứng:
+#   - IF OBJECT_ID(...) DROP TABLE    -> DROP TABLE IF EXISTS
+#   - IDENTITY(1,1)                   -> AUTOINCREMENT (SQLite) / SEQUENCE (DuckDB)
+#   - SELECT TOP n                    -> ... LIMIT n
+#   - ghép chuỗi bằng '+'             -> ||
+#   - RIGHT(s, n)                     -> tsql_right(s, n) (hàm tự đăng ký trên SQLite)
+
+BACKENDS = ('mssql', 'sqlite', 'duckdb')
+
+DEFAULT_DATABASES = {
+    'sqlite': 'DW_Bank.sqlite',
+    'duckdb': 'DW_Bank.duckdb',
+}
+
+SCHEMA_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_source', 'schema.sql')
+
+
+def _sqlite_right(text, length):
+    # SQLite không có hàm RIGHT() của T-SQL (RIGHT là từ khóa của RIGHT JOIN)
+    if text is None or length is None:
+        return None
+    return str(text)[-length:] if length > 0 else ''
+
+
+def create_embedded_engine(backend, database=None):
+    path = database or DEFAULT_DATABASES[backend]
+    if backend == 'sqlite':
+        # DECIMAL (Amount) được lưu dưới dạng chuỗi số, cột NUMERIC tự chuyển lại thành số
+        sqlite3.register_adapter(Decimal, str)
+        engine = sqlalchemy.create_engine(f"sqlite:///{path}")
+
+        @event.listens_for(engine, 'connect')
+        def _on_connect(dbapi_conn, connection_record):
+            dbapi_conn.create_function('tsql_right', 2, _sqlite_right, deterministic=True)
+            # WAL: luồng đọc (stream giao dịch) không bị khóa khi luồng khác đang ghi
+            dbapi_conn.execute('PRAGMA journal_mode=WAL')
+
+        return engine
+    if backend == 'duckdb':
+        # Cần: pip install duckdb duckdb_engine
+        return sqlalchemy.create_engine(f"duckdb:///{path}")
+    raise ValueError(f"Backend không hỗ trợ: {backend}")
+
+
+# ==============================================================================
+# Dịch schema.sql
+# ==============================================================================
+
+def _split_statements(script):
+    return [s.strip() for s in re.split(r';\s*(?:\n|$)', script) if s.strip()]
+
+
+def translate_schema(script, dialect):
+    # Dịch schema.sql (T-SQL) sang SQLite / DuckDB, trả về danh sách câu lệnh
+    script = re.sub(r'/\*.*?\*/', '', script, flags=re.DOTALL)
+    script = re.sub(r'^\s*(USE\s+\w+|GO|PRINT\s+.*?);?\s*$', '', script, flags=re.IGNORECASE | re.MULTILINE)
+    script = re.sub(r"IF\s+OBJECT_ID\('(\w+)',\s*'U'\)\s+IS\s+NOT\s+NULL\s+DROP\s+TABLE\s+\w+",
+                    r'DROP TABLE IF EXISTS \1', script, flags=re.IGNORECASE)
+    script = re.sub(r'\bNVARCHAR\(', 'VARCHAR(', script, flags=re.IGNORECASE)
+
+    if dialect == 'duckdb':
+        script = re.sub(r'\bBIT\b', 'BOOLEAN', script)
+        script = re.sub(r'\bDATETIME\b', 'TIMESTAMP', script)
+        # DuckDB không cho UPDATE dòng Dim đang được Fact tham chiếu khóa ngoại
+        # (MERGE / ON CONFLICT DO UPDATE) -> bỏ ràng buộc FOREIGN KEY
+        script = re.sub(r'^\s*(CONSTRAINT\s+\w+\s+)?FOREIGN\s+KEY\s*\(.*$', '', script,
+                        flags=re.IGNORECASE | re.MULTILINE)
+        script = re.sub(r',(\s*--[^\n]*)*\s*\)\s*;', '\n);', script)
+
+    statements = []
+    for statement in _split_statements(script):
+        m = re.search(r'^\s*CREATE\s+TABLE\s+(\w+)', statement, flags=re.IGNORECASE | re.MULTILINE)
+        if m and re.search(r'IDENTITY\(1,\s*1\)', statement, flags=re.IGNORECASE):
+            table_name = m.group(1)
+            if dialect == 'sqlite':
+                # Chỉ "INTEGER PRIMARY KEY" mới là cột tự tăng (rowid) trong SQLite
+                statement = re.sub(r'\b(BIG)?INT\s+PRIMARY\s+KEY\s+IDENTITY\(1,\s*1\)',
+                                   'INTEGER PRIMARY KEY AUTOINCREMENT', statement, flags=re.IGNORECASE)
+            else:
+                sequence = f"seq_{table_name}"
+                statements += [f"DROP SEQUENCE IF EXISTS {sequence}", f"CREATE SEQUENCE {sequence}"]
+                statement = re.sub(r'\b((?:BIG)?INT)\s+PRIMARY\s+KEY\s+IDENTITY\(1,\s*1\)',
+                                   rf"\1 PRIMARY KEY DEFAULT nextval('{sequence}')", statement, flags=re.IGNORECASE)
+        statements.append(statement)
+    return statements
+
+
+def create_schema(engine, schema_path=SCHEMA_FILE):
+    # Tạo (lại) toàn bộ bảng nguồn + Star Schema của schema.sql trên engine nhúng
+    with open(schema_path, encoding='utf-8') as f:
+        statements = translate_schema(f.read(), engine.dialect.name)
+    with engine.begin() as conn:
+        for statement in statements:
+            conn.exec_driver_sql(statement)
+
+
+def ensure_schema(engine, schema_path=SCHEMA_FILE):
+    # File database mới (chưa có bảng) -> tạo schema. Trả về True nếu vừa tạo.
+    if sqlalchemy.inspect(engine).has_table('Fact_Spending'):
+        return False
+    create_schema(engine, schema_path)
+    return True
+
+
+# ==============================================================================
+# Dịch truy vấn T-SQL (dashboard)
+# ==============================================================================
+
+TOP_RE = re.compile(r'\bSELECT\s+TOP\s*\(?\s*(\d+)\s*\)?', re.IGNORECASE)
+# '+' đứng cạnh 1 chuỗi hằng ('...') là phép ghép chuỗi, không phải phép cộng
+STRING_CONCAT_RE = re.compile(r"(?<=')\s*\+\s*|\s*\+\s*(?=')")
+RIGHT_RE = re.compile(r'\bRIGHT\s*\(', re.IGNORECASE)
+
+
+def translate_sql(sql, dialect):
+    if dialect == 'mssql':
+        return sql
+    sql = sql.strip().rstrip(';')
+    m = TOP_RE.search(sql)
+    if m:
+        sql = TOP_RE.sub('SELECT ', sql, count=1) + f"\nLIMIT {m.group(1)}"
+    if dialect == 'sqlite':
+        sql = RIGHT_RE.sub('tsql_right(', sql)
+    return STRING_CONCAT_RE.sub(' || ', sql)
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# Date_Key và bảng lịch Dim_Date (theo giờ)
+# ==============================================================================
+# Date_Key = yyyyMMddHH (ví dụ: 2025110614) -> INT
+# Tính bằng số học nguyên trên datetime64, không tạo chuỗi trung gian cho từng dòng.
+
+# Khoảng lịch mặc định sinh sẵn cho Dim_Date
+CALENDAR_START = '2020-01-01'
+CALENDAR_END = '2030-12-31'
+
+# Tên thứ (T2=2, ..., T7=7, CN=8)
+DAY_NAMES = {2: 'Thứ Hai', 3: 'Thứ Ba', 4: 'Thứ Tư', 5: 'Thứ Năm', 6: 'Thứ Sáu', 7: 'Thứ Bảy', 8: 'Chủ Nhật'}
+
+
+def date_key(timestamps):
+    # timestamps: Series/array datetime64 -> mảng int64 yyyyMMddHH
+    values = np.asarray(timestamps, dtype='datetime64[ns]')
+    days = values.astype('datetime64[D]')
+    months = values.astype('datetime64[M]')
+
+    year = months.astype('int64') // 12 + 1970
+    month = months.astype('int64') % 12 + 1
+    day = (days - months.astype('datetime64[D]')).astype('int64') + 1
+    hour = (values.astype('datetime64[h]') - days.astype('datetime64[h]')).astype('int64')
+
+    keys = year * 1000000 + month * 10000 + day * 100 + hour
+    if isinstance(timestamps, pd.Series):
+        return pd.Series(keys, index=timestamps.index, name='Date_Key')
+    return keys
+
+
+def build_dim_date(start=CALENDAR_START, end=CALENDAR_END):
+    # Sinh lịch đầy đủ theo giờ từ 00h ngày start đến 23h ngày end
+    hours = pd.Series(pd.date_range(pd.Timestamp(start).normalize(),
+                                    pd.Timestamp(end).normalize() + pd.Timedelta(hours=23), freq='h'))
+
+    dim_date = pd.DataFrame({'Date_Key': date_key(hours).to_numpy()})
+    dim_date['Full_Date'] = hours.dt.date
+    dim_date['Day_Of_Week'] = hours.dt.dayofweek + 2
+    dim_date['Day_Name'] = dim_date['Day_Of_Week'].map(DAY_NAMES)
+    # Cuối tuần (T7, CN)
+    dim_date['Is_Weekend'] = dim_date['Day_Of_Week'].isin([7, 8])
+    dim_date['Month'] = hours.dt.month
+    dim_date['Month_Name'] = 'Tháng ' + dim_date['Month'].astype(str)
+    dim_date['Quarter'] = hours.dt.quarter
+    dim_date['Year'] = hours.dt.year
+    dim_date['Hour_Of_Day'] = hours.dt.hour
+    return dim_date
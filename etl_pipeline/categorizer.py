@@ -0,0 +1,97 @@
+import re
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# Bộ phân loại Category (Merchant / P2P) - chạy theo cột thay vì từng dòng
+# ==============================================================================
+
+# Luật phân loại P2P theo nội dung chuyển khoản.
+# THỨ TỰ ƯU TIÊN giữ nguyên như hàm get_category cũ: luật nào đứng trước thắng.
+P2P_RULES = [
+    ('Ăn uống & Cà phê', ['an', 'com', 'pho', 'bun', 'cafe', 'nuoc', 'tra sua', 'nhau']),
+    ('Mua sắm', ['mua', 'shop', 'quan', 'ao', 'giay', 'tui', 'my pham', 'son', 'vay']),
+    ('Di chuyển & Vận tải', ['xe', 'grab', 'xang', 'ship', 'taxi', 'di lai']),
+    ('Hóa đơn & Dịch vụ', ['dien', 'mang', 'wifi', 'nha', 'hoc', 'nuoc', 'phi', 'internet']),
+    ('Giải trí & Du lịch', ['phim', 'du lich', 've', 'spa', 'game', 'homestay', 'karaoke']),
+    ('Tạp hóa & Siêu thị', ['tap hoa', 'rau', 'qua', 'gao', 'sieu thi', 'banh', 'keo']),
+]
+DEFAULT_P2P_CATEGORY = 'Chuyển khoản khác'
+
+
+class CategoryEngine:
+    """Bộ phân loại được "biên dịch" 1 lần từ bảng MCC và áp dụng cho cả cột.
+
+    - POS: hash join MerchantName -> Category (lấy dòng đầu tiên nếu CSV trùng tên).
+    - P2P: 1 regex duy nhất quét nội dung, mỗi nội dung KHÁC NHAU chỉ quét 1 lần.
+    """
+
+    def __init__(self, df_mcc_mapping, rules=P2P_RULES, default=DEFAULT_P2P_CATEGORY):
+        # 1. Từ điển Merchant -> Category (giữ dòng đầu tiên giống .iloc[0])
+        mapping = df_mcc_mapping.drop_duplicates(subset=['MerchantName'], keep='first')
+        mapping = mapping[mapping['MerchantName'].notna()]
+        self.merchant_index = pd.Index(mapping['MerchantName'].to_numpy(dtype=object))
+        self.merchant_categories = mapping['Category'].to_numpy(dtype=object)
+
+        # 2. Regex nhiều từ khóa: mỗi từ khóa gán mức ưu tiên của luật chứa nó.
+        # Dùng lookahead để bắt được MỌI vị trí (kể cả chồng lấn), và sắp xếp
+        # các nhánh theo ưu tiên để tại cùng 1 vị trí nhánh ưu tiên cao thắng.
+        self.categories = [name for name, _ in rules] + [default]
+        self.keyword_priority = {}
+        for priority, (_, keywords) in enumerate(rules):
+            for kw in keywords:
+                self.keyword_priority.setdefault(kw, priority)
+        ordered = sorted(self.keyword_priority, key=lambda kw: (self.keyword_priority[kw], -len(kw)))
+        self.pattern = re.compile('(?=(' + '|'.join(re.escape(kw) for kw in ordered) + '))')
+        self.default_priority = len(rules)
+
+    def categorize_text(self, text):
+        # Trả về Category cho 1 chuỗi nội dung đã lower()
+        hits = self.pattern.findall(text)
+        if not hits:
+            return self.categories[self.default_priority]
+        return self.categories[min(self.keyword_priority[kw] for kw in hits)]
+
+    def categorize_descriptions(self, descriptions):
+        # Phân loại cả cột TransactionDescription, mỗi giá trị khác nhau 1 lần
+        values = descriptions.to_numpy(dtype=object)
+        codes, uniques = pd.factorize(values)
+
+        # Giữ đúng hành vi cũ str(x).lower(): None -> 'none', NaN -> 'nan'
+        texts = [str(u).lower() for u in uniques] + ['none', 'nan']
+        lookup = np.array([self.categorize_text(t) for t in texts], dtype=object)
+
+        null_rows = codes == -1
+        if null_rows.any():
+            is_none = np.equal(values, None)
+            codes = codes.copy()
+            codes[null_rows & is_none] = len(uniques)
+            codes[null_rows & ~is_none] = len(uniques) + 1
+        return lookup[codes]
+
+    def categorize(self, df):
+        # Trả về Series Category cho DataFrame có cột MerchantName, TransactionDescription
+        positions = self.merchant_index.get_indexer(df['MerchantName'].to_numpy(dtype=object))
+        positions[df['MerchantName'].isna().to_numpy()] = -1
+        matched = positions >= 0
+
+        result = np.empty(len(df), dtype=object)
+        result[matched] = self.merchant_categories[positions[matched]]
+        if (~matched).any():
+            result[~matched] = self.categorize_descriptions(df['TransactionDescription'][~matched])
+        return pd.Series(result, index=df.index)
+
+
+def get_category_rowwise(row, df_mcc_mapping):
+    # Cách làm cũ (apply từng dòng) - giữ lại để đối chiếu kết quả và benchmark
+    if pd.notna(row['MerchantName']):
+        match = df_mcc_mapping[df_mcc_mapping['MerchantName'] == row['MerchantName']]
+        if not match.empty:
+            return match.iloc[0]['Category']
+
+    desc = str(row['TransactionDescription']).lower()
+    for category, keywords in P2P_RULES:
+        if any(x in desc for x in keywords):
+            return category
+    return DEFAULT_P2P_CATEGORY
@@ -0,0 +1,150 @@
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+import schemas
+from loader import upsert_frame
+
+# ==============================================================================
+# Feature mart theo khách hàng (CRM), cập nhật tăng dần
+# ==============================================================================
+# Mỗi khách hàng giữ 1 trạng thái cộng dồn được (First/Last Date_Key, số giao dịch, tổng chi,
+# phần chi ở nước ngoài) + 1 dòng cho mỗi hạng mục đã chi. Sau mỗi lần nạp Fact, chỉ các dòng
+# Fact MỚI (Transaction_Key > Mart_Watermark) được đọc theo khối, groupby bằng pandas rồi GỘP
+# vào trạng thái đã lưu (tổng: cộng dồn, ngày đầu / cuối: MIN / MAX) -> chi phí tỉ lệ với số
+# giao dịch mới, không quét lại toàn bộ Fact_Spending.
+#
+# Recency (số ngày từ giao dịch gần nhất), tỉ lệ chi nước ngoài, cơ cấu hạng mục và nhóm tuổi
+# phụ thuộc thời điểm đọc nên không lưu mà tính trong read_features().
+
+WATERMARK_TABLE = 'Mart_Watermark'
+FEATURES_TABLE = 'Mart_Customer_Features'
+CATEGORY_TABLE = 'Mart_Customer_Category'
+
+FOREIGN_REGION = 'Nước ngoài'
+
+# Số dòng Fact đọc mỗi khối khi tính phần chênh lệch
+CHUNK_SIZE = 500_000
+
+# Cách gộp từng cột: giữa các khối của 1 lần chạy (pandas) và với trạng thái đã lưu (MERGE / ON CONFLICT)
+FEATURES = {
+    'First_Date_Key': 'min', 'Last_Date_Key': 'max', 'Transaction_Count': 'sum',
+    'Total_Spent': 'sum', 'Foreign_Count': 'sum', 'Foreign_Spent': 'sum',
+}
+CATEGORY_FEATURES = {'Transaction_Count': 'sum', 'Total_Spent': 'sum'}
+
+DELTA_SQL = f"""
+SELECT f.Customer_Key, f.Date_Key, f.Transaction_Count,
+       CAST(ROUND(f.Amount_Spent * {schemas.AMOUNT_SCALE}, 0) AS BIGINT) AS Amount_Spent,
+       m.Category, l.Transaction_Region
+FROM Fact_Spending f
+JOIN Dim_Merchant m ON f.Merchant_Key = m.Merchant_Key
+JOIN Dim_Location l ON f.Location_Key = l.Location_Key
+WHERE f.Transaction_Key > :last_key AND f.Transaction_Key <= :max_key
+"""
+
+DELTA_DTYPES = {
+    'Customer_Key': 'int32', 'Date_Key': 'int32', 'Transaction_Count': 'Int32', 'Amount_Spent': 'Int64',
+    'Category': 'category', 'Transaction_Region': 'category',
+}
+
+# Nhóm tuổi theo số năm tròn (số ngày // 365): <18, 18-24, 25-34, 35-50, >50
+AGE_BINS = [-np.inf, 17, 24, 34, 50, np.inf]
+AGE_LABELS = ['< 18', '18-24 (Sinh viên)', '25-34 (Người đi làm)', '35-50 (Trung niên)', '> 50 (Cao tuổi)']
+
+
+def age_groups(birth_dates, now):
+    # Series ngày sinh -> Series category nhóm tuổi (pd.cut cho cả cột thay vì apply từng dòng)
+    age = (now - birth_dates).dt.days // 365
+    groups = pd.cut(age, AGE_BINS, labels=AGE_LABELS)
+    # Không có ngày sinh -> nhóm cuối (giống cách phân nhóm từng dòng trước đây)
+    return groups.fillna(AGE_LABELS[-1])
+
+
+def available(engine):
+    # Kho tạo bằng schema.sql cũ (chưa có mục 2.5) -> không có feature mart
+    return sqlalchemy.inspect(engine).has_table(WATERMARK_TABLE)
+
+
+def summarize(df):
+    # 1 khối dòng Fact -> (đặc trưng theo khách hàng, theo khách hàng x hạng mục)
+    foreign = (df['Transaction_Region'] == FOREIGN_REGION).to_numpy()
+    df = df.assign(First_Date_Key=df['Date_Key'], Last_Date_Key=df['Date_Key'],
+                   Total_Spent=df['Amount_Spent'],
+                   Foreign_Count=df['Transaction_Count'].where(foreign, 0),
+                   Foreign_Spent=df['Amount_Spent'].where(foreign, 0))
+    customers = df.groupby('Customer_Key', sort=False).agg(FEATURES)
+    categories = df.groupby(['Customer_Key', 'Category'], sort=False, observed=True).agg(CATEGORY_FEATURES)
+    return customers, categories
+
+
+def combine(parts, rules):
+    # Gộp kết quả của nhiều khối theo đúng luật gộp với trạng thái đã lưu
+    df = pd.concat(parts)
+    return df.groupby(level=list(df.index.names), sort=False, observed=True).agg(rules).reset_index()
+
+
+def refresh_features(engine, rebuild=False):
+    # Gộp các dòng Fact mới vào feature mart, trả về (Key cũ, Key mới, số khách hàng được cập nhật).
+    # Tất cả trong 1 transaction: lỗi giữa chừng thì không khách hàng nào bị cộng thiếu / cộng 2 lần.
+    with engine.begin() as conn:
+        if rebuild:
+            for table_name in (FEATURES_TABLE, CATEGORY_TABLE):
+                conn.execute(sqlalchemy.text(f"DELETE FROM {table_name}"))
+            conn.execute(sqlalchemy.text(f"UPDATE {WATERMARK_TABLE} SET Last_Transaction_Key = 0"))
+
+        last_key = int(conn.execute(sqlalchemy.text(
+            f"SELECT MAX(Last_Transaction_Key) FROM {WATERMARK_TABLE}")).scalar() or 0)
+        max_key = conn.execute(sqlalchemy.text("SELECT MAX(Transaction_Key) FROM Fact_Spending")).scalar()
+        if max_key is None or int(max_key) <= last_key:
+            return last_key, last_key, 0
+        max_key = int(max_key)
+        params = {'last_key': last_key, 'max_key': max_key}
+
+        customer_parts, category_parts = [], []
+        for chunk in pd.read_sql(sqlalchemy.text(DELTA_SQL), conn, params=params, chunksize=CHUNK_SIZE,
+                                 dtype=DELTA_DTYPES):
+            customers, categories = summarize(chunk)
+            customer_parts.append(customers)
+            category_parts.append(categories)
+
+        updated = 0
+        if customer_parts:
+            df_customers = combine(customer_parts, FEATURES)
+            updated = len(df_customers)
+            upsert_frame(conn, df_customers, FEATURES_TABLE, ['Customer_Key'], accumulate=FEATURES)
+            upsert_frame(conn, combine(category_parts, CATEGORY_FEATURES), CATEGORY_TABLE,
+                         ['Customer_Key', 'Category'], accumulate=CATEGORY_FEATURES)
+
+        conn.execute(sqlalchemy.text(f"UPDATE {WATERMARK_TABLE} SET Last_Transaction_Key = :max_key"), params)
+    return last_key, max_key, updated
+
+
+def read_features(engine, now=None):
+    # Bảng đặc trưng 1 dòng / khách hàng cho CRM / Data Mining:
+    # Recency_Days, Frequency, Monetary (đồng), Foreign_Share, Age_Group, Share_<hạng mục>
+    now = pd.Timestamp.now() if now is None else pd.Timestamp(now)
+    with engine.connect() as conn:
+        df = pd.read_sql(sqlalchemy.text(
+            f"SELECT m.*, c.BirthDate FROM {FEATURES_TABLE} m "
+            f"JOIN Dim_Customer c ON m.Customer_Key = c.Customer_Key"), conn, parse_dates=['BirthDate'])
+        df_category = pd.read_sql(sqlalchemy.text(
+            f"SELECT Customer_Key, Category, Total_Spent FROM {CATEGORY_TABLE}"), conn)
+
+    last_date = pd.to_datetime(df['Last_Date_Key'].astype('int64').astype(str), format='%Y%m%d%H')
+    total = df['Total_Spent'].astype('float64')
+    features = pd.DataFrame({
+        'Customer_Key': df['Customer_Key'],
+        'Recency_Days': (now - last_date).dt.days,
+        'Frequency': df['Transaction_Count'],
+        'Monetary': total,
+        'Foreign_Share': (df['Foreign_Spent'].astype('float64') / total.where(total != 0)).fillna(0.0),
+        'Age_Group': age_groups(df['BirthDate'], now),
+    })
+
+    # Cơ cấu hạng mục: tỉ lệ chi tiêu của từng hạng mục trên tổng chi của khách hàng
+    mix = df_category.pivot_table(index='Customer_Key', columns='Category', values='Total_Spent',
+                                  aggfunc='sum', fill_value=0).astype('float64')
+    mix = mix.div(mix.sum(axis=1).replace(0, np.nan), axis=0).fillna(0.0).add_prefix('Share_')
+    return features.merge(mix, left_on='Customer_Key', right_index=True, how='left').fillna(
+        {col: 0.0 for col in mix.columns})
@@ -1,9 +1,36 @@
+import argparse
+import contextlib
+import io
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
 import pandas as pd
 import sqlalchemy
-import pyodbc
 import sys
 import urllib.parse
 
+try:
+    import pyodbc
+    DRIVER_ERRORS = (pyodbc.Error,)
+except ImportError:  # Chỉ cần cho backend SQL Server
+    DRIVER_ERRORS = ()
+
+import aggregates
+import backends
+from calendar_dim import CALENDAR_START, CALENDAR_END, build_dim_date, date_key
+from categorizer import CategoryEngine
+import customer_features
+import fact_loader
+import instrumentation
+from key_resolver import KeyResolver, MISSING_KEY
+from keymap import KeyStore, DEFAULT_KEYMAP_FILE
+from loader import bulk_upsert
+import schemas
+from sources import ParallelSqlSource, SqlSource
+import snapshot_cache
+import watermark
+
 # ==============================================================================
 # Thông tin kết nối
 # ==============================================================================
@@ -11,11 +38,17 @@ DRIVER = '{ODBC Driver 18 for SQL Server}'
 SERVER_NAME = 'localhost'
 DATABASE_NAME = 'DW_Bank'
 USERNAME = 'sa'
-PASSWORD = 'yourpass' 
+PASSWORD = 'yourpass'
 
-print("Đang bắt đầu quá trình ETL...")
+# (Hãy đảm bảo file 'tbl_MCC_Mapping.csv' nằm CÙNG THƯ MỤC với file 'etl.py' này)
+CSV_PATH = 'tbl_MCC_Mapping.csv'
+
+
+def create_engine(pool_size=5, backend='mssql', database=None):
+    if backend != 'mssql':
+        # Engine nhúng SQLite / DuckDB (file cục bộ, không cần SQL Server)
+        return backends.create_embedded_engine(backend, database)
 
-try:
     # 1. Tạo chuỗi kết nối (Connection String) chuẩn của pyodbc
     connection_string = (
         f"DRIVER={DRIVER};"
@@ -25,154 +58,138 @@ try:
         f"PWD={PASSWORD};"
         f"Encrypt=no;"
     )
-    
+
     # 2. Mã hóa (quote) chuỗi này để SQLAlchemy hiểu
     quoted_connection_string = urllib.parse.quote_plus(connection_string)
-    
+
     # 3. Tạo 'engine' của SQLAlchemy bằng cách sử dụng chuỗi đã mã hóa
-    engine = sqlalchemy.create_engine(
+    # pool_size: số connection giữ sẵn để các luồng Extract đọc song song
+    return sqlalchemy.create_engine(
         f"mssql+pyodbc:///?odbc_connect={quoted_connection_string}",
-        fast_executemany=True
+        fast_executemany=True,
+        pool_size=pool_size
     )
 
-    # ==============================================================================
-    # BƯỚC 1: EXTRACT (Trích xuất)
-    # ==============================================================================
-    
-    # Kết nối thử
-    with engine.connect() as conn:
-        print("Kết nối SQL Server (qua SQLAlchemy) thành công!")
-
-        # --- 1. Đọc 3 bảng từ SQL Server ---
-        print("Đang trích xuất (Extract) dữ liệu từ SQL Server...")
-        df_customers = pd.read_sql("SELECT * FROM tbl_Customers", conn)
-        df_accounts = pd.read_sql("SELECT * FROM tbl_Accounts", conn)
-        df_transactions = pd.read_sql("SELECT * FROM tbl_Transactions", conn)
-    
-    # --- 2. Đọc 1 file từ CSV ---
-    print("Đang trích xuất (Extract) dữ liệu từ file CSV...")
-    # (Hãy đảm bảo file 'tbl_MCC_Mapping.csv' nằm CÙNG THƯ MỤC với file 'etl.py' này)
-    csv_path = 'tbl_MCC_Mapping.csv'
-    df_mcc_mapping = pd.read_csv(csv_path)
+
+# ==============================================================================
+# BƯỚC 1: EXTRACT (Trích xuất)
+# ==============================================================================
+
+def extract_full(source):
+    print("Đang trích xuất (Extract) dữ liệu từ SQL Server...")
+    # Khách hàng, tài khoản và hash được đọc đồng thời nếu nguồn hỗ trợ (--workers)
+    df_customers, df_accounts, (cust_hashes, acc_hashes) = source.fetch_all(
+        source.customers, source.accounts, source.row_hashes)
+
+    # Mọi dòng nguồn đều được kiểm tra (ID lấy từ hash: ở chế độ push-down df chỉ còn dòng hợp lệ)
+    changes = {
+        'customer_ids': set(cust_hashes['CustomerID'].astype(int).tolist()),
+        'account_ids': set(acc_hashes['AccountID'].astype(int).tolist()),
+        'customer_hashes': cust_hashes,
+        'account_hashes': acc_hashes,
+    }
+    return df_customers, df_accounts, changes
+
+
+def extract_incremental(source, state):
+    last_id = state['last_transaction_id']
+    print(f"Đang trích xuất phần thay đổi (TransactionID > {last_id})...")
+
+    # --- 1. Phát hiện Khách hàng / Tài khoản mới hoặc bị sửa ---
+    cust_hashes, acc_hashes = source.row_hashes()
+    changed_cust = watermark.changed_ids(cust_hashes, 'CustomerID', state['customer_hashes'])
+    changed_acc = watermark.changed_ids(acc_hashes, 'AccountID', state['account_hashes'])
+    print(f"   - Phát hiện {len(changed_cust)} khách hàng và {len(changed_acc)} tài khoản mới/thay đổi.")
+
+    # --- 2. Đọc đủ dữ liệu để kiểm tra logic cho phần thay đổi ---
+    # Tài khoản: được giao dịch mới tham chiếu (lọc ngay trên server) + thay đổi + thuộc khách hàng thay đổi
+    df_accounts = pd.concat(source.fetch_all(
+        lambda: source.accounts_for_delta(last_id),
+        lambda: source.read_by_ids('tbl_Accounts', 'AccountID', changed_acc),
+        lambda: source.read_by_ids('tbl_Accounts', 'CustomerID', changed_cust),
+    ), ignore_index=True).drop_duplicates(subset=['AccountID'])
+
+    # Khách hàng: thay đổi + chủ của các tài khoản ở trên
+    cust_ids = changed_cust | set(df_accounts['CustomerID'].dropna().astype(int).tolist())
+    df_customers = source.read_by_ids('tbl_Customers', 'CustomerID', cust_ids)
+
+    changes = {
+        'customer_ids': changed_cust,
+        'account_ids': changed_acc,
+        'customer_hashes': cust_hashes,
+        'account_hashes': acc_hashes,
+    }
+    return df_customers, df_accounts, changes
+
+
+def report_pushdown_rejections(stage_name, rejected):
+    # Push-down: dòng lỗi đã bị loại ngay trên server -> ghi nhận số dòng vào đúng bước / luật
+    # như khi lọc bằng pandas (metrics log, Prometheus và bảng tổng kết không đổi)
+    with instrumentation.stage(stage_name, pushdown=True) as s:
+        for rule, rows in rejected.items():
+            s.reject(rule, rows)
+            print(f"   - (Push-down) Đã loại {rows} dòng trên server: {rule}")
+
+
+def has_new_transactions(source, state):
+    max_id = source.max_transaction_id()
+    return max_id is not None and max_id > state['last_transaction_id']
+
+
+def extract(source, state, full_refresh):
+    try:
+        with instrumentation.stage('extract_customers_accounts') as s:
+            if full_refresh:
+                df_customers, df_accounts, changes = extract_full(source)
+            else:
+                df_customers, df_accounts, changes = extract_incremental(source, state)
+            s.rows_out = len(df_customers) + len(df_accounts)
+
+        # Push-down chỉ lọc khi đọc cả bảng; phần thay đổi (incremental) nhỏ nên vẫn lọc bằng pandas
+        if full_refresh and source.pushdown:
+            report_pushdown_rejections('clean_customers_accounts', source.rejected_customers_accounts())
+
+        # --- 2. Đọc 1 file từ CSV ---
+        print("Đang trích xuất (Extract) dữ liệu từ file CSV...")
+        with instrumentation.stage('extract_mcc_mapping') as s:
+            df_mcc_mapping = source.mcc_mapping(CSV_PATH)
+            s.rows_out = len(df_mcc_mapping)
+
+    except DRIVER_ERRORS as ex:
+        print("\n*** ĐÃ XẢY RA LỖI PYODBC ***")
+        print("Lỗi này thường là do sai thông tin đăng nhập hoặc driver.")
+        sqlstate = ex.args[0]
+        if sqlstate == '28000':
+            print("Lỗi [28000]: Login failed! (SAI USERNAME HOẶC PASSWORD)")
+        else:
+            print(ex)
+        sys.exit(1)
+
+    except FileNotFoundError:
+        print(f"\n*** LỖI: Không tìm thấy file '{CSV_PATH}' ***")
+        print("Hãy đảm bảo file 'tbl_MCC_Mapping.csv' nằm CÙNG THƯ MỤC với file 'etl.py'.")
+        sys.exit(1)
+
+    except Exception as e:
+        print("\n*** ĐÃ XẢY RA LỖI KHÁC ***")
+        print(e)
+        sys.exit(1)
 
     # --- In kết quả để kiểm tra ---
     print("\n--- Trích xuất thành công! ---")
     print(f"Đã tải {len(df_customers)} khách hàng.")
     print(f"Đã tải {len(df_accounts)} tài khoản.")
-    print(f"Đã tải {len(df_transactions)} giao dịch.")
     print(f"Đã tải {len(df_mcc_mapping)} quy tắc mapping.")
 
     print("\n--- 5 dòng đầu tbl_Customers: ---")
     print(df_customers.head())
 
-except pyodbc.Error as ex:
-    print("\n*** ĐÃ XẢY RA LỖI PYODBC ***")
-    print("Lỗi này thường là do sai thông tin đăng nhập hoặc driver.")
-    sqlstate = ex.args[0]
-    if sqlstate == '28000':
-        print("Lỗi [28000]: Login failed! (SAI USERNAME HOẶC PASSWORD)")
-    else:
-        print(ex)
-
-except FileNotFoundError:
-    print(f"\n*** LỖI: Không tìm thấy file '{csv_path}' ***")
-    print("Hãy đảm bảo file 'tbl_MCC_Mapping.csv' nằm CÙNG THƯ MỤC với file 'etl.py'.")
-    
-except Exception as e:
-    print("\n*** ĐÃ XẢY RA LỖI KHÁC ***")
-    print(e)
-    sys.exit(1)
+    return df_customers, df_accounts, df_mcc_mapping, changes
 
 
 # ==============================================================================
 # BƯỚC 2: TRANSFORM
 # ==============================================================================
-print("\nBắt đầu Bước 2: Transform...")
-print("\n--- Đang xử lý dữ liệu (Transform)... ---")
-
-# 1. CHUẨN HÓA KIỂU DỮ LIỆU (Để so sánh ngày tháng được)
-# ------------------------------------------------------------------------------
-print("1. Chuẩn hóa định dạng ngày tháng...")
-df_customers['BirthDate'] = pd.to_datetime(df_customers['BirthDate'])
-df_accounts['OpenDate'] = pd.to_datetime(df_accounts['OpenDate'])
-df_transactions['TransactionTimestamp'] = pd.to_datetime(df_transactions['TransactionTimestamp'])
-
-# 2. LÀM SẠCH DỮ LIỆU (Data Cleaning) - Xử lý các lỗi logic
-# ------------------------------------------------------------------------------
-print("2. Lọc bỏ dữ liệu lỗi logic (Cleaning)...")
-
-# A. Kiểm tra Logic: Ngày mở TK phải > Ngày sinh
-df_acc_cust = pd.merge(df_accounts, df_customers[['CustomerID', 'BirthDate']], on='CustomerID', how='inner')
-valid_accounts_mask = df_acc_cust['OpenDate'] > df_acc_cust['BirthDate']
-
-# Chỉ giữ lại các tài khoản hợp lệ
-df_accounts_clean = df_acc_cust[valid_accounts_mask].copy()
-df_accounts_clean = df_accounts_clean[['AccountID', 'CustomerID', 'AccountType', 'OpenDate']]
-
-print(f"   - Đã loại bỏ {len(df_accounts) - len(df_accounts_clean)} tài khoản lỗi (Mở trước khi sinh).")
-print(f"   - Số tài khoản hợp lệ còn lại: {len(df_accounts_clean)}")
-
-# B. Lọc bỏ Khách hàng không có tài khoản
-# Chỉ giữ lại những CustomerID nào CÓ XUẤT HIỆN trong danh sách tài khoản sạch
-sl_khach_truoc = len(df_customers)
-df_customers = df_customers[df_customers['CustomerID'].isin(df_accounts_clean['CustomerID'])]
-
-print(f"   - Đã loại bỏ {sl_khach_truoc - len(df_customers)} khách hàng 'vô chủ' (Không có tài khoản hợp lệ).")
-print(f"   - Số khách hàng còn lại để nạp vào kho: {len(df_customers)}")
-
-# C. Kiểm tra Logic: Giao dịch phải xảy ra SAU ngày mở TK
-df_trans_acc = pd.merge(df_transactions, df_accounts_clean[['AccountID', 'OpenDate']], on='AccountID', how='inner')
-valid_trans_mask = df_trans_acc['TransactionTimestamp'] >= df_trans_acc['OpenDate']
-
-# Chỉ giữ lại các giao dịch hợp lệ
-df_transactions_clean = df_trans_acc[valid_trans_mask].copy()
-# Giữ lại đủ cột (bao gồm cả P2P)
-df_transactions_clean = df_transactions_clean[[
-    'TransactionID', 'AccountID', 'MerchantName', 'Amount', 
-    'TransactionTimestamp', 'TransactionCountry',
-    'BeneficiaryName', 'TransactionDescription'
-]]
-
-print(f"   - Đã loại bỏ {len(df_transactions) - len(df_transactions_clean)} giao dịch lỗi logic.")
-
-
-# 3. CHUẨN BỊ DỮ LIỆU CHO CÁC BẢNG DIMENSION (Enrichment)
-# ------------------------------------------------------------------------------
-print("3. Tính toán và chuẩn bị dữ liệu cho Star Schema...")
-
-# --- A. Chuẩn bị Dim_Customer ---
-# Logic: Tính Tuổi và Nhóm Tuổi
-now = pd.Timestamp.now()
-df_customers['Age'] = (now - df_customers['BirthDate']).dt.days // 365
-
-def get_age_group(age):
-    if age < 18: return '< 18'
-    elif 18 <= age <= 24: return '18-24 (Sinh viên)'
-    elif 25 <= age <= 34: return '25-34 (Người đi làm)'
-    elif 35 <= age <= 50: return '35-50 (Trung niên)'
-    else: return '> 50 (Cao tuổi)'
-
-df_customers['Age_Group'] = df_customers['Age'].apply(get_age_group)
-
-# Tạo DataFrame cho Dim_Customer
-
-df_dim_customer_upload = df_customers[['CustomerID', 'FirstName', 'LastName', 'Age_Group', 'Gender', 'City', 'Country', 'BirthDate']].copy()
-
-df_dim_customer_upload.columns = ['CustomerID_Source', 'FirstName', 'LastName', 'Age_Group', 'Gender', 'City', 'Country', 'BirthDate']
-
-df_dim_customer_upload['CustomerName'] = df_dim_customer_upload['FirstName'] + ' ' + df_dim_customer_upload['LastName']
-
-df_dim_customer_upload = df_dim_customer_upload[['CustomerID_Source', 'CustomerName', 'Age_Group', 'Gender', 'City', 'Country', 'BirthDate']]
-
-# --- B. Chuẩn bị Dim_Account ---
-df_dim_account_upload = df_accounts_clean[['AccountID', 'AccountType', 'OpenDate']].copy()
-df_dim_account_upload.columns = ['AccountID_Source', 'Account_Type', 'Account_Open_Date']
-
-
-# --- C. Chuẩn bị Dim_Location ---
-# Lấy danh sách duy nhất các quốc gia từ giao dịch
-unique_locations = df_transactions_clean[['TransactionCountry']].drop_duplicates().copy()
-unique_locations.columns = ['Transaction_Country']
 
 # Xác định Trong nước / Nước ngoài
 def get_region(country):
@@ -180,213 +197,677 @@ def get_region(country):
         return 'Trong nước'
     return 'Nước ngoài'
 
-unique_locations['Transaction_Region'] = unique_locations['Transaction_Country'].apply(get_region)
-df_dim_location_upload = unique_locations
-
-
-# D. Chuẩn bị Dim_Merchant (Nâng cấp xử lý P2P)
-print("   -> Đang xử lý Dim_Merchant (Gộp Merchant và P2P)...")
-
-# 1. Tạo bản sao để xử lý
-df_merch = df_transactions_clean.copy()
-
-# 2. Gộp tên: Nếu MerchantName rỗng (P2P) thì lấy tên Người nhận (BeneficiaryName)
-df_merch['Final_Name'] = df_merch['MerchantName'].fillna(df_merch['BeneficiaryName'])
-
-# 3. Hàm đoán Category từ nội dung
-def get_category(row):
-    # A. Ưu tiên 1: Nếu có MerchantName -> Tra từ điển CSV
-    if pd.notna(row['MerchantName']):
-        # Tìm trong df_mcc_mapping
-        match = df_mcc_mapping[df_mcc_mapping['MerchantName'] == row['MerchantName']]
-        if not match.empty:
-            return match.iloc[0]['Category']
-    
-    # B. Ưu tiên 2: Nếu là P2P -> Phân tích nội dung Description
-    desc = str(row['TransactionDescription']).lower()
-    
-    if any(x in desc for x in ['an', 'com', 'pho', 'bun', 'cafe', 'nuoc', 'tra sua', 'nhau']):
-        return 'Ăn uống & Cà phê'
-    elif any(x in desc for x in ['mua', 'shop', 'quan', 'ao', 'giay', 'tui', 'my pham', 'son', 'vay']):
-        return 'Mua sắm'
-    elif any(x in desc for x in ['xe', 'grab', 'xang', 'ship', 'taxi', 'di lai']):
-        return 'Di chuyển & Vận tải'
-    elif any(x in desc for x in ['dien', 'mang', 'wifi', 'nha', 'hoc', 'nuoc', 'phi', 'internet']):
-        return 'Hóa đơn & Dịch vụ'
-    elif any(x in desc for x in ['phim', 'du lich', 've', 'spa', 'game', 'homestay', 'karaoke']):
-        return 'Giải trí & Du lịch'
-    elif any(x in desc for x in ['tap hoa', 'rau', 'qua', 'gao', 'sieu thi', 'banh', 'keo']):
-        return 'Tạp hóa & Siêu thị'
-    else:
-        return 'Chuyển khoản khác'
 
-# Áp dụng hàm vào từng dòng
-df_merch['Category_Final'] = df_merch.apply(get_category, axis=1)
+def clean_customers_accounts(df_customers, df_accounts):
+    # 1. CHUẨN HÓA KIỂU DỮ LIỆU (Để so sánh ngày tháng được)
+    # ------------------------------------------------------------------------------
+    print("1. Chuẩn hóa định dạng ngày tháng...")
+    df_customers['BirthDate'] = pd.to_datetime(df_customers['BirthDate'])
+    df_accounts['OpenDate'] = pd.to_datetime(df_accounts['OpenDate'])
 
-# 4. Tạo DataFrame cho Dim_Merchant
-# Lấy danh sách duy nhất các cặp (Tên, Category)
-df_dim_merchant_upload = df_merch[['Final_Name', 'Category_Final']].drop_duplicates(subset=['Final_Name'])
-df_dim_merchant_upload.columns = ['MerchantName_Source', 'Category']
+    # 2. LÀM SẠCH DỮ LIỆU (Data Cleaning) - Xử lý các lỗi logic
+    # ------------------------------------------------------------------------------
+    print("2. Lọc bỏ dữ liệu lỗi logic (Cleaning)...")
 
+    # A. Kiểm tra Logic: Ngày mở TK phải > Ngày sinh
+    df_acc_cust = pd.merge(df_accounts, df_customers[['CustomerID', 'BirthDate']], on='CustomerID', how='inner')
+    valid_accounts_mask = df_acc_cust['OpenDate'] > df_acc_cust['BirthDate']
+    instrumentation.reject('account_unknown_customer', len(df_accounts) - len(df_acc_cust))
+    instrumentation.reject('account_opened_before_birth', (~valid_accounts_mask).sum())
 
-# --- E. Chuẩn bị Dim_Date ---
-# Lấy tất cả các mốc thời gian duy nhất (theo giờ)
-temp_dates = df_transactions_clean[['TransactionTimestamp']].copy()
-# Làm tròn về giờ
-temp_dates['Full_Date'] = temp_dates['TransactionTimestamp'].dt.date
-temp_dates['Hour_Of_Day'] = temp_dates['TransactionTimestamp'].dt.hour
+    # Chỉ giữ lại các tài khoản hợp lệ
+    df_accounts_clean = df_acc_cust.loc[valid_accounts_mask, ['AccountID', 'CustomerID', 'AccountType', 'OpenDate']]
 
-# Lấy danh sách ngày+giờ duy nhất
-unique_dates = temp_dates[['TransactionTimestamp', 'Full_Date', 'Hour_Of_Day']].drop_duplicates()
+    print(f"   - Đã loại bỏ {len(df_accounts) - len(df_accounts_clean)} tài khoản lỗi (Mở trước khi sinh).")
+    print(f"   - Số tài khoản hợp lệ còn lại: {len(df_accounts_clean)}")
 
-# Tính toán các thuộc tính ngày tháng
-unique_dates['Day_Of_Week'] = unique_dates['TransactionTimestamp'].dt.dayofweek + 2
-# Lưu ý: Nếu CN thì dayofweek=6 -> +2 = 8. Cần xử lý nếu muốn CN=1. 
-# Thường VN: T2=2, ..., T7=7, CN=8. Code trên ra T2=2, CN=8. OK.
+    # B. Lọc bỏ Khách hàng không có tài khoản
+    # Chỉ giữ lại những CustomerID nào CÓ XUẤT HIỆN trong danh sách tài khoản sạch
+    sl_khach_truoc = len(df_customers)
+    df_customers = df_customers[df_customers['CustomerID'].isin(df_accounts_clean['CustomerID'])].copy()
+    instrumentation.reject('customer_without_valid_account', sl_khach_truoc - len(df_customers))
 
-# Tên thứ
-days = {2: 'Thứ Hai', 3: 'Thứ Ba', 4: 'Thứ Tư', 5: 'Thứ Năm', 6: 'Thứ Sáu', 7: 'Thứ Bảy', 8: 'Chủ Nhật'}
-unique_dates['Day_Name'] = unique_dates['Day_Of_Week'].map(days)
+    print(f"   - Đã loại bỏ {sl_khach_truoc - len(df_customers)} khách hàng 'vô chủ' (Không có tài khoản hợp lệ).")
+    print(f"   - Số khách hàng còn lại để nạp vào kho: {len(df_customers)}")
+    return df_customers, df_accounts_clean
 
-# Cuối tuần (T7, CN)
-unique_dates['Is_Weekend'] = unique_dates['Day_Of_Week'].isin([7, 8])
 
-unique_dates['Month'] = unique_dates['TransactionTimestamp'].dt.month
-unique_dates['Month_Name'] = 'Tháng ' + unique_dates['Month'].astype(str)
-unique_dates['Quarter'] = unique_dates['TransactionTimestamp'].dt.quarter
-unique_dates['Year'] = unique_dates['TransactionTimestamp'].dt.year
+def prepare_customer_account_dims(df_customers, df_accounts_clean):
+    # 3. CHUẨN BỊ DỮ LIỆU CHO CÁC BẢNG DIMENSION (Enrichment)
+    # ------------------------------------------------------------------------------
+    print("3. Tính toán và chuẩn bị dữ liệu cho Star Schema...")
 
-# TẠO DATE_KEY
-# Quy tắc: yyyyMMddHH (ví dụ: 2025110614) -> INT
-unique_dates['Date_Key'] = (
-    unique_dates['Year'].astype(str) + 
-    unique_dates['Month'].astype(str).str.zfill(2) + 
-    unique_dates['TransactionTimestamp'].dt.day.astype(str).str.zfill(2) + 
-    unique_dates['Hour_Of_Day'].astype(str).str.zfill(2)
-).astype(int)
+    # --- A. Chuẩn bị Dim_Customer ---
+    # Logic: Nhóm Tuổi theo số năm tròn tính từ ngày sinh
+    df_customers['Age_Group'] = customer_features.age_groups(df_customers['BirthDate'], pd.Timestamp.now())
+
+    # Tạo DataFrame cho Dim_Customer
+    df_dim_customer_upload = df_customers[['CustomerID', 'FirstName', 'LastName', 'Age_Group', 'Gender', 'City', 'Country', 'BirthDate']].copy()
+
+    df_dim_customer_upload.columns = ['CustomerID_Source', 'FirstName', 'LastName', 'Age_Group', 'Gender', 'City', 'Country', 'BirthDate']
+
+    df_dim_customer_upload['CustomerName'] = df_dim_customer_upload['FirstName'] + ' ' + df_dim_customer_upload['LastName']
+
+    df_dim_customer_upload = df_dim_customer_upload[['CustomerID_Source', 'CustomerName', 'Age_Group', 'Gender', 'City', 'Country', 'BirthDate']]
+
+    # --- B. Chuẩn bị Dim_Account ---
+    df_dim_account_upload = df_accounts_clean[['AccountID', 'AccountType', 'OpenDate']].copy()
+    df_dim_account_upload.columns = ['AccountID_Source', 'Account_Type', 'Account_Open_Date']
+
+    print(f"   -> Dim_Customer: {len(df_dim_customer_upload)} dòng")
+    print(f"   -> Dim_Account:  {len(df_dim_account_upload)} dòng")
+
+    return {
+        'Dim_Customer': schemas.apply(df_dim_customer_upload, 'Dim_Customer'),
+        'Dim_Account': schemas.apply(df_dim_account_upload, 'Dim_Account'),
+    }
+
+
+def transform_customers_accounts(df_customers, df_accounts):
+    # Làm sạch Khách hàng / Tài khoản (bảng nhỏ, giữ nguyên trong bộ nhớ suốt quá trình)
+    print("\nBắt đầu Bước 2: Transform...")
+    print("\n--- Đang xử lý dữ liệu (Transform)... ---")
+    with instrumentation.stage('clean_customers_accounts', rows_in=len(df_customers) + len(df_accounts)) as s:
+        df_customers, df_accounts_clean = clean_customers_accounts(df_customers, df_accounts)
+        s.rows_out = len(df_customers) + len(df_accounts_clean)
+    with instrumentation.stage('prepare_customer_account_dims', rows_in=s.rows_out) as s:
+        dims = prepare_customer_account_dims(df_customers, df_accounts_clean)
+        s.rows_out = len(dims['Dim_Customer']) + len(dims['Dim_Account'])
+    return dims, df_accounts_clean
+
+
+def clean_transactions(df_transactions, df_accounts_clean):
+    df_transactions['TransactionTimestamp'] = pd.to_datetime(df_transactions['TransactionTimestamp'])
+
+    # C. Kiểm tra Logic: Giao dịch phải xảy ra SAU ngày mở TK
+    df_trans_acc = pd.merge(df_transactions, df_accounts_clean[['AccountID', 'OpenDate']], on='AccountID', how='inner')
+    valid_trans_mask = df_trans_acc['TransactionTimestamp'] >= df_trans_acc['OpenDate']
+    # Giao dịch của tài khoản không tồn tại / đã bị loại cũng bị bỏ qua (inner join)
+    instrumentation.reject('transaction_unknown_account', len(df_transactions) - len(df_trans_acc))
+    instrumentation.reject('transaction_before_account_open', (~valid_trans_mask).sum())
+
+    # Chỉ giữ lại các giao dịch hợp lệ (đủ cột, bao gồm cả P2P)
+    df_transactions_clean = df_trans_acc.loc[valid_trans_mask, [
+        'TransactionID', 'AccountID', 'MerchantName', 'Amount',
+        'TransactionTimestamp', 'TransactionCountry',
+        'BeneficiaryName', 'TransactionDescription'
+    ]]
+
+    print(f"   - Đã loại bỏ {len(df_transactions) - len(df_transactions_clean)} giao dịch lỗi logic.")
+    return df_transactions_clean
+
+
+def prepare_location_dim(df_transactions_clean):
+    # --- C. Chuẩn bị Dim_Location ---
+    # Lấy danh sách duy nhất các quốc gia từ giao dịch
+    unique_locations = df_transactions_clean[['TransactionCountry']].drop_duplicates()
+    unique_locations.columns = ['Transaction_Country']
+    unique_locations['Transaction_Country'] = unique_locations['Transaction_Country'].astype(object)
+    unique_locations['Transaction_Region'] = unique_locations['Transaction_Country'].apply(get_region)
+    return schemas.apply(unique_locations, 'Dim_Location')
+
+
+def merchant_names(df_transactions):
+    # Tên Merchant cuối cùng: nếu MerchantName rỗng (P2P) thì lấy tên Người nhận (BeneficiaryName).
+    # MerchantName là category -> đổi về object trước khi điền tên người nhận (không có trong category)
+    return df_transactions['MerchantName'].astype(object).fillna(df_transactions['BeneficiaryName'])
+
+
+def prepare_merchant_dim(df_transactions_clean, category_engine, category=None):
+    # D. Chuẩn bị Dim_Merchant (Nâng cấp xử lý P2P)
+    # 1. Gộp tên: Nếu MerchantName rỗng (P2P) thì lấy tên Người nhận (BeneficiaryName)
+    final_name = merchant_names(df_transactions_clean)
+
+    # 2. Đoán Category theo cột (POS: tra từ điển CSV, P2P: phân tích Description)
+    # Bộ phân loại được biên dịch 1 lần, thay cho df_merch.apply(get_category, axis=1)
+    # (category: đã phân loại sẵn trong các tiến trình con khi transform song song)
+    if category is None:
+        category = category_engine.categorize(df_transactions_clean)
+
+    # 3. Tạo DataFrame cho Dim_Merchant
+    # Lấy danh sách duy nhất các cặp (Tên, Category)
+    df_dim_merchant_upload = pd.DataFrame({'MerchantName_Source': final_name, 'Category': category})
+    return schemas.apply(df_dim_merchant_upload.drop_duplicates(subset=['MerchantName_Source']), 'Dim_Merchant')
 
-df_dim_date_upload = unique_dates.drop(columns=['TransactionTimestamp'])
-# Loại bỏ trùng lặp
-df_dim_date_upload = df_dim_date_upload.drop_duplicates(subset=['Date_Key'])
 
+def transform_transactions(df_transactions, df_accounts_clean, category_engine):
+    # Làm sạch 1 khối giao dịch và chuẩn bị Dim_Location / Dim_Merchant cho khối đó
+    with instrumentation.stage('clean_transactions', rows_in=len(df_transactions)) as s:
+        df_transactions_clean = clean_transactions(df_transactions, df_accounts_clean)
+        s.rows_out = len(df_transactions_clean)
+    with instrumentation.stage('categorize_merchants', rows_in=len(df_transactions_clean)) as s:
+        df_dim_merchant = prepare_merchant_dim(df_transactions_clean, category_engine)
+        s.rows_out = len(df_dim_merchant)
+    with instrumentation.stage('prepare_location_dim', rows_in=len(df_transactions_clean)) as s:
+        df_dim_location = prepare_location_dim(df_transactions_clean)
+        s.rows_out = len(df_dim_location)
+    dims = {
+        'Dim_Merchant': df_dim_merchant,
+        'Dim_Location': df_dim_location,
+    }
+    return dims, df_transactions_clean
 
-print("\n--- Transform hoàn tất! Đã chuẩn bị xong 5 DataFrames cho Dim ---")
-print(f"1. Dim_Customer: {len(df_dim_customer_upload)} dòng")
-print(f"2. Dim_Account:  {len(df_dim_account_upload)} dòng")
-print(f"3. Dim_Merchant: {len(df_dim_merchant_upload)} dòng")
-print(f"4. Dim_Location: {len(df_dim_location_upload)} dòng")
-print(f"5. Dim_Date:     {len(df_dim_date_upload)} dòng")
+
+# ==============================================================================
+# TRANSFORM SONG SONG (--transform-workers): chia giao dịch theo AccountID
+# ==============================================================================
+# Mỗi khối giao dịch được chia thành N phần theo AccountID % N, nên mọi giao dịch của 1 tài
+# khoản nằm cùng 1 phần và việc kiểm tra với tài khoản sạch không cần dữ liệu của phần khác.
+# Tiến trình con (ProcessPoolExecutor) làm sạch + phân loại Category cho phần của mình;
+# danh sách tài khoản sạch và bảng MCC chỉ được gửi sang mỗi tiến trình con 1 lần (initializer).
+# Tiến trình chính ghép các phần lại theo TransactionID (đúng thứ tự của khối gốc) rồi mới
+# chọn Dim_Merchant / Dim_Location -> kết quả giống hệt khi chạy 1 tiến trình.
+
+_worker_context = {}
+
+
+def _init_transform_worker(df_accounts_clean, df_mcc_mapping):
+    _worker_context['accounts'] = df_accounts_clean
+    _worker_context['category_engine'] = CategoryEngine(df_mcc_mapping)
+
+
+def _transform_shard(df_shard):
+    # Chạy trong tiến trình con. Trả về giao dịch sạch (kèm cột Category) và số liệu từng bước.
+    metrics = instrumentation.start_run()
+    with contextlib.redirect_stdout(io.StringIO()):
+        with metrics.stage('clean_transactions', rows_in=len(df_shard)) as s:
+            df_clean = clean_transactions(df_shard, _worker_context['accounts'])
+            s.rows_out = len(df_clean)
+        with metrics.stage('categorize_merchants', rows_in=len(df_clean)) as s:
+            category = _worker_context['category_engine'].categorize(df_clean)
+            s.rows_out = len(category)
+    return df_clean.assign(Category=category), metrics.totals
+
+
+class ShardedTransform:
+    def __init__(self, workers, df_accounts_clean, df_mcc_mapping):
+        self.workers = workers
+        # spawn: an toàn cả khi tiến trình chính đang có luồng đọc song song (--workers)
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                            initializer=_init_transform_worker,
+                                            initargs=(df_accounts_clean, df_mcc_mapping))
+
+    def shards(self, df_transactions):
+        shard_ids = df_transactions['AccountID'].fillna(0).to_numpy() % self.workers
+        return [df_transactions[shard_ids == i] for i in range(self.workers)]
+
+    def transform(self, df_transactions):
+        # Cùng kết quả với transform_transactions(df_transactions, ...)
+        with instrumentation.stage('transform_shards', rows_in=len(df_transactions), shards=self.workers) as s:
+            results = list(self.executor.map(_transform_shard, self.shards(df_transactions)))
+            for _, totals in results:
+                instrumentation.current().merge(totals)
+            df_transactions_clean = schemas.concat([df for df, _ in results], 'tbl_Transactions')
+            df_transactions_clean = df_transactions_clean.sort_values('TransactionID', kind='stable',
+                                                                      ignore_index=True)
+            category = df_transactions_clean.pop('Category')
+            s.rows_out = len(df_transactions_clean)
+        print(f"   - Đã loại bỏ {len(df_transactions) - len(df_transactions_clean)} giao dịch lỗi logic "
+              f"({self.workers} tiến trình).")
+
+        with instrumentation.stage('prepare_merchant_dim', rows_in=len(df_transactions_clean)) as s:
+            df_dim_merchant = prepare_merchant_dim(df_transactions_clean, None, category)
+            s.rows_out = len(df_dim_merchant)
+        with instrumentation.stage('prepare_location_dim', rows_in=len(df_transactions_clean)) as s:
+            df_dim_location = prepare_location_dim(df_transactions_clean)
+            s.rows_out = len(df_dim_location)
+        dims = {
+            'Dim_Merchant': df_dim_merchant,
+            'Dim_Location': df_dim_location,
+        }
+        return dims, df_transactions_clean
+
+    def close(self):
+        self.executor.shutdown()
 
 
 # ==============================================================================
 # BƯỚC 3: LOAD (Tải)
 # ==============================================================================
-print("\nBắt đầu Bước 3: Load...")
 
-# Hàm nạp dữ liệu
-def load_to_sql(df, table_name, engine):
+# Hàm nạp dữ liệu: bulk insert vào staging rồi MERGE theo khóa tự nhiên (chạy lại không bị trùng)
+# identity_col: df đã có sẵn Surrogate Key do ETL cấp (cần bật IDENTITY_INSERT)
+# update=False: dòng đã có thì bỏ qua (dùng cho Fact)
+def load_to_sql(df, table_name, engine, key_cols, identity_col=None, update=True, output_cols=None):
     try:
-        print(f"   + Đang nạp {len(df)} dòng vào bảng '{table_name}'...")
-        df.to_sql(table_name, con=engine, if_exists='append', index=False)
-        print(f"     -> Thành công!")
+        print(f"   + Đang nạp {len(df)} dòng vào bảng '{table_name}' (staging + MERGE)...")
+        affected, output = bulk_upsert(df, table_name, key_cols, engine, identity_col=identity_col,
+                                       update=update, output_cols=output_cols)
+        print(f"     -> Thành công! ({affected} dòng được thêm mới/cập nhật)")
+        return output
     except Exception as e:
         print(f"     -> LỖI khi nạp {table_name}: {e}")
         sys.exit(1)
 
-# 1. NẠP CÁC BẢNG DIMENSION
-# ------------------------------------------------------------------------------
-print("1. Nạp dữ liệu vào các bảng Dimension...")
-
-load_to_sql(df_dim_date_upload, 'Dim_Date', engine)
-load_to_sql(df_dim_customer_upload, 'Dim_Customer', engine)
-load_to_sql(df_dim_account_upload, 'Dim_Account', engine)
-load_to_sql(df_dim_merchant_upload, 'Dim_Merchant', engine)
-load_to_sql(df_dim_location_upload, 'Dim_Location', engine)
-
-
-# 2. TẠO DỮ LIỆU CHO BẢNG FACT
-# ------------------------------------------------------------------------------
-print("2. Xử lý bảng Fact (Lookup Keys)...")
-
-# Để tạo bảng Fact, cần thay thế các ID gốc (CustomerID, AccountID...) 
-# bằng các KEY tự tăng (Customer_Key, Account_Key...) vừa được sinh ra trong SQL Server.
-
-# A. Đọc lại các bảng Dim từ SQL để lấy Key mới nhất
-with engine.connect() as conn:
-    dim_cust_db = pd.read_sql("SELECT Customer_Key, CustomerID_Source FROM Dim_Customer", conn)
-
-    # 1. Lấy Account_Key từ kho (Dim_Account)
-    dim_acc_key = pd.read_sql("SELECT Account_Key, AccountID_Source FROM Dim_Account", conn)
-    # 2. Lấy mối quan hệ Account -> Customer từ nguồn (tbl_Accounts) 
-    source_acc_cust = pd.read_sql("SELECT AccountID, CustomerID FROM tbl_Accounts", conn)
-    # 3. Ghép lại trong Python để có: Account_Key + CustomerID
-    dim_acc_db = pd.merge(dim_acc_key, source_acc_cust, left_on='AccountID_Source', right_on='AccountID', how='inner')
-    
-    dim_merch_db = pd.read_sql("SELECT Merchant_Key, MerchantName_Source FROM Dim_Merchant", conn)
-    dim_loc_db = pd.read_sql("SELECT Location_Key, Transaction_Country FROM Dim_Location", conn)
-
-# B. Bắt đầu ghép nối (Mapping) vào bảng giao dịch sạch (df_transactions_clean)
-fact_table = df_transactions_clean.copy()
-
-# 2.1. Map Account_Key và lấy CustomerID
-# Join bảng Fact với Dim_Account (qua AccountID)
-fact_table = pd.merge(fact_table, dim_acc_key, left_on='AccountID', right_on='AccountID_Source', how='inner')
-
-# 2.2. Map Customer_Key
-# Bảng Transaction không có CustomerID, lấy nó từ thông tin Account
-# Lấy mapping Account -> Customer từ dữ liệu gốc
-acc_to_cust = df_accounts_clean[['AccountID', 'CustomerID']]
-fact_table = pd.merge(fact_table, acc_to_cust, on='AccountID', how='inner')
-
-# Giờ mới map với Dim_Customer để lấy Customer_Key
-fact_table = pd.merge(fact_table, dim_cust_db, left_on='CustomerID', right_on='CustomerID_Source', how='inner')
-
-# 2.3. Map Merchant_Key
-# Bước A: Tái tạo lại cột 'Final_Name' cho bảng Fact
-fact_table['Final_Name'] = fact_table['MerchantName'].fillna(fact_table['BeneficiaryName'])
-
-# Bước B: Map dựa trên cột Final_Name này
-fact_table = pd.merge(fact_table, dim_merch_db, left_on='Final_Name', right_on='MerchantName_Source', how='inner')
-
-# 2.4. Map Location_Key
-fact_table = pd.merge(fact_table, dim_loc_db, left_on='TransactionCountry', right_on='Transaction_Country', how='inner')
-
-# 2.5. Map Date_Key
-fact_table['Date_Key'] = (
-    fact_table['TransactionTimestamp'].dt.year.astype(str) + 
-    fact_table['TransactionTimestamp'].dt.month.astype(str).str.zfill(2) + 
-    fact_table['TransactionTimestamp'].dt.day.astype(str).str.zfill(2) + 
-    fact_table['TransactionTimestamp'].dt.hour.astype(str).str.zfill(2)
-).astype(int)
-
-# 2.6. Tạo cột Transaction_Count
-fact_table['Transaction_Count'] = 1
-
-# 2.7. Đổi tên cột Amount
-fact_table.rename(columns={'Amount': 'Amount_Spent'}, inplace=True)
-
-# 3. CHUẨN BỊ DATAFRAME CHO FACT
-# ------------------------------------------------------------------------------
-# Chỉ giữ lại các cột Key và Measure
-df_fact_upload = fact_table[[
-    'Date_Key', 
-    'Customer_Key', 
-    'Account_Key', 
-    'Merchant_Key', 
-    'Location_Key', 
-    'Amount_Spent', 
-    'Transaction_Count'
-]]
-
-print(f"   -> Đã tạo bảng Fact với {len(df_fact_upload)} dòng.")
-
-
-# 4. NẠP BẢNG FACT
-# ------------------------------------------------------------------------------
-load_to_sql(df_fact_upload, 'Fact_Spending', engine)
-
-
-print("\n=======================================================")
-print("   CHÚC MỪNG! QUÁ TRÌNH ETL ĐÃ HOÀN TẤT 100%   ")
-print("   DỮ LIỆU ĐÃ SẴN SÀNG TRONG KHO 'DW_Bank'     ")
-print("=======================================================")
\ No newline at end of file
+
+# Các bảng Dim và khóa tự nhiên (natural key) tương ứng
+DIM_NATURAL_KEYS = {
+    'Dim_Date': 'Date_Key',
+    'Dim_Customer': 'CustomerID_Source',
+    'Dim_Account': 'AccountID_Source',
+    'Dim_Merchant': 'MerchantName_Source',
+    'Dim_Location': 'Transaction_Country',
+}
+
+
+def load_dim(engine, df, table_name, keystore, include_existing=False):
+    # Cấp Surrogate Key cho các dòng mới, MERGE vào kho rồi ghi nhớ Key thực tế (OUTPUT)
+    key_map = keystore[table_name]
+    df_upload = key_map.assign(df, include_existing=include_existing)
+    if df_upload.empty:
+        return
+    output = load_to_sql(df_upload, table_name, engine, key_cols=[key_map.natural_col],
+                         identity_col=key_map.key_col if key_map.assigns_keys else None,
+                         output_cols=[key_map.key_col, key_map.natural_col] if key_map.assigns_keys else [key_map.key_col])
+    key_map.commit(output)
+    keystore.save()
+
+
+def load_customer_account_dims(engine, dims, changes, full_refresh, keystore):
+    # Full refresh: MERGE tất cả. Incremental: chỉ MERGE dòng bị sửa (theo hash) + dòng hợp lệ CHƯA có
+    # trong kho. Dòng bị loại ở lần trước đã được ghi nhớ hash nên không bao giờ là "thay đổi" nữa:
+    # khách hàng trước đây chưa có tài khoản hợp lệ nay mở tài khoản, hoặc tài khoản trở nên hợp lệ
+    # vì thông tin chủ tài khoản được sửa -> chỉ có thể nhận ra qua bản đồ Key.
+    for table_name, ids in [
+        ('Dim_Customer', changes['customer_ids']),
+        ('Dim_Account', changes['account_ids']),
+    ]:
+        key_col = DIM_NATURAL_KEYS[table_name]
+        df = dims[table_name]
+        if not full_refresh:
+            known = list(keystore[table_name].keys.keys())
+            df = df[df[key_col].isin(ids) | ~df[key_col].isin(known)]
+        load_dim(engine, df, table_name, keystore, include_existing=True)
+
+
+def load_calendar(engine, keystore, start, end):
+    # Dim_Date là lịch theo giờ sinh sẵn: chỉ những giờ chưa có trong kho mới được nạp
+    load_dim(engine, build_dim_date(start, end), 'Dim_Date', keystore)
+
+
+def ensure_calendar(engine, keystore, timestamps):
+    # Giao dịch nằm ngoài khoảng lịch đã sinh -> sinh bổ sung các ngày còn thiếu
+    keys = date_key(timestamps)
+    missing = timestamps[~keys.isin(list(keystore['Dim_Date'].keys.keys()))]
+    if not missing.empty:
+        load_calendar(engine, keystore, missing.min(), missing.max())
+
+
+def load_transaction_dims(engine, dims, keystore):
+    # Chỉ nạp các giá trị Merchant / Location chưa có Key trong bản đồ
+    for table_name in ['Dim_Merchant', 'Dim_Location']:
+        load_dim(engine, dims[table_name], table_name, keystore)
+
+
+# Thứ tự tra cứu Key và luật ghi nhận dòng Fact bị loại khi không tìm thấy Key
+FACT_KEY_RULES = [
+    ('Account_Key', 'fact_unmatched_account'),
+    ('Customer_Key', 'fact_unmatched_customer'),
+    ('Merchant_Key', 'fact_unmatched_merchant'),
+    ('Location_Key', 'fact_unmatched_location'),
+]
+
+
+def build_fact_table(resolver, df_transactions_clean):
+    # Để tạo bảng Fact, cần thay thế các ID gốc (CustomerID, AccountID...)
+    # bằng các KEY (Customer_Key, Account_Key...) mà ETL đã cấp khi nạp Dim.
+    # Mỗi cột khóa tự nhiên được tra thẳng ra 1 mảng Key int32 (KeyResolver), không merge cả bảng.
+    df = df_transactions_clean
+
+    # A. Tra cứu Key từ bản đồ trong bộ nhớ (không cần đọc lại kho)
+    owners = resolver.owners(df['AccountID'])  # Bảng Transaction không có CustomerID -> lấy từ Account
+    keys = {
+        'Account_Key': resolver.resolve('Dim_Account', df['AccountID']),
+        'Customer_Key': resolver.resolve('Dim_Customer', owners),
+        'Merchant_Key': resolver.resolve_merchant(df),
+        'Location_Key': resolver.resolve('Dim_Location', df['TransactionCountry']),
+    }
+
+    # B. Dòng thiếu Key bị loại (Fact có khóa ngoại tới mọi Dim) nhưng được báo cáo theo Dim đầu tiên bị thiếu
+    matched = np.ones(len(df), dtype=bool)
+    for key_col, rule in FACT_KEY_RULES:
+        missing = matched & (keys[key_col] == MISSING_KEY)
+        if missing.any():
+            instrumentation.reject(rule, missing.sum())
+            print(f"   - {missing.sum()} giao dịch không tìm thấy {key_col} "
+                  f"(ví dụ TransactionID: {df['TransactionID'].to_numpy()[missing][:5].tolist()})")
+            matched &= ~missing
+
+    # C. CHUẨN BỊ DATAFRAME CHO FACT: chỉ tạo các cột Key và Measure
+    # Date_Key (yyyyMMddHH) tính bằng số học nguyên; giữ TransactionID nguồn để khử trùng khi chạy lại
+    df_fact_upload = schemas.apply(pd.DataFrame({
+        'TransactionID_Source': df['TransactionID'].to_numpy()[matched],
+        'Date_Key': date_key(df['TransactionTimestamp'].to_numpy()[matched]),
+        **{key_col: keys[key_col][matched]
+           for key_col in ['Customer_Key', 'Account_Key', 'Merchant_Key', 'Location_Key']},
+        'Amount_Spent': df['Amount'].array[matched],
+        'Transaction_Count': np.ones(int(matched.sum()), dtype='int8'),
+    }), 'Fact_Spending')
+
+    print(f"   -> Đã tạo bảng Fact với {len(df_fact_upload)} dòng.")
+    return df_fact_upload
+
+
+def unmatched_account_ids(resolver, df_transactions):
+    # TransactionID của các giao dịch có tài khoản chưa có trong Dim_Account (tài khoản chưa tồn tại
+    # hoặc đang bị loại, kể cả do khách hàng sở hữu bị loại) -> có thể nạp được ở lần chạy sau
+    missing = resolver.resolve('Dim_Account', df_transactions['AccountID']) == MISSING_KEY
+    return df_transactions['TransactionID'].to_numpy()[missing]
+
+
+def load_fact(loader, df_fact_upload):
+    # Nạp Fact theo lô (song song nếu có nhiều luồng); lô đã COMMIT được ghi vào checkpoint
+    n_batches = -(-len(df_fact_upload) // loader.batch_size)
+    print(f"   + Đang nạp {len(df_fact_upload)} dòng vào bảng 'Fact_Spending' "
+          f"({n_batches} lô x {loader.batch_size} dòng, {loader.workers} luồng)...")
+    try:
+        result = loader.load(df_fact_upload)
+    except Exception as e:
+        print(f"     -> LỖI khi nạp Fact_Spending: {e}")
+        print(f"     (Đã nạp xong {len(loader.checkpoint.batches)}/{n_batches} lô - "
+              f"chạy lại ETL sẽ tiếp tục từ các lô còn thiếu)")
+        sys.exit(1)
+    if result['skipped_batches']:
+        print(f"     - Bỏ qua {result['skipped_batches']} lô đã nạp ở lần chạy trước (checkpoint)")
+    rate = f"{result['rows_per_s']:,.0f} dòng/s" if result['rows_per_s'] else '-'
+    print(f"     -> Thành công! ({result['inserted']} dòng được thêm mới, {result['seconds']:.2f}s, {rate})")
+    return result
+
+
+def update_aggregates(engine, rebuild=False):
+    # Cộng dồn các dòng Fact vừa nạp vào bảng tổng hợp của dashboard
+    if not aggregates.available(engine):
+        print("(Kho chưa có bảng tổng hợp Agg_* - hãy chạy lại schema.sql, bỏ qua bước này)")
+        return
+    print("\n3. Cập nhật bảng tổng hợp (Aggregate) cho dashboard...")
+    last_key, max_key = aggregates.refresh_aggregates(engine, rebuild=rebuild)
+    if max_key > last_key:
+        print(f"   -> Đã cộng dồn các dòng Fact có Transaction_Key {last_key + 1} - {max_key}")
+    else:
+        print("   -> Không có dòng Fact mới.")
+
+
+def update_customer_features(engine, rebuild=False):
+    # Gộp các dòng Fact vừa nạp vào feature mart theo khách hàng (CRM)
+    if not customer_features.available(engine):
+        print("(Kho chưa có feature mart Mart_* - hãy chạy lại schema.sql, bỏ qua bước này)")
+        return
+    print("\n4. Cập nhật feature mart theo khách hàng (CRM)...")
+    last_key, max_key, updated = customer_features.refresh_features(engine, rebuild=rebuild)
+    if max_key > last_key:
+        print(f"   -> Đã gộp các dòng Fact có Transaction_Key {last_key + 1} - {max_key} ({updated} khách hàng)")
+    else:
+        print("   -> Không có dòng Fact mới.")
+
+
+def run_pipeline(engine, source, df_customers, df_accounts, df_mcc_mapping, changes, state, full_refresh, chunk_size, state_file, keystore,
+                 calendar=(CALENDAR_START, CALENDAR_END), rebuild_aggregates=False, loader=None,
+                 disable_fact_constraints=False, transform_workers=1):
+    # 1. Khách hàng / Tài khoản: làm sạch và nạp Dim 1 lần
+    dims, df_accounts_clean = transform_customers_accounts(df_customers, df_accounts)
+
+    print("\nBắt đầu Bước 3: Load...")
+    print("1. Nạp dữ liệu vào các bảng Dimension (Date, Customer, Account)...")
+    with instrumentation.stage('load_dim_date'):
+        load_calendar(engine, keystore, *calendar)
+    with instrumentation.stage('load_customer_account_dims',
+                               rows_in=len(dims['Dim_Customer']) + len(dims['Dim_Account'])):
+        load_customer_account_dims(engine, dims, changes, full_refresh, keystore)
+
+    # Dim đã nạp xong -> ghi nhớ hash ngay để lần chạy sau không nạp lại.
+    # Ghi nhớ mọi dòng đã kiểm tra (kể cả dòng bị loại do lỗi logic), nếu không các dòng lỗi
+    # sẽ bị coi là "thay đổi" ở mọi lần chạy. Tài khoản bị loại vẫn được kiểm tra lại khi
+    # khách hàng sở hữu thay đổi (extract_incremental đọc tài khoản theo CustomerID).
+    # (Push-down: dòng bị loại trên server không có trong df nhưng có trong changes)
+    watermark.remember_hashes(state['customer_hashes'], changes['customer_hashes'], 'CustomerID',
+                              df_customers['CustomerID'].tolist() + list(changes['customer_ids']))
+    watermark.remember_hashes(state['account_hashes'], changes['account_hashes'], 'AccountID',
+                              df_accounts['AccountID'].tolist() + list(changes['account_ids']))
+    watermark.save_state(state, state_file)
+
+    # 2. Giao dịch: xử lý từng khối (validation -> category -> lookup key -> nạp Fact)
+    if transform_workers > 1:
+        print(f"Transform song song: {transform_workers} tiến trình (chia giao dịch theo AccountID)")
+        sharded = ShardedTransform(transform_workers, df_accounts_clean, df_mcc_mapping)
+        transform, close_transform = sharded.transform, sharded.close
+    else:
+        category_engine = CategoryEngine(df_mcc_mapping)
+        transform = lambda df: transform_transactions(df, df_accounts_clean, category_engine)
+        close_transform = lambda: None
+    resolver = KeyResolver(keystore, df_accounts_clean)
+    loader = loader or fact_loader.FactLoader(engine)
+    hold_id = None
+    if source.pushdown:
+        report_pushdown_rejections('clean_transactions', source.rejected_transactions(state['last_transaction_id']))
+        # Push-down: giao dịch thiếu tài khoản không về tới client -> hỏi server giao dịch đầu tiên như vậy
+        first_id = None if full_refresh else source.first_unknown_account_transaction(state['last_transaction_id'])
+        if first_id is not None:
+            hold_id = int(first_id) - 1
+            print(f"   !!! (Push-down) Có giao dịch thiếu tài khoản hợp lệ: High-water mark "
+                  f"dừng ở TransactionID {hold_id}, lần chạy sau sẽ thử nạp lại.")
+
+    transactions = instrumentation.iter_stage('extract_transactions',
+                                              source.iter_transactions(state['last_transaction_id'], chunk_size))
+    try:
+        with loader.constraints_disabled(disable_fact_constraints):
+            total_rows, total_facts, load_rows, load_seconds = load_transactions(
+                engine, transactions, transform, resolver, loader, keystore, state, state_file,
+                hold_unmatched=not full_refresh, hold_id=hold_id)
+    finally:
+        close_transform()
+
+    print(f"\n--- Đã xử lý {total_rows} giao dịch, nạp {total_facts} dòng vào Fact_Spending ---")
+    if load_seconds:
+        print(f"--- Tốc độ nạp Fact: {load_rows / load_seconds:,.0f} dòng/s ---")
+
+    with instrumentation.stage('update_aggregates'):
+        update_aggregates(engine, rebuild=rebuild_aggregates)
+    with instrumentation.stage('update_customer_features'):
+        update_customer_features(engine, rebuild=rebuild_aggregates)
+
+
+def load_transactions(engine, transactions, transform, resolver, loader, keystore, state, state_file,
+                      hold_unmatched=False, hold_id=None):
+    # Xử lý từng khối giao dịch, trả về (số giao dịch, số dòng Fact, số dòng đã gửi nạp, thời gian nạp Fact)
+    # hold_unmatched (incremental): High-water mark dừng TRƯỚC giao dịch đầu tiên bị loại do thiếu
+    # tài khoản / khách hàng -> lần chạy sau đọc lại và thử nạp tiếp (Fact khử trùng nên không nhân đôi).
+    # hold_id: High-water mark không được vượt quá giá trị này (None: không giới hạn)
+    total_rows, total_facts, load_rows, load_seconds = 0, 0, 0, 0.0
+    for i, df_transactions in enumerate(transactions, start=1):
+        if df_transactions.empty:
+            continue
+        print(f"\n--- Khối giao dịch #{i}: {len(df_transactions)} dòng ---")
+
+        chunk_dims, df_transactions_clean = transform(df_transactions)
+
+        print("1. Nạp dữ liệu vào các bảng Dimension (Merchant, Location)...")
+        with instrumentation.stage('load_transaction_dims', chunk=i,
+                                   rows_in=len(chunk_dims['Dim_Merchant']) + len(chunk_dims['Dim_Location'])):
+            ensure_calendar(engine, keystore, df_transactions_clean['TransactionTimestamp'])
+            load_transaction_dims(engine, chunk_dims, keystore)
+
+        print("2. Xử lý bảng Fact (Lookup Keys)...")
+        with instrumentation.stage('build_fact_table', chunk=i, rows_in=len(df_transactions_clean)) as s:
+            df_fact_upload = build_fact_table(resolver, df_transactions_clean)
+            s.rows_out = len(df_fact_upload)
+        # Fact: khử trùng theo TransactionID nguồn -> chạy lại khối đã nạp sẽ không nhân đôi
+        with instrumentation.stage('load_fact', chunk=i, rows_in=len(df_fact_upload)) as s:
+            result = load_fact(loader, df_fact_upload)
+            s.rows_out = result['inserted']
+        load_rows += result['rows']
+        load_seconds += result['seconds']
+
+        retry_ids = unmatched_account_ids(resolver, df_transactions)
+        if len(retry_ids):
+            if hold_unmatched:
+                first_id = int(retry_ids.min())
+                hold_id = first_id - 1 if hold_id is None else min(hold_id, first_id - 1)
+                print(f"   !!! {len(retry_ids)} giao dịch thiếu tài khoản / khách hàng: High-water mark "
+                      f"dừng ở TransactionID {hold_id}, lần chạy sau sẽ thử nạp lại.")
+            else:
+                print(f"   !!! {len(retry_ids)} giao dịch thiếu tài khoản / khách hàng bị bỏ qua và "
+                      f"sẽ KHÔNG được thử lại (ví dụ TransactionID: {retry_ids[:5].tolist()}).")
+
+        # Khối đã nạp xong -> dời High-water mark (chạy lại sẽ tiếp tục từ khối sau)
+        done = df_transactions
+        if hold_id is not None:
+            done = df_transactions[df_transactions['TransactionID'] <= hold_id]
+        if not done.empty:
+            state['last_transaction_id'] = max(state['last_transaction_id'], int(done['TransactionID'].max()))
+            chunk_max_ts = done['TransactionTimestamp'].max()
+            if state['last_transaction_ts'] is None or chunk_max_ts > pd.Timestamp(state['last_transaction_ts']):
+                state['last_transaction_ts'] = str(chunk_max_ts)
+            watermark.save_state(state, state_file)
+
+        total_rows += len(df_transactions)
+        total_facts += len(df_fact_upload)
+
+    return total_rows, total_facts, load_rows, load_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description='ETL Kho dữ liệu giao dịch ngân hàng')
+    parser.add_argument('--full-refresh', action='store_true',
+                        help='Đọc lại TOÀN BỘ dữ liệu nguồn (chạy sau schema.sql), bỏ qua High-water mark')
+    parser.add_argument('--state-file', default=watermark.DEFAULT_STATE_FILE,
+                        help='File lưu High-water mark giữa các lần chạy')
+    parser.add_argument('--keymap-file', default=DEFAULT_KEYMAP_FILE,
+                        help='File lưu bản đồ Natural Key -> Surrogate Key giữa các lần chạy')
+    parser.add_argument('--calendar-start', default=CALENDAR_START,
+                        help='Ngày bắt đầu của lịch Dim_Date (sinh sẵn theo giờ)')
+    parser.add_argument('--calendar-end', default=CALENDAR_END,
+                        help='Ngày kết thúc của lịch Dim_Date')
+    parser.add_argument('--use-cache', action='store_true',
+                        help='Dùng snapshot Arrow cục bộ của dữ liệu nguồn (chỉ đọc lại DB khi nguồn thay đổi)')
+    parser.add_argument('--cache-dir', default=snapshot_cache.DEFAULT_CACHE_DIR,
+                        help='Thư mục chứa snapshot dữ liệu nguồn')
+    parser.add_argument('--chunk-size', type=int, default=None,
+                        help='Đọc và xử lý tbl_Transactions theo từng khối N dòng (mặc định: cả bảng 1 lần)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Số luồng đọc song song tbl_Transactions (chia theo khoảng TransactionID)')
+    parser.add_argument('--backend', choices=backends.BACKENDS, default='mssql',
+                        help='Kho dữ liệu: SQL Server (mặc định) hoặc engine nhúng sqlite / duckdb')
+    parser.add_argument('--database', default=None,
+                        help='File database cho backend sqlite / duckdb (mặc định: DW_Bank.sqlite / DW_Bank.duckdb)')
+    parser.add_argument('--pushdown', action='store_true',
+                        help='Chạy các luật làm sạch (ngày mở TK, ngày giao dịch, khách hàng không có TK) '
+                             'bằng JOIN trên server, chỉ đọc về các dòng hợp lệ')
+    parser.add_argument('--transform-workers', type=int, default=1,
+                        help='Số tiến trình làm sạch + phân loại giao dịch song song (chia theo AccountID)')
+    parser.add_argument('--fact-batch-size', type=int, default=fact_loader.DEFAULT_BATCH_SIZE,
+                        help='Số dòng mỗi lô khi nạp Fact_Spending')
+    parser.add_argument('--load-workers', type=int, default=None,
+                        help='Số luồng nạp song song các lô Fact (mặc định: bằng --workers; engine nhúng luôn 1)')
+    parser.add_argument('--fact-checkpoint-file', default=fact_loader.DEFAULT_CHECKPOINT_FILE,
+                        help='File ghi các lô Fact đã nạp (chạy lại sau lỗi sẽ tiếp tục từ lô còn thiếu)')
+    parser.add_argument('--disable-fact-constraints', action='store_true',
+                        help='Tắt khóa ngoại + chỉ mục non-clustered của Fact_Spending trong lúc nạp, '
+                             'dựng lại sau đó (SQL Server)')
+    parser.add_argument('--rebuild-aggregates', action='store_true',
+                        help='Tính lại các bảng tổng hợp Agg_* và feature mart Mart_* từ toàn bộ Fact_Spending')
+    parser.add_argument('--metrics-log', default=None,
+                        help='Ghi số liệu từng bước (thời gian, CPU, số dòng, dòng bị loại, bộ nhớ) dạng JSON lines')
+    parser.add_argument('--prometheus-file', default=None,
+                        help='Ghi số liệu lần chạy ra Prometheus textfile (node_exporter textfile collector)')
+    parser.add_argument('--profile-stage', default=None,
+                        help='Bật profile cho 1 bước, ví dụ: clean_transactions, categorize_merchants, load_fact')
+    parser.add_argument('--profile-mode', choices=instrumentation.PROFILE_MODES, default='cprofile',
+                        help='cprofile: ghi <bước>.prof + <bước>.txt; tracemalloc: ghi top cấp phát vào metrics log')
+    parser.add_argument('--profile-dir', default='.',
+                        help='Thư mục ghi file profile')
+    args = parser.parse_args()
+
+    metrics = instrumentation.start_run(log_path=args.metrics_log, prometheus_path=args.prometheus_file,
+                                        profile_stage=args.profile_stage, profile_mode=args.profile_mode,
+                                        profile_dir=args.profile_dir)
+    status = 'failed'
+    try:
+        run(args)
+        status = 'success'
+    finally:
+        metrics.finish(status)
+        metrics.print_summary()
+
+
+def run(args):
+    print("Đang bắt đầu quá trình ETL...")
+
+    state = watermark.load_state(args.state_file)
+    # Lần chạy đầu (chưa có state) thì đọc toàn bộ như cũ
+    full_refresh = args.full_refresh or watermark.is_first_run(state)
+    if full_refresh:
+        print("Chế độ: FULL REFRESH (đọc toàn bộ dữ liệu nguồn)")
+        state = watermark.empty_state()
+    else:
+        print(f"Chế độ: INCREMENTAL (High-water mark: TransactionID = {state['last_transaction_id']}, "
+              f"thời điểm = {state['last_transaction_ts']})")
+    if args.chunk_size:
+        print(f"Chế độ STREAMING: xử lý giao dịch theo khối {args.chunk_size} dòng")
+
+    if args.workers > 1:
+        print(f"Extract song song: {args.workers} luồng")
+
+    pushdown = args.pushdown
+    if pushdown and args.use_cache and snapshot_cache.available():
+        # Snapshot là bản sao nguyên vẹn của nguồn -> luật làm sạch chạy bằng pandas như cũ
+        print("(Dùng snapshot cục bộ -> bỏ qua --pushdown)")
+        pushdown = False
+    if pushdown:
+        print("Chế độ PUSH-DOWN: lọc dữ liệu lỗi logic ngay trên server")
+
+    load_workers = args.load_workers or args.workers
+    # +1 connection cho luồng chính (đọc High-water mark, đồng bộ Key)
+    engine = create_engine(pool_size=max(args.workers, load_workers) + 1, backend=args.backend,
+                           database=args.database)
+    if args.backend != 'mssql' and backends.ensure_schema(engine):
+        print(f"Đã tạo schema (schema.sql) trên database {args.backend} mới.")
+
+    with engine.connect() as conn:
+        print(f"Kết nối {'SQL Server' if args.backend == 'mssql' else args.backend} (qua SQLAlchemy) thành công!")
+        if args.workers > 1:
+            source = ParallelSqlSource(conn, engine, args.workers, pushdown=pushdown)
+        else:
+            source = SqlSource(conn, pushdown=pushdown)
+        if args.use_cache:
+            if snapshot_cache.available():
+                source = snapshot_cache.open_snapshot(conn, args.cache_dir, CSV_PATH, source)
+            else:
+                print("(Chưa cài pyarrow -> bỏ qua snapshot, đọc trực tiếp từ SQL Server)")
+
+        df_customers, df_accounts, df_mcc_mapping, changes = extract(source, state, full_refresh)
+
+        # Bản đồ Surrogate Key: đọc từ file, chỉ đọc lại bảng Dim nào không còn khớp kho
+        keystore = KeyStore(args.keymap_file)
+        keystore.load()
+        rebuilt = keystore.sync(conn)
+        if rebuilt:
+            print(f"Đã đồng bộ lại bản đồ Key từ kho cho: {', '.join(rebuilt)}")
+
+        if not has_new_transactions(source, state) and not changes['customer_ids'] and not changes['account_ids']:
+            print("\nKhông có dữ liệu mới kể từ lần chạy trước. Kết thúc.")
+            if args.rebuild_aggregates:
+                with instrumentation.stage('update_aggregates'):
+                    update_aggregates(engine, rebuild=True)
+                with instrumentation.stage('update_customer_features'):
+                    update_customer_features(engine, rebuild=True)
+            return
+
+        run_pipeline(engine, source, df_customers, df_accounts, df_mcc_mapping, changes, state,
+                     full_refresh, args.chunk_size, args.state_file, keystore,
+                     calendar=(args.calendar_start, args.calendar_end),
+                     rebuild_aggregates=args.rebuild_aggregates,
+                     loader=fact_loader.FactLoader(engine, args.fact_batch_size, load_workers,
+                                                   args.fact_checkpoint_file),
+                     disable_fact_constraints=args.disable_fact_constraints,
+                     transform_workers=args.transform_workers)
+
+    print(f"\nĐã lưu High-water mark: TransactionID = {state['last_transaction_id']}")
+
+    print("\n=======================================================")
+    print("   CHÚC MỪNG! QUÁ TRÌNH ETL ĐÃ HOÀN TẤT 100%   ")
+    print("   DỮ LIỆU ĐÃ SẴN SÀNG TRONG KHO 'DW_Bank'     ")
+    print("=======================================================")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,175 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import sqlalchemy
+
+import schemas
+from loader import create_staging_sql, staging_name, upsert_sql
+
+# ==============================================================================
+# Nạp Fact_Spending theo lô, song song và tiếp tục được sau khi lỗi
+# ==============================================================================
+# Mỗi khối Fact được sắp theo TransactionID_Source rồi chia thành các lô cố định. Mỗi lô:
+#   1. bulk insert vào bảng staging riêng (stg_Fact_Spending_<lô>) qua 1 connection của pool
+#   2. INSERT các dòng chưa có vào Fact_Spending (SQL Server: WITH (TABLOCK) -> ghi log tối
+#      thiểu khi database ở recovery model SIMPLE / BULK_LOGGED; engine nhúng: ON CONFLICT DO NOTHING)
+#   3. COMMIT rồi ghi số lô vào file checkpoint
+# Bước 1 của các lô chạy đồng thời (phần gửi dữ liệu qua mạng là phần chậm nhất). Bước 2 thì KHÔNG:
+# TABLOCK giữ khóa độc quyền trên Fact_Spending tới khi COMMIT nên các lệnh INSERT lần lượt chạy
+# từng lô một (đổi lấy ghi log tối thiểu). Nếu 1 lô lỗi, các lô đã
+# COMMIT được ghi trong checkpoint -> chạy lại ETL sẽ đọc lại đúng khối đó và chỉ nạp các lô còn thiếu.
+# (Fact khử trùng theo TransactionID_Source nên kể cả khi checkpoint mất, chạy lại cũng không nhân đôi.)
+
+FACT_TABLE = 'Fact_Spending'
+FACT_KEY = 'TransactionID_Source'
+
+DEFAULT_BATCH_SIZE = 50_000
+DEFAULT_CHECKPOINT_FILE = 'etl_fact_checkpoint.json'
+
+# Chỉ mục non-clustered KHÔNG unique của Fact (chỉ mục unique giữ cho việc khử trùng nên không tắt)
+NONCLUSTERED_INDEXES_SQL = """
+SELECT name FROM sys.indexes
+WHERE object_id = OBJECT_ID(:table_name) AND type_desc = 'NONCLUSTERED' AND is_unique = 0 AND is_disabled = 0
+"""
+
+
+def insert_new_sql(staging, columns, dialect):
+    # Câu lệnh trả về số dòng được thêm mới dưới dạng kết quả truy vấn: cursor.rowcount của
+    # INSERT ... SELECT không đáng tin (DuckDB luôn trả về -1)
+    col_list = ', '.join(columns)
+    if dialect != 'mssql':
+        # RETURNING chỉ trả về dòng thực sự được thêm (dòng trùng bị DO NOTHING bỏ qua)
+        return upsert_sql(FACT_TABLE, staging, columns, [FACT_KEY], update=False, output_cols=[FACT_KEY])
+    return (f"SET NOCOUNT ON; "
+            f"INSERT INTO {FACT_TABLE} WITH (TABLOCK) ({col_list}) SELECT {col_list} FROM {staging} s "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {FACT_TABLE} t WHERE t.{FACT_KEY} = s.{FACT_KEY}); "
+            f"SELECT @@ROWCOUNT")
+
+
+class FactCheckpoint:
+    # {'signature': <khối đang nạp>, 'batches': [các lô đã COMMIT]}, ghi file tạm rồi đổi tên
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.signature = None
+        self.batches = set()
+
+    def start(self, signature):
+        # Trả về tập lô đã nạp của khối này (checkpoint của khối khác -> bắt đầu lại từ đầu)
+        self.signature, self.batches = signature, set()
+        if self.path and os.path.exists(self.path):
+            with open(self.path, 'r', encoding='utf-8') as f:
+                saved = json.load(f)
+            if saved.get('signature') == signature:
+                self.batches = set(saved.get('batches', []))
+        return set(self.batches)
+
+    def commit(self, batch_no):
+        with self.lock:
+            self.batches.add(batch_no)
+            self._save()
+
+    def clear(self):
+        self.signature, self.batches = None, set()
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+    def _save(self):
+        if not self.path:
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'signature': self.signature, 'batches': sorted(self.batches)}, f)
+        os.replace(tmp_path, self.path)
+
+
+class FactLoader:
+    def __init__(self, engine, batch_size=DEFAULT_BATCH_SIZE, workers=1, checkpoint_file=None):
+        self.engine = engine
+        self.batch_size = batch_size
+        # SQLite / DuckDB chỉ có 1 luồng ghi tại 1 thời điểm -> nạp tuần tự
+        self.workers = workers if engine.dialect.name == 'mssql' else 1
+        self.checkpoint = FactCheckpoint(checkpoint_file)
+
+    def split(self, df):
+        # Sắp theo khóa tự nhiên -> cùng 1 khối luôn được chia thành đúng các lô như lần chạy trước
+        df = df.sort_values(FACT_KEY, kind='stable').drop_duplicates(subset=[FACT_KEY], keep='last')
+        return [df.iloc[start:start + self.batch_size] for start in range(0, len(df), self.batch_size)]
+
+    def load_batch(self, batch_no, df):
+        df = schemas.to_database(df)
+        columns = list(df.columns)
+        staging = staging_name(FACT_TABLE, f"_{batch_no}")
+        dialect = self.engine.dialect.name
+        with self.engine.begin() as conn:
+            for sql in create_staging_sql(FACT_TABLE, staging, columns, dialect=dialect):
+                conn.exec_driver_sql(sql)
+            df.to_sql(staging, con=conn, if_exists='append', index=False)
+            result = conn.exec_driver_sql(insert_new_sql(staging, columns, dialect))
+            inserted = result.scalar() if dialect == 'mssql' else len(result.fetchall())
+            conn.exec_driver_sql(f"DROP TABLE {staging}")
+        self.checkpoint.commit(batch_no)
+        return inserted
+
+    def load(self, df):
+        # Trả về số liệu của lần nạp: dòng, dòng mới, lô, lô bỏ qua (đã nạp), giây, dòng/s
+        batches = self.split(df)
+        signature = (f"{df[FACT_KEY].min()}-{df[FACT_KEY].max()}-{len(df)}-{self.batch_size}"
+                     if len(df) else None)
+        done = self.checkpoint.start(signature)
+        pending = [(batch_no, batch) for batch_no, batch in enumerate(batches) if batch_no not in done]
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(self.load_batch, batch_no, batch) for batch_no, batch in pending]
+            # Đợi mọi lô kết thúc (lô lỗi không làm dừng các lô khác) rồi mới báo lỗi đầu tiên
+            errors = [f.exception() for f in futures]
+        seconds = time.perf_counter() - start
+        error = next((e for e in errors if e is not None), None)
+        if error is not None:
+            raise error
+        self.checkpoint.clear()
+
+        rows = sum(len(batch) for _, batch in pending)
+        return {
+            'rows': rows,
+            'inserted': sum(f.result() for f in futures),
+            'batches': len(batches),
+            'skipped_batches': len(batches) - len(pending),
+            'seconds': seconds,
+            'rows_per_s': rows / seconds if seconds else None,
+        }
+
+    @contextmanager
+    def constraints_disabled(self, enabled=True):
+        # Tắt khóa ngoại + chỉ mục non-clustered của Fact trong lúc nạp, bật / dựng lại sau đó.
+        # WITH CHECK: kiểm tra lại toàn bộ khóa ngoại để SQL Server vẫn tin cậy (trusted) ràng buộc.
+        if not enabled:
+            yield
+            return
+        if self.engine.dialect.name != 'mssql':
+            print("(Tắt khóa ngoại / chỉ mục khi nạp Fact chỉ hỗ trợ SQL Server, bỏ qua)")
+            yield
+            return
+
+        with self.engine.begin() as conn:
+            indexes = [row[0] for row in conn.execute(sqlalchemy.text(NONCLUSTERED_INDEXES_SQL),
+                                                      {'table_name': FACT_TABLE})]
+            conn.exec_driver_sql(f"ALTER TABLE {FACT_TABLE} NOCHECK CONSTRAINT ALL")
+            for name in indexes:
+                conn.exec_driver_sql(f"ALTER INDEX {name} ON {FACT_TABLE} DISABLE")
+        print(f"Đã tắt khóa ngoại và {len(indexes)} chỉ mục non-clustered của {FACT_TABLE} trong lúc nạp.")
+        try:
+            yield
+        finally:
+            print(f"Đang dựng lại chỉ mục và kiểm tra lại khóa ngoại của {FACT_TABLE}...")
+            start = time.perf_counter()
+            with self.engine.begin() as conn:
+                for name in indexes:
+                    conn.exec_driver_sql(f"ALTER INDEX {name} ON {FACT_TABLE} REBUILD")
+                conn.exec_driver_sql(f"ALTER TABLE {FACT_TABLE} WITH CHECK CHECK CONSTRAINT ALL")
+            print(f"   -> Xong ({time.perf_counter() - start:.1f}s)")
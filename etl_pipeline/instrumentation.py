@@ -0,0 +1,301 @@
+import cProfile
+import io
+import json
+import os
+import pstats
+import resource
+import sys
+import time
+import tracemalloc
+import uuid
+from contextlib import contextmanager
+
+# ==============================================================================
+# Đo lường từng bước của ETL (thời gian, CPU, số dòng, dòng bị loại, bộ nhớ)
+# ==============================================================================
+# Mỗi bước logic được bọc bằng:
+#     with instrumentation.stage('clean_transactions', rows_in=len(df)) as s:
+#         ...
+#         s.rows_out = len(df_clean)
+# và các luật làm sạch gọi instrumentation.reject('<luật>', số_dòng) trong bước đang chạy.
+# Bước được gọi nhiều lần (mỗi khối giao dịch) thì số liệu được cộng dồn theo tên bước.
+#
+# Kết quả:
+#   - JSON lines (--metrics-log): 1 dòng cho mỗi lần chạy 1 bước + 1 dòng tổng kết
+#   - Prometheus textfile (--prometheus-file): cho node_exporter textfile collector
+#   - Tùy chọn cProfile / tracemalloc cho ĐÚNG 1 bước (--profile-stage)
+
+PROFILE_MODES = ('cprofile', 'tracemalloc')
+
+
+def current_rss():
+    # RSS hiện tại (byte) đọc từ /proc; hệ điều hành khác -> None
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss():
+    # ru_maxrss: KB trên Linux, byte trên macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageRecord:
+    def __init__(self, name, rows_in=None, fields=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.rejected = {}
+        self.fields = fields or {}
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.memory_delta = None
+        self.profile = None
+
+    def reject(self, rule, rows):
+        self.rejected[rule] = self.rejected.get(rule, 0) + int(rows)
+
+    def to_dict(self):
+        return {
+            'stage': self.name,
+            **self.fields,
+            'wall_seconds': round(self.wall_seconds, 6),
+            'cpu_seconds': round(self.cpu_seconds, 6),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'rejected': self.rejected,
+            'memory_delta_bytes': self.memory_delta,
+            **({'profile': self.profile} if self.profile else {}),
+        }
+
+
+class RunMetrics:
+    def __init__(self, log_path=None, prometheus_path=None, profile_stage=None, profile_mode='cprofile',
+                 profile_dir='.'):
+        if profile_mode not in PROFILE_MODES:
+            raise ValueError(f"Chế độ profile không hỗ trợ: {profile_mode}")
+        self.run_id = uuid.uuid4().hex[:12]
+        self.started = time.time()
+        self.log_path = log_path
+        self.prometheus_path = prometheus_path
+        self.profile_stage = profile_stage
+        self.profile_mode = profile_mode
+        self.profile_dir = profile_dir
+        self.profiler = None
+        self.totals = {}  # tên bước -> số liệu cộng dồn
+        self.stack = []
+
+    # --- Ghi nhận ---
+
+    @contextmanager
+    def stage(self, name, rows_in=None, **fields):
+        record = StageRecord(name, rows_in, fields)
+        self.stack.append(record)
+        profiling = name == self.profile_stage
+        if profiling:
+            self._start_profile()
+        rss_before = current_rss()
+        wall_start, cpu_start = time.perf_counter(), time.process_time()
+        try:
+            yield record
+        finally:
+            record.wall_seconds = time.perf_counter() - wall_start
+            record.cpu_seconds = time.process_time() - cpu_start
+            rss_after = current_rss()
+            if rss_before is not None and rss_after is not None:
+                record.memory_delta = rss_after - rss_before
+            if profiling:
+                record.profile = self._stop_profile(name)
+            self.stack.pop()
+            self._accumulate(record)
+            self._log({'event': 'stage', **record.to_dict()})
+
+    def reject(self, rule, rows):
+        # Ghi số dòng bị loại theo luật vào bước đang chạy (ngoài mọi bước -> bỏ qua)
+        if self.stack:
+            self.stack[-1].reject(rule, rows)
+
+    def iter_stage(self, name, iterable, rows=len):
+        # Đo thời gian lấy từng phần tử của 1 iterator (ví dụ: stream giao dịch theo khối)
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name) as record:
+                item = next(iterator, StopIteration)
+                if item is not StopIteration:
+                    record.rows_out = rows(item)
+            if item is StopIteration:
+                return
+            yield item
+
+    def _total(self, name):
+        return self.totals.setdefault(name, {
+            'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0, 'rows_in': 0, 'rows_out': 0,
+            'rejected': {}, 'memory_delta_bytes': 0,
+        })
+
+    def _accumulate(self, record):
+        total = self._total(record.name)
+        total['calls'] += 1
+        total['wall_seconds'] += record.wall_seconds
+        total['cpu_seconds'] += record.cpu_seconds
+        total['rows_in'] += record.rows_in or 0
+        total['rows_out'] += record.rows_out or 0
+        total['memory_delta_bytes'] += record.memory_delta or 0
+        for rule, rows in record.rejected.items():
+            total['rejected'][rule] = total['rejected'].get(rule, 0) + rows
+
+    def merge(self, totals):
+        # Cộng dồn số liệu do tiến trình khác ghi nhận (ví dụ: tiến trình con của transform song song).
+        # Thời gian wall của các tiến trình được cộng lại (giống thời gian CPU), không phải thời gian thực.
+        for name, other in totals.items():
+            total = self._total(name)
+            for key in ('calls', 'wall_seconds', 'cpu_seconds', 'rows_in', 'rows_out', 'memory_delta_bytes'):
+                total[key] += other[key]
+            for rule, rows in other['rejected'].items():
+                total['rejected'][rule] = total['rejected'].get(rule, 0) + rows
+
+    # --- Profile 1 bước ---
+
+    def _start_profile(self):
+        if self.profile_mode == 'cprofile':
+            self.profiler = self.profiler or cProfile.Profile()
+            self.profiler.enable()
+        else:
+            tracemalloc.start()
+
+    def _stop_profile(self, name):
+        if self.profile_mode == 'cprofile':
+            # Gộp mọi lần gọi của bước vào 1 file .prof (ghi đè mỗi lần, file cuối là tổng)
+            self.profiler.disable()
+            os.makedirs(self.profile_dir, exist_ok=True)
+            path = os.path.join(self.profile_dir, f"{name}.prof")
+            self.profiler.dump_stats(path)
+            text = io.StringIO()
+            pstats.Stats(self.profiler, stream=text).sort_stats('cumulative').print_stats(15)
+            with open(os.path.join(self.profile_dir, f"{name}.txt"), 'w', encoding='utf-8') as f:
+                f.write(text.getvalue())
+            return {'mode': 'cprofile', 'file': path}
+
+        snapshot = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        top = snapshot.statistics('lineno')[:10]
+        return {
+            'mode': 'tracemalloc',
+            'peak_traced_bytes': peak,
+            'top_allocations': [{'line': str(s.traceback), 'bytes': s.size, 'count': s.count} for s in top],
+        }
+
+    # --- Xuất kết quả ---
+
+    def _log(self, event):
+        if self.log_path is None:
+            return
+        event = {'ts': round(time.time(), 3), 'run_id': self.run_id, **event}
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(event, ensure_ascii=False, default=str) + '\n')
+
+    def summary(self):
+        return {
+            'run_id': self.run_id,
+            'duration_seconds': round(time.time() - self.started, 3),
+            'peak_rss_bytes': peak_rss(),
+            'stages': self.totals,
+        }
+
+    def finish(self, status='success'):
+        summary = {**self.summary(), 'status': status}
+        self._log({'event': 'run_summary', **summary})
+        if self.prometheus_path:
+            write_prometheus(self.prometheus_path, summary)
+        return summary
+
+    def print_summary(self):
+        print("\n--- Thời gian từng bước ---")
+        print(f"{'Bước':32s} {'Wall (s)':>9s} {'CPU (s)':>9s} {'Dòng vào':>12s} {'Dòng ra':>12s} {'Bộ nhớ (MB)':>12s}")
+        for name, total in self.totals.items():
+            print(f"{name:32s} {total['wall_seconds']:9.2f} {total['cpu_seconds']:9.2f} {total['rows_in']:12,} "
+                  f"{total['rows_out']:12,} {total['memory_delta_bytes'] / 2**20:12.1f}")
+            for rule, rows in total['rejected'].items():
+                print(f"   - loại ({rule}): {rows:,} dòng")
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+PROMETHEUS_METRICS = [
+    ('etl_stage_wall_seconds', 'wall_seconds', 'Thời gian thực của bước ETL (giây)'),
+    ('etl_stage_cpu_seconds', 'cpu_seconds', 'Thời gian CPU của tiến trình trong bước ETL (giây)'),
+    ('etl_stage_rows_in', 'rows_in', 'Số dòng đầu vào của bước ETL'),
+    ('etl_stage_rows_out', 'rows_out', 'Số dòng đầu ra của bước ETL'),
+    ('etl_stage_memory_delta_bytes', 'memory_delta_bytes', 'Thay đổi RSS trong bước ETL (byte)'),
+    ('etl_stage_calls', 'calls', 'Số lần bước ETL được gọi trong lần chạy'),
+]
+
+
+def write_prometheus(path, summary):
+    # Textfile cho node_exporter: ghi ra file tạm rồi đổi tên để collector không đọc file dở
+    lines = []
+    for metric, key, help_text in PROMETHEUS_METRICS:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+        for name, total in summary['stages'].items():
+            lines.append(f'{metric}{{stage="{_escape(name)}"}} {total[key]}')
+
+    lines += ["# HELP etl_rows_rejected Số dòng bị loại theo luật làm sạch", "# TYPE etl_rows_rejected gauge"]
+    for name, total in summary['stages'].items():
+        for rule, rows in total['rejected'].items():
+            lines.append(f'etl_rows_rejected{{stage="{_escape(name)}",rule="{_escape(rule)}"}} {rows}')
+
+    status = 1 if summary['status'] == 'success' else 0
+    lines += [
+        "# HELP etl_run_duration_seconds Tổng thời gian lần chạy ETL gần nhất (giây)",
+        "# TYPE etl_run_duration_seconds gauge",
+        f"etl_run_duration_seconds {summary['duration_seconds']}",
+        "# HELP etl_run_peak_rss_bytes Peak RSS của tiến trình ETL (byte)",
+        "# TYPE etl_run_peak_rss_bytes gauge",
+        f"etl_run_peak_rss_bytes {summary['peak_rss_bytes']}",
+        "# HELP etl_run_success 1 nếu lần chạy ETL gần nhất thành công",
+        "# TYPE etl_run_success gauge",
+        f"etl_run_success {status}",
+        "# HELP etl_run_finished_timestamp_seconds Thời điểm kết thúc lần chạy ETL gần nhất",
+        "# TYPE etl_run_finished_timestamp_seconds gauge",
+        f"etl_run_finished_timestamp_seconds {time.time():.0f}",
+    ]
+
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write('\n'.join(lines) + '\n')
+    os.replace(tmp_path, path)
+
+
+# ==============================================================================
+# Lần chạy hiện tại (mặc định chỉ ghi nhận trong bộ nhớ, không ghi file)
+# ==============================================================================
+
+_current = RunMetrics()
+
+
+def start_run(**kwargs):
+    global _current
+    _current = RunMetrics(**kwargs)
+    return _current
+
+
+def current():
+    return _current
+
+
+def stage(name, rows_in=None, **fields):
+    return _current.stage(name, rows_in, **fields)
+
+
+def reject(rule, rows):
+    _current.reject(rule, rows)
+
+
+def iter_stage(name, iterable, rows=len):
+    return _current.iter_stage(name, iterable, rows)
@@ -0,0 +1,77 @@
+import numpy as np
+import pandas as pd
+
+from schemas import KEY_DTYPE
+
+# ==============================================================================
+# Tra cứu Surrogate Key cho bảng Fact bằng chỉ mục (thay cho chuỗi pd.merge)
+# ==============================================================================
+# Mỗi bảng tra cứu (Natural Key -> Key) được dựng thành 1 pd.Index đúng 1 lần và chỉ dựng
+# lại khi bản đồ Key của Dim thay đổi. Mỗi cột khóa tự nhiên của khối giao dịch được đổi
+# thẳng thành 1 mảng int32 bằng Index.get_indexer (cột category: chỉ tra các category,
+# sau đó lấy theo mã số). Không copy cả bảng giao dịch, không sinh cột thừa.
+# Giá trị không tìm thấy -> MISSING_KEY (-1) để nơi gọi báo cáo thay vì âm thầm bỏ qua.
+
+MISSING_KEY = -1
+
+
+class KeyIndex:
+    # Bảng tra cứu: khóa (không trùng) -> giá trị int32
+    def __init__(self, keys, values):
+        self.index = pd.Index(keys)
+        self.values = np.asarray(values, dtype=KEY_DTYPE)
+
+    def positions(self, column):
+        # Vị trí trong self.index của từng giá trị (-1 nếu không có)
+        if isinstance(column.dtype, pd.CategoricalDtype):
+            category_pos = self.index.get_indexer(column.cat.categories)
+            codes = column.cat.codes.to_numpy()
+            # Khối toàn NULL (ví dụ: khối chỉ có giao dịch P2P) -> không có category nào để tra
+            if not len(category_pos):
+                return np.full(len(codes), -1, dtype=np.intp)
+            # Mã -1 (NULL) được thay tạm bằng 0 trước khi lấy theo vị trí, sau đó mới che lại
+            return np.where(codes >= 0, category_pos[np.where(codes >= 0, codes, 0)], -1)
+        return self.index.get_indexer(column)
+
+    def take(self, column):
+        if not len(self.index):
+            return np.full(len(column), MISSING_KEY, dtype=KEY_DTYPE)
+        pos = self.positions(column)
+        return np.where(pos >= 0, self.values[pos], MISSING_KEY).astype(KEY_DTYPE, copy=False)
+
+
+class KeyResolver:
+    # Dùng chung cho mọi khối giao dịch của 1 lần chạy
+    def __init__(self, keystore, df_accounts_clean):
+        self.keystore = keystore
+        self.lookups = {}  # tên Dim -> (phiên bản bản đồ Key, KeyIndex)
+        # Giao dịch không có CustomerID -> lấy chủ tài khoản từ danh sách tài khoản sạch
+        self.account_owner = KeyIndex(df_accounts_clean['AccountID'].to_numpy(),
+                                      df_accounts_clean['CustomerID'].to_numpy())
+
+    def lookup(self, table_name):
+        key_map = self.keystore[table_name]
+        # Key chỉ được thêm (không đổi / xóa) -> (số Key, Key lớn nhất) đủ để biết bản đồ đã đổi
+        version = (len(key_map.keys), key_map.max_key)
+        cached = self.lookups.get(table_name)
+        if cached is None or cached[0] != version:
+            cached = (version, KeyIndex(list(key_map.keys.keys()), list(key_map.keys.values())))
+            self.lookups[table_name] = cached
+        return cached[1]
+
+    def resolve(self, table_name, column):
+        # Cột Natural Key -> mảng Surrogate Key int32 (MISSING_KEY nếu Dim chưa có)
+        return self.lookup(table_name).take(column)
+
+    def resolve_merchant(self, df_transactions):
+        # Tên Merchant cuối cùng = MerchantName, rỗng (P2P) thì lấy BeneficiaryName
+        merchant = df_transactions['MerchantName']
+        keys = self.resolve('Dim_Merchant', merchant)
+        p2p = merchant.isna().to_numpy()
+        if p2p.any():
+            keys[p2p] = self.resolve('Dim_Merchant', df_transactions['BeneficiaryName'][p2p])
+        return keys
+
+    def owners(self, account_ids):
+        # AccountID -> CustomerID (MISSING_KEY nếu tài khoản không có trong danh sách sạch)
+        return self.account_owner.take(account_ids)
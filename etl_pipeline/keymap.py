@@ -0,0 +1,123 @@
+import os
+import pickle
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+from schemas import KEY_DTYPE
+
+# ==============================================================================
+# Quản lý Surrogate Key ngay trong tiến trình ETL
+# ==============================================================================
+# Thay vì để SQL Server tự sinh IDENTITY rồi đọc lại toàn bộ bảng Dim để lấy Key,
+# ETL tự cấp Key (max + 1, +2, ...) khi nạp Dim và giữ bản đồ
+# Natural Key -> Surrogate Key trong bộ nhớ. Bản đồ được lưu ra file giữa các lần
+# chạy; đầu mỗi lần chạy chỉ cần 1 truy vấn COUNT/MAX nhỏ để kiểm tra còn khớp kho.
+
+DEFAULT_KEYMAP_FILE = 'etl_keymap.pkl'
+
+# Bảng Dim -> (cột Surrogate Key, cột Natural Key)
+# Dim_Date dùng luôn Date_Key làm khóa tự nhiên nên chỉ cần ghi nhớ tập khóa đã có.
+DIM_KEYS = {
+    'Dim_Date': ('Date_Key', 'Date_Key'),
+    'Dim_Customer': ('Customer_Key', 'CustomerID_Source'),
+    'Dim_Account': ('Account_Key', 'AccountID_Source'),
+    'Dim_Merchant': ('Merchant_Key', 'MerchantName_Source'),
+    'Dim_Location': ('Location_Key', 'Transaction_Country'),
+}
+
+
+class SurrogateKeyMap:
+    def __init__(self, table_name, key_col, natural_col):
+        self.table_name = table_name
+        self.key_col = key_col
+        self.natural_col = natural_col
+        self.keys = {}
+        self.max_key = 0
+
+    @property
+    def assigns_keys(self):
+        return self.key_col != self.natural_col
+
+    def reset(self, df=None):
+        # Nạp lại bản đồ từ DataFrame (key_col, natural_col) đọc từ kho
+        self.keys, self.max_key = {}, 0
+        if df is not None and not df.empty:
+            df = df.sort_values(self.key_col).drop_duplicates(subset=[self.natural_col], keep='first')
+            self.keys = dict(zip(df[self.natural_col].tolist(), df[self.key_col].astype(int).tolist()))
+            self.max_key = int(df[self.key_col].max())
+
+    def new_rows(self, df):
+        # Giữ lại các dòng có Natural Key chưa có Key
+        return df[~df[self.natural_col].isin(list(self.keys.keys()))]
+
+    def assign(self, df, include_existing=False):
+        # Cấp Key liên tiếp cho các dòng MỚI, trả về df đã có cột key_col ở đầu.
+        # include_existing=True: giữ cả dòng đã có Key (để UPDATE) kèm Key hiện tại.
+        df = df.drop_duplicates(subset=[self.natural_col], keep='last')
+        if not include_existing:
+            df = self.new_rows(df)
+        if not self.assigns_keys:
+            return df
+        keys = df[self.natural_col].map(self.keys)
+        is_new = keys.isna()
+        if is_new.any():
+            keys[is_new] = list(range(self.max_key + 1, self.max_key + 1 + int(is_new.sum())))
+        return df.assign(**{self.key_col: keys.astype('int64')})[[self.key_col] + list(df.columns)]
+
+    def commit(self, df_loaded):
+        # Ghi nhớ Key của các dòng đã nạp thành công vào kho (kết quả OUTPUT của MERGE)
+        if df_loaded is None or df_loaded.empty:
+            return
+        self.keys.update(zip(df_loaded[self.natural_col].tolist(), df_loaded[self.key_col].astype(int).tolist()))
+        self.max_key = max(self.max_key, int(df_loaded[self.key_col].max()))
+
+    def to_frame(self):
+        # Trả về bảng tra cứu (key_col, natural_col) giống kết quả SELECT từ kho
+        return pd.DataFrame({
+            self.key_col: np.fromiter(self.keys.values(), dtype=KEY_DTYPE, count=len(self.keys)),
+            self.natural_col: list(self.keys.keys()),
+        })
+
+
+class KeyStore:
+    def __init__(self, path=DEFAULT_KEYMAP_FILE):
+        self.path = path
+        self.maps = {table: SurrogateKeyMap(table, key_col, natural_col)
+                     for table, (key_col, natural_col) in DIM_KEYS.items()}
+
+    def __getitem__(self, table_name):
+        return self.maps[table_name]
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, 'rb') as f:
+            saved = pickle.load(f)
+        for table_name, (keys, max_key) in saved.items():
+            if table_name in self.maps:
+                self.maps[table_name].keys = keys
+                self.maps[table_name].max_key = max_key
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({t: (m.keys, m.max_key) for t, m in self.maps.items()}, f)
+        os.replace(tmp_path, self.path)
+
+    def sync(self, conn):
+        # Kiểm tra nhanh (COUNT, MAX) từng bảng Dim; chỉ đọc lại bảng nào không khớp
+        rebuilt = []
+        for table_name, key_map in self.maps.items():
+            row = conn.execute(sqlalchemy.text(
+                f"SELECT COUNT(*), MAX({key_map.key_col}) FROM {table_name}"
+            )).one()
+            count, max_key = int(row[0]), int(row[1] or 0)
+            if count == len(key_map.keys) and max_key == key_map.max_key:
+                continue
+            # Dim_Date: Key cũng là khóa tự nhiên -> chỉ đọc 1 cột (tránh trùng tên cột)
+            columns = ', '.join(dict.fromkeys([key_map.key_col, key_map.natural_col]))
+            key_map.reset(pd.read_sql(f"SELECT {columns} FROM {table_name}", conn) if count else None)
+            rebuilt.append(table_name)
+        return rebuilt
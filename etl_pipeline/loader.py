@@ -0,0 +1,130 @@
+import pandas as pd
+
+import schemas
+
+# ==============================================================================
+# Nạp dữ liệu an toàn khi chạy lại (Idempotent): Staging + MERGE
+# ==============================================================================
+# 1. Bulk insert DataFrame vào bảng staging (cùng kiểu cột với bảng đích)
+# 2. MERGE từ staging vào bảng đích theo khóa tự nhiên:
+#      - Khớp khóa     -> UPDATE (Dim) hoặc bỏ qua (Fact)
+#      - Chưa có khóa  -> INSERT
+# Chạy lại ETL hay thử lại sau khi lỗi giữa chừng đều không sinh dòng trùng.
+# Trên engine nhúng (SQLite / DuckDB) MERGE được thay bằng INSERT ... ON CONFLICT tương đương.
+
+
+def staging_name(table_name, suffix=''):
+    return f"stg_{table_name}{suffix}"
+
+
+def create_staging_sql(table_name, staging, columns, identity_col=None, dialect='mssql'):
+    # Trả về danh sách câu lệnh tạo bảng staging rỗng, cùng kiểu cột với bảng đích
+    if dialect != 'mssql':
+        return [
+            f"DROP TABLE IF EXISTS {staging}",
+            f"CREATE TABLE {staging} AS SELECT {', '.join(columns)} FROM {table_name} LIMIT 0",
+        ]
+    # SELECT TOP 0 ... INTO giữ nguyên kiểu cột của bảng đích.
+    # Cột IDENTITY được CAST để bảng staging không kế thừa thuộc tính IDENTITY.
+    select_list = ', '.join(
+        f"CAST({c} AS BIGINT) AS {c}" if c == identity_col else c for c in columns
+    )
+    return [
+        f"IF OBJECT_ID('{staging}', 'U') IS NOT NULL DROP TABLE {staging}; "
+        f"SELECT TOP 0 {select_list} INTO {staging} FROM {table_name};"
+    ]
+
+
+def combine_sql(target, source, op):
+    # Gộp giá trị cũ (target) với giá trị mới (source): 'sum' cộng dồn, 'min' / 'max' giữ giá trị nhỏ / lớn hơn
+    if op == 'min':
+        return f"CASE WHEN {source} < {target} THEN {source} ELSE {target} END"
+    if op == 'max':
+        return f"CASE WHEN {source} > {target} THEN {source} ELSE {target} END"
+    return f"{target} + {source}"
+
+
+def _combine_op(accumulate, col):
+    # accumulate=True: mọi cột là 'sum'; dict: {cột: 'sum' | 'min' | 'max'} (cột không có -> 'sum')
+    return accumulate.get(col, 'sum') if isinstance(accumulate, dict) else 'sum'
+
+
+def merge_sql(table_name, staging, columns, key_cols, update=True, output_cols=None, identity_col=None,
+              accumulate=False):
+    # accumulate: khớp khóa thì CỘNG DỒN / gộp giá trị (dùng cho bảng tổng hợp) thay vì ghi đè
+    on_clause = ' AND '.join(f"t.{k} = s.{k}" for k in key_cols)
+    # Không bao giờ ghi đè Surrogate Key của dòng đã có
+    set_cols = [c for c in columns if c not in key_cols and c != identity_col]
+    insert_cols = ', '.join(columns)
+    insert_values = ', '.join(f"s.{c}" for c in columns)
+
+    sql = f"MERGE {table_name} WITH (HOLDLOCK) AS t USING {staging} AS s ON {on_clause}"
+    if update and set_cols:
+        sql += " WHEN MATCHED THEN UPDATE SET " + ', '.join(
+            f"t.{c} = {combine_sql(f't.{c}', f's.{c}', _combine_op(accumulate, c))}" if accumulate
+            else f"t.{c} = s.{c}" for c in set_cols)
+    sql += f" WHEN NOT MATCHED BY TARGET THEN INSERT ({insert_cols}) VALUES ({insert_values})"
+    if output_cols:
+        sql += " OUTPUT " + ', '.join(f"inserted.{c}" for c in output_cols)
+    return sql + ';'
+
+
+def upsert_sql(table_name, staging, columns, key_cols, update=True, output_cols=None, identity_col=None,
+               accumulate=False):
+    # SQLite (>= 3.35) / DuckDB: INSERT ... ON CONFLICT ... RETURNING thay cho MERGE ... OUTPUT.
+    # Cần chỉ mục UNIQUE trên key_cols (mục 2.3 của schema.sql).
+    set_cols = [c for c in columns if c not in key_cols and c != identity_col]
+    col_list = ', '.join(columns)
+
+    # "WHERE true": SQLite cần để phân biệt ON CONFLICT với mệnh đề JOIN ... ON
+    sql = (f"INSERT INTO {table_name} ({col_list}) SELECT {col_list} FROM {staging} WHERE true "
+           f"ON CONFLICT ({', '.join(key_cols)}) ")
+    if update and set_cols:
+        sql += "DO UPDATE SET " + ', '.join(
+            f"{c} = {combine_sql(f'{table_name}.{c}', f'excluded.{c}', _combine_op(accumulate, c))}" if accumulate
+            else f"{c} = excluded.{c}" for c in set_cols)
+    else:
+        sql += "DO NOTHING"
+    if output_cols:
+        sql += " RETURNING " + ', '.join(output_cols)
+    return sql
+
+
+def bulk_upsert(df, table_name, key_cols, engine, identity_col=None, update=True,
+                output_cols=None, staging_suffix=''):
+    # Trả về (số dòng bị ảnh hưởng, DataFrame OUTPUT nếu có yêu cầu output_cols)
+    with engine.begin() as conn:
+        return upsert_frame(conn, df, table_name, key_cols, identity_col=identity_col, update=update,
+                            output_cols=output_cols, staging_suffix=staging_suffix)
+
+
+def upsert_frame(conn, df, table_name, key_cols, identity_col=None, update=True, output_cols=None,
+                 staging_suffix='', accumulate=False):
+    # Giống bulk_upsert nhưng chạy trong transaction của conn (để gộp với các câu lệnh khác)
+    # MERGE báo lỗi nếu staging có 2 dòng cùng khóa -> giữ dòng cuối cùng
+    df = schemas.to_database(df.drop_duplicates(subset=key_cols, keep='last'))
+    columns = list(df.columns)
+    staging = staging_name(table_name, staging_suffix)
+    dialect = conn.dialect.name
+    # SQLite / DuckDB cho phép ghi thẳng giá trị vào cột tự tăng, không cần IDENTITY_INSERT
+    identity_insert = identity_col and dialect == 'mssql'
+    statement_sql = merge_sql if dialect == 'mssql' else upsert_sql
+
+    for sql in create_staging_sql(table_name, staging, columns, identity_col, dialect):
+        conn.exec_driver_sql(sql)
+    df.to_sql(staging, con=conn, if_exists='append', index=False)
+
+    if identity_insert:
+        conn.exec_driver_sql(f"SET IDENTITY_INSERT {table_name} ON")
+    try:
+        result = conn.exec_driver_sql(statement_sql(table_name, staging, columns, key_cols, update, output_cols,
+                                                    identity_col, accumulate))
+        output = pd.DataFrame(result.fetchall(), columns=output_cols) if output_cols else None
+        affected = len(output) if output_cols else result.rowcount
+    finally:
+        # MERGE lỗi cũng phải tắt lại: session trong pool giữ IDENTITY_INSERT cho tới khi bị đóng
+        if identity_insert:
+            conn.exec_driver_sql(f"SET IDENTITY_INSERT {table_name} OFF")
+
+    conn.exec_driver_sql(f"DROP TABLE {staging}")
+    return affected, output
@@ -0,0 +1,127 @@
+import hashlib
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import sqlalchemy
+
+import aggregates
+
+try:
+    import pyarrow  # noqa: F401  (pd.to_feather / pd.read_feather cần pyarrow)
+except ImportError:  # pyarrow là tùy chọn, không có thì luôn truy vấn trực tiếp
+    pyarrow = None
+
+# ==============================================================================
+# Cache kết quả truy vấn dashboard
+# ==============================================================================
+# Khóa cache = (tên truy vấn, nội dung SQL, "phiên bản" kho dữ liệu).
+# Phiên bản kho = MAX(Transaction_Key) + COUNT(*) của Fact_Spending + Agg_Watermark (Key đã cộng
+# dồn, số lần --rebuild-aggregates): chỉ đổi khi ETL nạp thêm Fact / cộng dồn hoặc tính lại bảng
+# tổng hợp, nên vẽ lại dashboard khi kho không đổi sẽ không chạy truy vấn nặng nào.
+# Kết quả lưu dạng cột (Arrow/Feather) trong <cache_dir>/, xóa theo tuổi hoặc tổng dung lượng.
+
+DEFAULT_CACHE_DIR = '.dashboard_cache'
+DEFAULT_MAX_AGE = 7 * 24 * 3600        # 7 ngày
+DEFAULT_MAX_BYTES = 100 * 1024 * 1024  # 100 MB
+
+VERSION_SQL = """
+SELECT
+    (SELECT MAX(Transaction_Key) FROM Fact_Spending),
+    (SELECT COUNT(*) FROM Fact_Spending),
+    (SELECT MAX(Last_Transaction_Key) FROM Agg_Watermark),
+    ({rebuild_count})
+"""
+
+REBUILD_COUNT_SQL = f"SELECT MAX({aggregates.REBUILD_COLUMN}) FROM {aggregates.WATERMARK_TABLE}"
+
+
+def available():
+    return pyarrow is not None
+
+
+def version_stamp(conn):
+    # Kho cũ chưa có cột Rebuild_Count (thêm ở lần --rebuild-aggregates đầu tiên) -> coi như 0
+    rebuild_count = REBUILD_COUNT_SQL if aggregates.has_rebuild_counter(conn) else '0'
+    max_key, count, agg_key, rebuilds = conn.execute(
+        sqlalchemy.text(VERSION_SQL.format(rebuild_count=rebuild_count))).one()
+    return f"{max_key or 0}-{count}-{agg_key or 0}-{rebuilds or 0}"
+
+
+class QueryCache:
+    def __init__(self, cache_dir=DEFAULT_CACHE_DIR, max_age=DEFAULT_MAX_AGE, max_bytes=DEFAULT_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, name, sql, stamp):
+        digest = hashlib.sha1(f"{sql}\n{stamp}".encode('utf-8')).hexdigest()[:16]
+        return os.path.join(self.cache_dir, f"{name}_{digest}.arrow")
+
+    def get(self, name, sql, stamp):
+        path = self._path(name, sql, stamp)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)  # Đánh dấu vừa dùng (xóa theo dung lượng sẽ bỏ file lâu không dùng trước)
+        return pd.read_feather(path)
+
+    def put(self, name, sql, stamp, df):
+        path = self._path(name, sql, stamp)
+        # Kết quả của phiên bản kho cũ không bao giờ được dùng lại -> xóa luôn
+        for entry in os.listdir(self.cache_dir):
+            if entry.startswith(f"{name}_") and os.path.join(self.cache_dir, entry) != path:
+                os.remove(os.path.join(self.cache_dir, entry))
+        tmp_path = path + '.tmp'
+        df.reset_index(drop=True).to_feather(tmp_path)
+        os.replace(tmp_path, path)
+
+    def evict(self):
+        # Xóa file quá max_age, sau đó xóa file cũ nhất cho tới khi tổng dung lượng <= max_bytes
+        now = time.time()
+        entries = []
+        for entry in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, entry)
+            stat = os.stat(path)
+            if now - stat.st_mtime > self.max_age:
+                os.remove(path)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            os.remove(path)
+            total -= size
+
+
+def run_queries(engine, queries, cache=None, workers=None):
+    # queries: {tên: SQL} -> ({tên: DataFrame}, danh sách truy vấn đã thực sự chạy trên kho)
+    # Truy vấn nào chưa có trong cache thì chạy ĐỒNG THỜI, mỗi truy vấn 1 connection từ pool
+    results, missing = {}, dict(queries)
+    if cache is not None:
+        with engine.connect() as conn:
+            stamp = version_stamp(conn)
+        for name, sql in queries.items():
+            df = cache.get(name, sql, stamp)
+            if df is not None:
+                results[name] = df
+                del missing[name]
+
+    def read(sql):
+        with engine.connect() as conn:
+            return pd.read_sql(sql, conn)
+
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers or len(missing)) as executor:
+            futures = {name: executor.submit(read, sql) for name, sql in missing.items()}
+            for name, future in futures.items():
+                results[name] = future.result()
+                if cache is not None:
+                    cache.put(name, queries[name], stamp, results[name])
+
+    if cache is not None:
+        cache.evict()
+    return results, sorted(missing)
@@ -0,0 +1,105 @@
+from decimal import Decimal
+
+import pandas as pd
+
+# ==============================================================================
+# Kiểu cột (dtype) gọn cho mọi DataFrame của pipeline
+# ==============================================================================
+# Mặc định pandas giữ chuỗi dạng object / int64 / float64 cho mọi cột. Chính sách ở đây:
+#   - Chuỗi ít giá trị khác nhau (Gender, City, AccountType, MerchantName, Category...)
+#     -> category: mỗi dòng chỉ là 1 mã số nhỏ, merge / drop_duplicates so sánh mã số
+#   - ID nguồn và Surrogate Key -> int32 (Int32 nếu cột cho phép NULL); TransactionID giữ int64
+#   - Amount -> số nguyên đơn vị nhỏ nhất (xu = 1/100 đồng), cộng trừ chính xác tuyệt đối.
+#     Đổi ngay trong câu SELECT (CAST(ROUND(Amount * 100, 0) AS BIGINT)) nên không đi qua float.
+# Kiểu được áp dụng ngay lúc đọc (pd.read_sql(dtype=..., parse_dates=...)).
+#
+# Lưu ý: TransactionDescription / BeneficiaryName / tên khách hàng nhiều giá trị khác nhau
+# nên vẫn là chuỗi thường (NULL phải giữ là None cho bộ phân loại P2P).
+
+AMOUNT_SCALE = 100
+
+# Cột tiền tệ lưu dạng số nguyên xu trong pipeline, đổi lại DECIMAL(18, 2) khi nạp vào kho
+MONEY_COLUMNS = ['Amount', 'Amount_Spent', 'Total_Spent', 'Foreign_Spent']
+
+SOURCE_DTYPES = {
+    'tbl_Customers': {
+        'CustomerID': 'int32', 'Gender': 'category', 'City': 'category', 'Country': 'category',
+    },
+    'tbl_Accounts': {
+        'AccountID': 'int32', 'CustomerID': 'Int32', 'AccountType': 'category',
+    },
+    'tbl_Transactions': {
+        'TransactionID': 'int64', 'AccountID': 'Int32', 'MerchantName': 'category', 'Amount': 'Int64',
+        'TransactionCountry': 'category',
+    },
+}
+
+SOURCE_DATES = {
+    'tbl_Customers': ['BirthDate'],
+    'tbl_Accounts': ['OpenDate'],
+    'tbl_Transactions': ['TransactionTimestamp'],
+}
+
+# Cột của tbl_Transactions khi đọc (Amount đổi sang xu ngay trên server)
+TRANSACTION_COLUMNS = (
+    "TransactionID, AccountID, MerchantName, "
+    f"CAST(ROUND(Amount * {AMOUNT_SCALE}, 0) AS BIGINT) AS Amount, "
+    "TransactionTimestamp, TransactionCountry, BeneficiaryName, TransactionDescription"
+)
+
+# Các DataFrame Star Schema do ETL tạo ra
+STAR_DTYPES = {
+    'Dim_Customer': {'CustomerID_Source': 'int32', 'Age_Group': 'category', 'Gender': 'category',
+                     'City': 'category', 'Country': 'category'},
+    'Dim_Account': {'AccountID_Source': 'int32', 'Account_Type': 'category'},
+    'Dim_Merchant': {'Category': 'category'},
+    'Dim_Location': {'Transaction_Region': 'category'},
+    'Fact_Spending': {'TransactionID_Source': 'int64', 'Date_Key': 'int32', 'Customer_Key': 'int32',
+                      'Account_Key': 'int32', 'Merchant_Key': 'int32', 'Location_Key': 'int32',
+                      'Amount_Spent': 'Int64', 'Transaction_Count': 'int8'},
+}
+
+KEY_DTYPE = 'int32'
+
+
+def read_options(table_name):
+    # Tham số cho pd.read_sql: ép kiểu + đổi cột ngày ngay khi đọc
+    if table_name is None:
+        return {}
+    return {'dtype': SOURCE_DTYPES[table_name], 'parse_dates': SOURCE_DATES[table_name]}
+
+
+def apply(df, table_name):
+    # Ép kiểu 1 DataFrame đã có (snapshot, kết quả pd.concat...) theo chính sách của bảng
+    dtypes = {**SOURCE_DTYPES, **STAR_DTYPES}[table_name]
+    dtypes = {col: dtype for col, dtype in dtypes.items() if col in df.columns and df[col].dtype != dtype}
+    df = df.astype(dtypes) if dtypes else df
+    for col in SOURCE_DATES.get(table_name, []):
+        if col in df.columns and not pd.api.types.is_datetime64_any_dtype(df[col]):
+            df[col] = pd.to_datetime(df[col])
+    return df
+
+
+def concat(frames, table_name):
+    # pd.concat các khối có tập category khác nhau sẽ trả về object -> ép kiểu lại
+    return apply(pd.concat(frames, ignore_index=True), table_name)
+
+
+def to_decimal(cents):
+    # Series số nguyên xu -> Series object decimal.Decimal (NULL -> None), chính xác tuyệt đối
+    values = cents.to_numpy(dtype=object, na_value=None)
+    return pd.Series([None if v is None else Decimal(int(v)) / AMOUNT_SCALE for v in values],
+                     index=cents.index, dtype=object)
+
+
+def to_database(df):
+    # Trước khi ghi vào kho: cột tiền tệ (xu) -> decimal.Decimal 2 chữ số thập phân cho cột DECIMAL(18, 2).
+    # Không đi qua float: giá trị ghi vào kho đúng bằng số xu đã tính trong pipeline.
+    money = [c for c in MONEY_COLUMNS if c in df.columns and pd.api.types.is_integer_dtype(df[c])]
+    if not money:
+        return df
+    return df.assign(**{c: to_decimal(df[c]) for c in money})
+
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 2**20
@@ -0,0 +1,239 @@
+import argparse
+import glob
+import os
+import re
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+import sqlalchemy
+
+import backends
+
+# ==============================================================================
+# Nạp nhanh dữ liệu thô (data_source/tbl_*/*.sql) vào tbl_Customers, tbl_Accounts, tbl_Transactions
+# ==============================================================================
+# Các file nguồn là hàng chục nghìn câu "INSERT INTO ... VALUES (...)" 1 dòng.
+# Thay vì chạy cả file trong Azure Data Studio / SSMS (dễ tràn bộ nhớ), script này:
+#   1. Đọc file theo dòng (không nạp cả file vào RAM) và tách từng bộ giá trị
+#   2. Gom thành lô N dòng rồi gửi bằng executemany (fast_executemany của pyodbc)
+#   3. Nạp theo thứ tự khóa ngoại: Customers -> Accounts -> Transactions,
+#      các file của cùng 1 bảng được đọc và nạp song song
+# Dòng có khóa chính đã tồn tại sẽ được bỏ qua -> chạy lại (sau khi lỗi giữa chừng) an toàn.
+
+DEFAULT_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data_source')
+
+# Thứ tự nạp (bảng cha trước) và khóa chính của từng bảng
+SEED_TABLES = [
+    ('tbl_Customers', 'CustomerID'),
+    ('tbl_Accounts', 'AccountID'),
+    ('tbl_Transactions', 'TransactionID'),
+]
+
+DEFAULT_BATCH_SIZE = 5000
+
+INSERT_RE = re.compile(r"\s*INSERT\s+INTO\s+\[?(\w+)\]?\s*\(([^)]*)\)\s*VALUES\s*", re.IGNORECASE)
+
+# 1 giá trị trong bộ (...): chuỗi '...' / N'...' ('' là dấu nháy), NULL hoặc số
+VALUE_RE = re.compile(
+    r"\s*(?:N?'((?:[^']|'')*)'|(NULL)|([-+]?\d+(?:\.\d*)?(?:[eE][-+]?\d+)?))\s*([,)])",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+class SeedParseError(ValueError):
+    pass
+
+
+def _convert(text, is_null, number):
+    if text is not None:
+        return text.replace("''", "'")
+    if is_null:
+        return None
+    # DECIMAL giữ chính xác (Amount), số nguyên -> int
+    if '.' in number or 'e' in number.lower():
+        return Decimal(number)
+    return int(number)
+
+
+def parse_values(sql, pos):
+    # Đọc các bộ (...), (...) bắt đầu từ vị trí pos -> danh sách tuple
+    rows = []
+    while True:
+        while pos < len(sql) and sql[pos].isspace():
+            pos += 1
+        if pos >= len(sql) or sql[pos] != '(':
+            raise SeedParseError(f"Thiếu '(' tại vị trí {pos}: {sql[pos:pos + 50]!r}")
+        pos += 1
+
+        row = []
+        while True:
+            m = VALUE_RE.match(sql, pos)
+            if not m:
+                raise SeedParseError(f"Không đọc được giá trị tại vị trí {pos}: {sql[pos:pos + 50]!r}")
+            text, is_null, number, sep = m.groups()
+            row.append(_convert(text, is_null, number))
+            pos = m.end()
+            if sep == ')':
+                break
+        rows.append(tuple(row))
+
+        # Câu INSERT nhiều bộ: VALUES (...), (...)
+        while pos < len(sql) and sql[pos].isspace():
+            pos += 1
+        if pos < len(sql) and sql[pos] == ',':
+            pos += 1
+            continue
+        return rows
+
+
+def parse_insert(sql):
+    # "INSERT INTO t (a, b) VALUES (1, N'x'), (2, NULL)" -> ('t', ['a', 'b'], [(1, 'x'), (2, None)])
+    m = INSERT_RE.match(sql)
+    if not m:
+        return None
+    columns = [c.strip().strip('[]') for c in m.group(2).split(',')]
+    rows = parse_values(sql, m.end())
+    for row in rows:
+        if len(row) != len(columns):
+            raise SeedParseError(f"Số giá trị ({len(row)}) khác số cột ({len(columns)}): {sql[:80]!r}")
+    return m.group(1), columns, rows
+
+
+def iter_statements(path):
+    # Tách file thành từng câu lệnh (kết thúc bằng ';' nằm ngoài chuỗi), đọc theo dòng.
+    # Số dấu nháy chẵn = đang ở ngoài chuỗi ('' trong chuỗi không làm đổi tính chẵn lẻ).
+    buffer, quotes = [], 0
+    with open(path, encoding='utf-8-sig') as f:
+        for line in f:
+            stripped = line.strip()
+            if not buffer and (not stripped or stripped.startswith('--')):
+                continue
+            buffer.append(line)
+            quotes += line.count("'")
+            if quotes % 2 == 0 and stripped.endswith(';'):
+                yield ''.join(buffer).strip().rstrip(';')
+                buffer, quotes = [], 0
+    if buffer and ''.join(buffer).strip():
+        yield ''.join(buffer).strip().rstrip(';')
+
+
+def iter_batches(path, batch_size):
+    # -> (table, columns, [rows...]) với tối đa batch_size dòng mỗi lô
+    current_key, rows = None, []
+    for statement in iter_statements(path):
+        parsed = parse_insert(statement)
+        if parsed is None:
+            continue  # GO, SET ..., comment nhiều dòng...
+        table_name, columns, values = parsed
+        key = (table_name, tuple(columns))
+        if key != current_key and rows:
+            yield current_key[0], list(current_key[1]), rows
+            rows = []
+        current_key = key
+        rows.extend(values)
+        if len(rows) >= batch_size:
+            yield table_name, columns, rows
+            rows = []
+    if rows:
+        yield current_key[0], list(current_key[1]), rows
+
+
+def seed_files(data_dir, table_name):
+    # data_source/tbl_Customers/*.sql, ...
+    return sorted(glob.glob(os.path.join(data_dir, table_name, '*.sql')))
+
+
+def existing_keys(engine, table_name, key_col):
+    with engine.connect() as conn:
+        return {row[0] for row in conn.execute(sqlalchemy.text(f"SELECT {key_col} FROM {table_name}"))}
+
+
+def load_file(engine, path, table_name, key_col, skip_keys, batch_size, dry_run=False):
+    # Nạp 1 file trên 1 connection riêng, commit theo từng lô. Trả về (số dòng đọc, số dòng nạp)
+    read_rows, loaded_rows = 0, 0
+    for batch_table, columns, rows in iter_batches(path, batch_size):
+        if batch_table.lower() != table_name.lower():
+            raise SeedParseError(f"File '{path}' chứa INSERT vào '{batch_table}', không phải '{table_name}'")
+        read_rows += len(rows)
+
+        key_idx = columns.index(key_col)
+        rows = [r for r in rows if r[key_idx] not in skip_keys]
+        if not rows or dry_run:
+            continue
+
+        insert_sql = sqlalchemy.text(
+            f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(':' + c for c in columns)})"
+        )
+        with engine.begin() as conn:
+            conn.execute(insert_sql, [dict(zip(columns, r)) for r in rows])
+        loaded_rows += len(rows)
+    return read_rows, loaded_rows
+
+
+def seed(engine, data_dir=DEFAULT_DATA_DIR, batch_size=DEFAULT_BATCH_SIZE, workers=4, dry_run=False):
+    total = 0
+    for table_name, key_col in SEED_TABLES:
+        files = seed_files(data_dir, table_name)
+        if not files:
+            print(f"   - {table_name}: không có file .sql, bỏ qua.")
+            continue
+
+        skip_keys = set() if dry_run else existing_keys(engine, table_name, key_col)
+        t0 = time.perf_counter()
+        # Các file của cùng 1 bảng chứa khoảng khóa khác nhau -> nạp song song được
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {
+                path: executor.submit(load_file, engine, path, table_name, key_col, skip_keys, batch_size, dry_run)
+                for path in files
+            }
+            results = {path: f.result() for path, f in futures.items()}
+        elapsed = time.perf_counter() - t0
+
+        read_rows = sum(r for r, _ in results.values())
+        loaded_rows = sum(n for _, n in results.values())
+        total += loaded_rows
+        summary = "(chỉ kiểm tra)" if dry_run else \
+            f"nạp {loaded_rows} dòng (bỏ qua {read_rows - loaded_rows} dòng đã có)"
+        print(f"   - {table_name}: {len(files)} file, đọc {read_rows} dòng, {summary} trong {elapsed:.2f}s "
+              f"({read_rows / max(elapsed, 1e-9):,.0f} dòng/s)")
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Nạp nhanh dữ liệu thô từ các file INSERT trong data_source/')
+    parser.add_argument('--data-dir', default=DEFAULT_DATA_DIR,
+                        help='Thư mục chứa tbl_Customers/, tbl_Accounts/, tbl_Transactions/')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Số dòng mỗi lô executemany')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='Số file được đọc và nạp song song (cho cùng 1 bảng)')
+    parser.add_argument('--backend', choices=backends.BACKENDS, default='mssql',
+                        help='Database đích: SQL Server (mặc định) hoặc engine nhúng sqlite / duckdb')
+    parser.add_argument('--database', default=None,
+                        help='File database cho backend sqlite / duckdb')
+    parser.add_argument('--dry-run', action='store_true',
+                        help='Chỉ đọc và kiểm tra cú pháp các file, không ghi vào database')
+    args = parser.parse_args()
+
+    print(f"Đang nạp dữ liệu thô từ '{os.path.abspath(args.data_dir)}'...")
+    engine = None
+    if not args.dry_run:
+        from etl import create_engine
+        engine = create_engine(pool_size=args.workers + 1, backend=args.backend, database=args.database)
+        # Engine nhúng: tạo bảng theo schema.sql nếu database còn trống
+        if args.backend != 'mssql' and backends.ensure_schema(engine):
+            print(f"Đã tạo schema (schema.sql) trên database {args.backend} mới.")
+
+    t0 = time.perf_counter()
+    try:
+        total = seed(engine, args.data_dir, args.batch_size, args.workers, args.dry_run)
+    except SeedParseError as e:
+        print(f"\n*** LỖI CÚ PHÁP FILE NGUỒN: {e} ***")
+        sys.exit(1)
+    print(f"\nHoàn tất: nạp {total} dòng trong {time.perf_counter() - t0:.2f}s.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import hashlib
+import json
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+import schemas
+from sources import TRANSACTIONS_SQL
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+except ImportError:  # pyarrow là tùy chọn, không có thì ETL đọc thẳng từ SQL Server
+    pa = None
+
+# ==============================================================================
+# Snapshot cục bộ (Arrow IPC) của dữ liệu nguồn
+# ==============================================================================
+# Lần đầu: đọc tbl_Customers, tbl_Accounts, tbl_Transactions, tbl_MCC_Mapping.csv
+# và ghi ra file Arrow có kiểu cột rõ ràng trong thư mục <cache_dir>/<fingerprint>/.
+# Các lần sau (sửa logic Transform, chạy lại sau khi Load lỗi...): nếu fingerprint
+# nguồn không đổi thì memory-map file snapshot, không cần đọc lại qua ODBC.
+
+DEFAULT_CACHE_DIR = '.etl_cache'
+
+# Tăng khi định dạng file snapshot thay đổi (snapshot cũ sẽ được tạo lại)
+# 2: Amount lưu dạng số nguyên xu (schemas.AMOUNT_SCALE) thay vì DECIMAL
+SNAPSHOT_FORMAT = 2
+
+# Fingerprint nguồn: số dòng, ID lớn nhất (+ checksum cho 2 bảng nhỏ) trong 1 truy vấn
+FINGERPRINT_SQL = """
+SELECT
+    (SELECT COUNT_BIG(*) FROM tbl_Customers) AS Customer_Count,
+    (SELECT MAX(CustomerID) FROM tbl_Customers) AS Customer_Max_ID,
+    (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM tbl_Customers) AS Customer_Checksum,
+    (SELECT COUNT_BIG(*) FROM tbl_Accounts) AS Account_Count,
+    (SELECT MAX(AccountID) FROM tbl_Accounts) AS Account_Max_ID,
+    (SELECT CHECKSUM_AGG(BINARY_CHECKSUM(*)) FROM tbl_Accounts) AS Account_Checksum,
+    (SELECT COUNT_BIG(*) FROM tbl_Transactions) AS Transaction_Count,
+    (SELECT MAX(TransactionID) FROM tbl_Transactions) AS Transaction_Max_ID
+"""
+
+# Engine nhúng (SQLite / DuckDB): không có CHECKSUM_AGG -> thêm hash dòng tính phía client
+PORTABLE_FINGERPRINT_SQL = """
+SELECT
+    (SELECT COUNT(*) FROM tbl_Customers) AS Customer_Count,
+    (SELECT MAX(CustomerID) FROM tbl_Customers) AS Customer_Max_ID,
+    (SELECT COUNT(*) FROM tbl_Accounts) AS Account_Count,
+    (SELECT MAX(AccountID) FROM tbl_Accounts) AS Account_Max_ID,
+    (SELECT COUNT(*) FROM tbl_Transactions) AS Transaction_Count,
+    (SELECT MAX(TransactionID) FROM tbl_Transactions) AS Transaction_Max_ID
+"""
+
+# Số dòng mỗi lần đọc tbl_Transactions khi ghi snapshot
+SNAPSHOT_CHUNK_SIZE = 100_000
+
+
+def available():
+    return pa is not None
+
+
+def table_schemas():
+    # Kiểu cột giống schema.sql (DATETIME -> timestamp), Amount là số nguyên xu như khi đọc từ SQL
+    return {
+        'tbl_Customers': pa.schema([
+            ('CustomerID', pa.int32()), ('FirstName', pa.string()), ('LastName', pa.string()),
+            ('BirthDate', pa.date32()), ('Gender', pa.string()), ('City', pa.string()),
+            ('Country', pa.string()),
+        ]),
+        'tbl_Accounts': pa.schema([
+            ('AccountID', pa.int32()), ('CustomerID', pa.int32()), ('AccountType', pa.string()),
+            ('OpenDate', pa.timestamp('us')),
+        ]),
+        'tbl_Transactions': pa.schema([
+            ('TransactionID', pa.int64()), ('AccountID', pa.int32()), ('MerchantName', pa.string()),
+            ('Amount', pa.int64()), ('TransactionTimestamp', pa.timestamp('us')),
+            ('TransactionCountry', pa.string()), ('BeneficiaryName', pa.string()),
+            ('TransactionDescription', pa.string()),
+        ]),
+        # BINARY_CHECKSUM (INT) trên SQL Server, hash 64-bit trên engine nhúng
+        'customer_hashes': pa.schema([('CustomerID', pa.int32()), ('Row_Hash', pa.int64())]),
+        'account_hashes': pa.schema([('AccountID', pa.int32()), ('Row_Hash', pa.int64())]),
+    }
+
+
+def source_fingerprint(conn, csv_path, source):
+    is_mssql = conn.dialect.name == 'mssql'
+    row = conn.execute(sqlalchemy.text(FINGERPRINT_SQL if is_mssql else PORTABLE_FINGERPRINT_SQL)).one()
+    parts = {k: (None if v is None else str(v)) for k, v in row._mapping.items()}
+    parts['Snapshot_Format'] = SNAPSHOT_FORMAT
+    if not is_mssql:
+        cust_hashes, acc_hashes = source.row_hashes()
+        parts['Customer_Checksum'] = str(int(cust_hashes['Row_Hash'].sum()))
+        parts['Account_Checksum'] = str(int(acc_hashes['Row_Hash'].sum()))
+    with open(csv_path, 'rb') as f:
+        parts['MCC_Mapping_MD5'] = hashlib.md5(f.read()).hexdigest()
+    return hashlib.sha1(json.dumps(parts, sort_keys=True).encode()).hexdigest()[:16], parts
+
+
+def _coerce_types(df, schema):
+    # SQLite trả DATETIME dạng chuỗi -> đổi về đúng kiểu trước khi ghi Arrow
+    df = df.copy()
+    for field in schema:
+        col = df[field.name]
+        if pa.types.is_timestamp(field.type) and not pd.api.types.is_datetime64_any_dtype(col):
+            df[field.name] = pd.to_datetime(col)
+        elif pa.types.is_date(field.type) and not pd.api.types.is_object_dtype(col):
+            df[field.name] = pd.to_datetime(col).dt.date
+    return df
+
+
+def _write_frame(df, path, schema=None):
+    if schema is not None:
+        df = _coerce_types(df, schema)
+    table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+    with ipc.new_file(path, table.schema) as writer:
+        writer.write_table(table)
+
+
+def _read_table(path):
+    # Memory-map: dữ liệu không bị copy vào RAM cho tới khi thực sự dùng
+    with pa.memory_map(path, 'r') as source:
+        return ipc.open_file(source).read_all()
+
+
+def _to_pandas(table, table_name=None):
+    # Giống SqlSource: ép kiểu cột theo schemas (category, int32, Amount dạng xu...)
+    df = table.to_pandas(date_as_object=False)
+    return schemas.apply(df, table_name) if table_name else df
+
+
+def build_snapshot(conn, snapshot_dir, csv_path, source):
+    arrow_schemas = table_schemas()
+    tmp_dir = snapshot_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+
+    _write_frame(source.customers(), os.path.join(tmp_dir, 'tbl_Customers.arrow'), arrow_schemas['tbl_Customers'])
+    _write_frame(source.accounts(), os.path.join(tmp_dir, 'tbl_Accounts.arrow'), arrow_schemas['tbl_Accounts'])
+    cust_hashes, acc_hashes = source.row_hashes()
+    _write_frame(cust_hashes, os.path.join(tmp_dir, 'customer_hashes.arrow'), arrow_schemas['customer_hashes'])
+    _write_frame(acc_hashes, os.path.join(tmp_dir, 'account_hashes.arrow'), arrow_schemas['account_hashes'])
+    _write_frame(pd.read_csv(csv_path), os.path.join(tmp_dir, 'tbl_MCC_Mapping.arrow'))
+
+    # Giao dịch: ghi theo từng khối (đã sắp xếp theo TransactionID)
+    schema = arrow_schemas['tbl_Transactions']
+    stream_conn = conn.execution_options(stream_results=True)
+    with ipc.new_file(os.path.join(tmp_dir, 'tbl_Transactions.arrow'), schema) as writer:
+        for chunk in pd.read_sql(sqlalchemy.text(TRANSACTIONS_SQL), stream_conn, params={'last_id': 0},
+                                 chunksize=SNAPSHOT_CHUNK_SIZE, coerce_float=False):
+            writer.write_table(pa.Table.from_pandas(_coerce_types(chunk, schema), schema=schema, preserve_index=False))
+
+    os.replace(tmp_dir, snapshot_dir)
+
+
+class SnapshotSource:
+    # Cùng các hàm với sources.SqlSource nhưng đọc từ file Arrow đã memory-map
+    # (không có push-down: snapshot luôn chứa toàn bộ dòng nguồn, lọc bằng pandas)
+    pushdown = False
+
+    def __init__(self, snapshot_dir):
+        read = lambda name: _read_table(os.path.join(snapshot_dir, f'{name}.arrow'))
+        self._customers = _to_pandas(read('tbl_Customers'), 'tbl_Customers')
+        self._accounts = _to_pandas(read('tbl_Accounts'), 'tbl_Accounts')
+        self._customer_hashes = _to_pandas(read('customer_hashes'))
+        self._account_hashes = _to_pandas(read('account_hashes'))
+        self._mcc_mapping = _to_pandas(read('tbl_MCC_Mapping'))
+        # Giao dịch giữ ở dạng Arrow (memory-map), chỉ đổi sang pandas theo từng khối
+        self._transactions = read('tbl_Transactions')
+        self._transaction_ids = self._transactions.column('TransactionID').to_numpy()
+
+    def fetch_all(self, *calls):
+        return [call() for call in calls]
+
+    def customers(self):
+        return self._customers.copy()
+
+    def accounts(self):
+        return self._accounts.copy()
+
+    def mcc_mapping(self, csv_path):
+        return self._mcc_mapping.copy()
+
+    def row_hashes(self):
+        return self._customer_hashes.copy(), self._account_hashes.copy()
+
+    def read_by_ids(self, table_name, id_col, ids):
+        df = {'tbl_Customers': self._customers, 'tbl_Accounts': self._accounts}[table_name]
+        return df[df[id_col].isin(list(ids))].reset_index(drop=True)
+
+    def _delta_offset(self, last_id):
+        # Snapshot đã sắp xếp theo TransactionID -> tìm nhị phân vị trí bắt đầu
+        return int(np.searchsorted(self._transaction_ids, last_id, side='right'))
+
+    def accounts_for_delta(self, last_id):
+        delta = self._transactions.slice(self._delta_offset(last_id))
+        account_ids = pc.unique(delta.column('AccountID')).to_pylist()
+        return self.read_by_ids('tbl_Accounts', 'AccountID', account_ids)
+
+    def max_transaction_id(self):
+        return int(self._transaction_ids[-1]) if len(self._transaction_ids) else None
+
+    def iter_transactions(self, last_id, chunk_size):
+        offset = self._delta_offset(last_id)
+        total = len(self._transaction_ids)
+        chunk_size = chunk_size or max(total - offset, 1)
+        for start in range(offset, total, chunk_size):
+            yield _to_pandas(self._transactions.slice(start, chunk_size), 'tbl_Transactions')
+
+
+def open_snapshot(conn, cache_dir, csv_path, source):
+    # Trả về SnapshotSource khớp với fingerprint hiện tại của nguồn (tạo mới nếu chưa có)
+    fingerprint, parts = source_fingerprint(conn, csv_path, source)
+    snapshot_dir = os.path.join(cache_dir, fingerprint)
+
+    if os.path.isdir(snapshot_dir):
+        print(f"Dùng snapshot cục bộ '{snapshot_dir}' (nguồn không thay đổi).")
+    else:
+        print(f"Đang tạo snapshot cục bộ '{snapshot_dir}'...")
+        os.makedirs(cache_dir, exist_ok=True)
+        build_snapshot(conn, snapshot_dir, csv_path, source)
+        with open(os.path.join(snapshot_dir, 'fingerprint.json'), 'w', encoding='utf-8') as f:
+            json.dump(parts, f, ensure_ascii=False, indent=2)
+        # Chỉ giữ snapshot mới nhất
+        for name in os.listdir(cache_dir):
+            old_dir = os.path.join(cache_dir, name)
+            if name != fingerprint and os.path.isdir(old_dir):
+                shutil.rmtree(old_dir, ignore_errors=True)
+
+    return SnapshotSource(snapshot_dir)
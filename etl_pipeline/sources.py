@@ -0,0 +1,236 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+import sqlalchemy
+
+import schemas
+
+# ==============================================================================
+# Nguồn dữ liệu cho bước Extract
+# ==============================================================================
+# SqlSource đọc trực tiếp từ SQL Server. Các nguồn khác (ví dụ snapshot cục bộ)
+# cung cấp cùng các hàm này để bước Extract không cần biết dữ liệu đến từ đâu.
+# ParallelSqlSource đọc song song nhiều khoảng TransactionID qua connection pool.
+
+# Số ID tối đa trong 1 mệnh đề IN (...) khi đọc các dòng thay đổi
+ID_BATCH_SIZE = 1000
+
+# ------------------------------------------------------------------------------
+# Chế độ push-down (--pushdown): các luật làm sạch của Bước 2 chạy ngay trên server
+# bằng JOIN / EXISTS theo khóa chính - khóa ngoại, chỉ các dòng hợp lệ được gửi về client.
+#   - Tài khoản hợp lệ: có chủ và OpenDate > BirthDate
+#   - Khách hàng hợp lệ: có ít nhất 1 tài khoản hợp lệ
+#   - Giao dịch hợp lệ: thuộc tài khoản hợp lệ và TransactionTimestamp >= OpenDate
+# Số dòng bị loại theo từng luật được đếm bằng các truy vấn COUNT (chỉ vài con số qua mạng).
+# ------------------------------------------------------------------------------
+VALID_ACCOUNT_JOIN = "JOIN tbl_Customers c ON c.CustomerID = a.CustomerID AND a.OpenDate > c.BirthDate"
+
+VALID_CUSTOMERS_SQL = (
+    "SELECT * FROM tbl_Customers c WHERE EXISTS "
+    f"(SELECT 1 FROM tbl_Accounts a {VALID_ACCOUNT_JOIN} WHERE a.CustomerID = c.CustomerID)"
+)
+VALID_ACCOUNTS_SQL = f"SELECT a.* FROM tbl_Accounts a {VALID_ACCOUNT_JOIN}"
+
+# Điều kiện thêm vào WHERE khi đọc tbl_Transactions t
+VALID_TRANSACTION_CONDITION = (
+    f" AND EXISTS (SELECT 1 FROM tbl_Accounts a {VALID_ACCOUNT_JOIN} "
+    "WHERE a.AccountID = t.AccountID AND t.TransactionTimestamp >= a.OpenDate)"
+)
+
+# CASE ... ELSE 1: so sánh với NULL cũng bị tính là lỗi (giống phép so sánh NaT của pandas)
+REJECTED_CUSTOMERS_ACCOUNTS_SQL = f"""
+SELECT
+    (SELECT COUNT(*) FROM tbl_Accounts a
+     WHERE NOT EXISTS (SELECT 1 FROM tbl_Customers c WHERE c.CustomerID = a.CustomerID)) AS account_unknown_customer,
+    (SELECT COUNT(*) FROM tbl_Accounts a JOIN tbl_Customers c ON c.CustomerID = a.CustomerID
+     WHERE CASE WHEN a.OpenDate > c.BirthDate THEN 0 ELSE 1 END = 1) AS account_opened_before_birth,
+    (SELECT COUNT(*) FROM tbl_Customers c
+     WHERE NOT EXISTS (SELECT 1 FROM tbl_Accounts a {VALID_ACCOUNT_JOIN}
+                       WHERE a.CustomerID = c.CustomerID)) AS customer_without_valid_account
+"""
+
+REJECTED_TRANSACTIONS_SQL = f"""
+SELECT
+    COUNT(CASE WHEN v.AccountID IS NULL THEN 1 END) AS transaction_unknown_account,
+    COUNT(CASE WHEN v.AccountID IS NULL OR t.TransactionTimestamp >= v.OpenDate THEN NULL ELSE 1 END)
+        AS transaction_before_account_open
+FROM tbl_Transactions t
+LEFT JOIN (SELECT a.AccountID, a.OpenDate FROM tbl_Accounts a {VALID_ACCOUNT_JOIN}) v ON v.AccountID = t.AccountID
+WHERE t.TransactionID > :last_id
+"""
+
+# Giao dịch mới đầu tiên không thuộc tài khoản hợp lệ (incremental: High-water mark dừng trước nó)
+FIRST_UNKNOWN_ACCOUNT_SQL = f"""
+SELECT MIN(t.TransactionID) FROM tbl_Transactions t
+WHERE t.TransactionID > :last_id
+  AND NOT EXISTS (SELECT 1 FROM tbl_Accounts a {VALID_ACCOUNT_JOIN} WHERE a.AccountID = t.AccountID)
+"""
+
+
+def transactions_sql(condition, pushdown=False):
+    # Đọc giao dịch theo thứ tự TransactionID để High-water mark luôn tăng dần
+    if pushdown:
+        condition += VALID_TRANSACTION_CONDITION
+    return f"SELECT {schemas.TRANSACTION_COLUMNS} FROM tbl_Transactions t WHERE {condition} ORDER BY TransactionID"
+
+
+TRANSACTIONS_SQL = transactions_sql("TransactionID > :last_id")
+TRANSACTION_BOUNDS_SQL = (
+    "SELECT MIN(TransactionID), MAX(TransactionID) FROM tbl_Transactions WHERE TransactionID > :last_id"
+)
+
+
+def hash_rows(df, id_col):
+    # (ID, hash của cả dòng) - tương đương SELECT ID, BINARY_CHECKSUM(*)
+    return pd.DataFrame({
+        id_col: df[id_col],
+        'Row_Hash': pd.util.hash_pandas_object(df, index=False).astype('int64'),
+    })
+
+
+class SqlSource:
+    def __init__(self, conn, pushdown=False):
+        self.conn = conn
+        self.pushdown = pushdown
+
+    def _read(self, sql, params=None, table_name=None):
+        # table_name: ép kiểu cột theo schemas ngay khi đọc
+        return pd.read_sql(sqlalchemy.text(sql), self.conn, params=params, **schemas.read_options(table_name))
+
+    def fetch_all(self, *calls):
+        # Chạy lần lượt các hàm đọc (1 connection không dùng chung được giữa các luồng)
+        return [call() for call in calls]
+
+    def _read_table(self, table_name):
+        return self._read(f"SELECT * FROM {table_name}", table_name=table_name)
+
+    def customers(self):
+        if self.pushdown:
+            return self._read(VALID_CUSTOMERS_SQL, table_name='tbl_Customers')
+        return self._read_table('tbl_Customers')
+
+    def accounts(self):
+        if self.pushdown:
+            return self._read(VALID_ACCOUNTS_SQL, table_name='tbl_Accounts')
+        return self._read_table('tbl_Accounts')
+
+    def rejected_customers_accounts(self):
+        # Push-down: số dòng bị loại theo từng luật của tbl_Customers / tbl_Accounts
+        row = self.conn.execute(sqlalchemy.text(REJECTED_CUSTOMERS_ACCOUNTS_SQL)).one()
+        return {rule: int(rows or 0) for rule, rows in row._mapping.items()}
+
+    def rejected_transactions(self, last_id):
+        # Push-down: số giao dịch mới (TransactionID > last_id) bị loại theo từng luật
+        row = self.conn.execute(sqlalchemy.text(REJECTED_TRANSACTIONS_SQL), {'last_id': last_id}).one()
+        return {rule: int(rows or 0) for rule, rows in row._mapping.items()}
+
+    def first_unknown_account_transaction(self, last_id):
+        # Push-down: TransactionID nhỏ nhất (> last_id) của tài khoản không tồn tại / bị loại, None nếu không có
+        return self.conn.execute(sqlalchemy.text(FIRST_UNKNOWN_ACCOUNT_SQL), {'last_id': last_id}).scalar()
+
+    def mcc_mapping(self, csv_path):
+        return pd.read_csv(csv_path)
+
+    def row_hashes(self):
+        if self.conn.dialect.name != 'mssql':
+            # Engine nhúng không có BINARY_CHECKSUM -> băm từng dòng phía client
+            # (luôn đọc cả bảng, kể cả ở chế độ push-down: hash phủ mọi dòng nguồn)
+            return (hash_rows(self._read_table('tbl_Customers'), 'CustomerID'),
+                    hash_rows(self._read_table('tbl_Accounts'), 'AccountID'))
+        # Đọc (ID, checksum) của bảng nguồn - chỉ 2 cột nên rất nhẹ
+        cust_hashes = self._read("SELECT CustomerID, BINARY_CHECKSUM(*) AS Row_Hash FROM tbl_Customers")
+        acc_hashes = self._read("SELECT AccountID, BINARY_CHECKSUM(*) AS Row_Hash FROM tbl_Accounts")
+        return cust_hashes, acc_hashes
+
+    def read_by_ids(self, table_name, id_col, ids):
+        # Đọc các dòng có id_col nằm trong ids, chia lô để mệnh đề IN không quá dài
+        ids = sorted(int(i) for i in ids)
+        frames = []
+        for start in range(0, len(ids), ID_BATCH_SIZE):
+            id_list = ', '.join(str(i) for i in ids[start:start + ID_BATCH_SIZE])
+            frames.append(self._read(f"SELECT * FROM {table_name} WHERE {id_col} IN ({id_list})",
+                                     table_name=table_name))
+        if not frames:
+            return self._read(f"SELECT * FROM {table_name} WHERE 1 = 0", table_name=table_name)
+        return schemas.concat(frames, table_name)
+
+    def accounts_for_delta(self, last_id):
+        # Tài khoản được các giao dịch mới tham chiếu (lọc ngay trên server)
+        return self._read(
+            "SELECT * FROM tbl_Accounts WHERE AccountID IN "
+            "(SELECT AccountID FROM tbl_Transactions WHERE TransactionID > :last_id)",
+            params={'last_id': last_id}, table_name='tbl_Accounts')
+
+    def max_transaction_id(self):
+        return self.conn.execute(sqlalchemy.text("SELECT MAX(TransactionID) FROM tbl_Transactions")).scalar()
+
+    def iter_transactions(self, last_id, chunk_size):
+        # Đọc tbl_Transactions: cả bảng 1 lần (chunk_size=None) hoặc từng khối cố định
+        # dùng con trỏ phía server (stream_results) để bộ nhớ không phụ thuộc tổng lịch sử.
+        sql = sqlalchemy.text(transactions_sql("TransactionID > :last_id", self.pushdown))
+        params = {'last_id': last_id}
+        options = schemas.read_options('tbl_Transactions')
+        if not chunk_size:
+            yield pd.read_sql(sql, self.conn, params=params, **options)
+            return
+
+        stream_conn = self.conn.execution_options(stream_results=True)
+        for chunk in pd.read_sql(sql, stream_conn, params=params,
+                                 chunksize=chunk_size, **options):
+            yield chunk
+
+
+class ParallelSqlSource(SqlSource):
+    # Mỗi lần đọc lấy 1 connection riêng từ pool của engine -> các truy vấn chạy đồng thời.
+    # tbl_Transactions được chia thành các khoảng TransactionID liên tiếp, đọc bằng
+    # nhiều luồng nhưng trả về ĐÚNG THỨ TỰ để High-water mark vẫn tăng dần.
+
+    def __init__(self, conn, engine, workers, pushdown=False):
+        super().__init__(conn, pushdown)
+        self.engine = engine
+        self.workers = workers
+
+    def _read(self, sql, params=None, table_name=None):
+        with self.engine.connect() as conn:
+            return pd.read_sql(sqlalchemy.text(sql), conn, params=params, **schemas.read_options(table_name))
+
+    def fetch_all(self, *calls):
+        # Ví dụ: đọc tbl_Customers, tbl_Accounts và hash cùng lúc
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            futures = [executor.submit(call) for call in calls]
+            return [f.result() for f in futures]
+
+    def transaction_ranges(self, last_id, chunk_size):
+        # Chia [MIN, MAX] của phần giao dịch mới thành các khoảng [low, high]
+        low, high = self.conn.execute(sqlalchemy.text(TRANSACTION_BOUNDS_SQL), {'last_id': last_id}).one()
+        if low is None:
+            return []
+        low, high = int(low), int(high)
+        # Có chunk_size: mỗi khoảng tối đa chunk_size ID (<= chunk_size dòng).
+        # Không có: chia đều cho các luồng.
+        width = chunk_size or -(-(high - low + 1) // self.workers)
+        return [(start, min(start + width - 1, high)) for start in range(low, high + 1, width)]
+
+    def iter_transactions(self, last_id, chunk_size):
+        ranges = self.transaction_ranges(last_id, chunk_size)
+        # Đọc 1 khoảng TransactionID (khóa chính clustered -> mỗi khoảng là 1 lần quét liên tục)
+        sql = transactions_sql("TransactionID BETWEEN :low AND :high", self.pushdown)
+        read_range = lambda r: self._read(sql, params={'low': r[0], 'high': r[1]},
+                                          table_name='tbl_Transactions')
+
+        if not chunk_size:
+            # Trả về 1 DataFrame duy nhất (giống SqlSource)
+            frames = self.fetch_all(*[lambda r=r: read_range(r) for r in ranges])
+            if frames:
+                yield schemas.concat(frames, 'tbl_Transactions')
+            return
+
+        # Streaming: chỉ giữ tối đa 2 x workers khoảng đang đọc / chờ xử lý trong bộ nhớ
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            pending = []
+            for r in ranges:
+                pending.append(executor.submit(read_range, r))
+                if len(pending) >= 2 * self.workers:
+                    yield pending.pop(0).result()
+            for future in pending:
+                yield future.result()
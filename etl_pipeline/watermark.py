@@ -0,0 +1,61 @@
+import json
+import os
+
+import pandas as pd
+
+# ==============================================================================
+# Trạng thái nạp tăng dần (Incremental): High-water mark + Hash các dòng nguồn
+# ==============================================================================
+# File state lưu giữa các lần chạy:
+#   - last_transaction_id / last_transaction_ts: giao dịch lớn nhất đã xử lý
+#   - customer_hashes / account_hashes: {ID: BINARY_CHECKSUM} của các dòng
+#     ĐÃ NẠP vào Dim. Dòng mới hoặc có hash khác => coi là "thay đổi".
+
+DEFAULT_STATE_FILE = 'etl_state.json'
+
+
+def empty_state():
+    return {
+        'last_transaction_id': 0,
+        'last_transaction_ts': None,
+        'customer_hashes': {},
+        'account_hashes': {},
+    }
+
+
+def load_state(path=DEFAULT_STATE_FILE):
+    if not os.path.exists(path):
+        return empty_state()
+    with open(path, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    # JSON chỉ có key dạng chuỗi -> đổi lại về int
+    state['customer_hashes'] = {int(k): v for k, v in state.get('customer_hashes', {}).items()}
+    state['account_hashes'] = {int(k): v for k, v in state.get('account_hashes', {}).items()}
+    return {**empty_state(), **state}
+
+
+def save_state(state, path=DEFAULT_STATE_FILE):
+    # Ghi ra file tạm rồi đổi tên để không bao giờ để lại file state hỏng
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def is_first_run(state):
+    return state['last_transaction_id'] == 0 and not state['customer_hashes']
+
+
+def changed_ids(df_hashes, id_col, stored_hashes):
+    # Trả về tập ID mới hoặc có hash khác với lần nạp trước
+    stored = pd.Series(stored_hashes, dtype='int64')
+    previous = df_hashes[id_col].map(stored)
+    changed = previous.isna() | (previous != df_hashes['Row_Hash'])
+    return set(df_hashes.loc[changed, id_col].astype(int).tolist())
+
+
+def remember_hashes(stored_hashes, df_hashes, id_col, loaded_ids):
+    # Cập nhật hash cho các dòng vừa được xử lý xong (đã nạp vào Dim hoặc bị loại)
+    loaded = df_hashes[df_hashes[id_col].isin(loaded_ids)]
+    stored_hashes.update(zip(loaded[id_col].astype(int).tolist(), loaded['Row_Hash'].astype(int).tolist()))
+    return stored_hashes
@@ -0,0 +1,97 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Cho phép import các module trong thư mục etl_pipeline/
+ETL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl_pipeline')
+sys.path.insert(0, ETL_DIR)
+
+from categorizer import CategoryEngine, get_category_rowwise
+
+# ==============================================================================
+# BENCHMARK: apply(get_category) từng dòng  vs  CategoryEngine theo cột
+# ==============================================================================
+
+SAMPLE_MERCHANTS = [
+    ('Highlands Coffee', 'Ăn uống & Cà phê'), ('Phuc Long Coffee', 'Ăn uống & Cà phê'),
+    ('Gogi House', 'Ăn uống & Cà phê'), ('KFC', 'Ăn uống & Cà phê'), ('Lotteria', 'Ăn uống & Cà phê'),
+    ('Tiki', 'Mua sắm'), ('Shopee', 'Mua sắm'), ('Lazada', 'Mua sắm'), ('Uniqlo', 'Mua sắm'),
+    ('Winmart', 'Tạp hóa & Siêu thị'), ('Coo.op Mart', 'Tạp hóa & Siêu thị'), ('7-Eleven', 'Tạp hóa & Siêu thị'),
+    ('Grab', 'Di chuyển & Vận tải'), ('Be', 'Di chuyển & Vận tải'), ('Petrolimex', 'Di chuyển & Vận tải'),
+    ('VNPT', 'Hóa đơn & Dịch vụ'), ('CGV Cinema', 'Giải trí & Du lịch'), ('Netflix', 'Giải trí & Du lịch'),
+]
+# Một vài merchant KHÔNG có trong bảng mapping (rơi xuống nhánh Description)
+UNMAPPED_MERCHANTS = ['Cửa hàng lạ', 'Thế Giới Di Động', 'FPT Shop']
+
+SAMPLE_DESCRIPTIONS = [
+    'gop tien di choi', 'phi dich vu', 'thanh toan ve may bay', 'nap game', 'tien xang',
+    'tien tour du lich', 'mua kinh', 'ck tien mua trai cay', 'tien ve sinh', 'tien net',
+    'mua rau cu', 'mua banh keo', 'di bar', 'tra tien an trua', 'tien mang', 'tien grab',
+    'bao duong xe', 'thanh toan cuoc internet', 'dat phong homestay', 'tien gao', 'di spa',
+    'ck tien nhau nhe', 'chuyen tien', 'giat ui', None,
+]
+
+
+def load_mcc_mapping(csv_path):
+    if os.path.exists(csv_path):
+        return pd.read_csv(csv_path)
+    print(f"(Không tìm thấy '{csv_path}', dùng bảng mapping mẫu)")
+    return pd.DataFrame(SAMPLE_MERCHANTS, columns=['MerchantName', 'Category'])
+
+
+def make_transactions(n_rows, df_mcc_mapping, seed=42):
+    # Sinh n_rows giao dịch trộn POS/P2P (khoảng 60% POS như dữ liệu nguồn)
+    rng = np.random.default_rng(seed)
+    merchants = np.array(list(df_mcc_mapping['MerchantName'].dropna().unique()) + UNMAPPED_MERCHANTS, dtype=object)
+    descriptions = np.array(SAMPLE_DESCRIPTIONS, dtype=object)
+
+    is_pos = rng.random(n_rows) < 0.6
+    merchant_col = np.where(is_pos, merchants[rng.integers(0, len(merchants), n_rows)], None)
+    desc_col = np.where(is_pos, None, descriptions[rng.integers(0, len(descriptions), n_rows)])
+    return pd.DataFrame({'MerchantName': merchant_col, 'TransactionDescription': desc_col})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark phân loại Category')
+    parser.add_argument('--rows', type=int, default=1_000_000)
+    parser.add_argument('--mcc', default=os.path.join(ETL_DIR, 'tbl_MCC_Mapping.csv'))
+    parser.add_argument('--legacy-rows', type=int, default=None,
+                        help='Chỉ chạy cách cũ trên N dòng đầu rồi ngoại suy (mặc định: toàn bộ)')
+    args = parser.parse_args()
+
+    df_mcc_mapping = load_mcc_mapping(args.mcc)
+    df = make_transactions(args.rows, df_mcc_mapping)
+    print(f"Đã sinh {len(df):,} giao dịch, {len(df_mcc_mapping)} quy tắc mapping.")
+
+    # 1. Cách mới
+    t0 = time.perf_counter()
+    engine = CategoryEngine(df_mcc_mapping)
+    new_result = engine.categorize(df)
+    t_new = time.perf_counter() - t0
+    print(f"CategoryEngine:       {t_new:8.2f}s  ({len(df) / t_new:,.0f} dòng/s)")
+
+    # 2. Cách cũ
+    legacy_rows = len(df) if args.legacy_rows is None else min(args.legacy_rows, len(df))
+    df_legacy = df.iloc[:legacy_rows]
+    t0 = time.perf_counter()
+    old_result = df_legacy.apply(get_category_rowwise, axis=1, args=(df_mcc_mapping,))
+    t_old = time.perf_counter() - t0
+    t_old_full = t_old * len(df) / legacy_rows
+    note = '' if legacy_rows == len(df) else f' (đo trên {legacy_rows:,} dòng, ngoại suy)'
+    print(f"apply(get_category):  {t_old_full:8.2f}s  ({legacy_rows / t_old:,.0f} dòng/s){note}")
+    print(f"Tăng tốc:             {t_old_full / t_new:8.1f}x")
+
+    # 3. Đối chiếu kết quả
+    mismatches = (new_result.iloc[:legacy_rows].to_numpy() != old_result.to_numpy()).sum()
+    if mismatches:
+        print(f"*** SAI KHÁC: {mismatches} dòng cho kết quả khác nhau! ***")
+        sys.exit(1)
+    print(f"Kết quả trùng khớp 100% trên {legacy_rows:,} dòng.")
+
+
+if __name__ == '__main__':
+    main()
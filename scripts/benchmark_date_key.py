@@ -0,0 +1,68 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+# Cho phép import các module trong thư mục etl_pipeline/
+ETL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl_pipeline')
+sys.path.insert(0, ETL_DIR)
+
+from calendar_dim import build_dim_date, date_key
+
+# ==============================================================================
+# MICRO-BENCHMARK: Date_Key bằng ghép chuỗi (cách cũ) vs số học nguyên
+# ==============================================================================
+
+
+def date_key_strings(ts):
+    # Cách cũ trong etl.py: đổi sang chuỗi, zfill, ghép lại rồi ép về int
+    return (
+        ts.dt.year.astype(str) +
+        ts.dt.month.astype(str).str.zfill(2) +
+        ts.dt.day.astype(str).str.zfill(2) +
+        ts.dt.hour.astype(str).str.zfill(2)
+    ).astype(int)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark tính Date_Key')
+    parser.add_argument('--rows', type=int, default=5_000_000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    # Sinh timestamp ngẫu nhiên trong khoảng 2022 - 2025 (giống dữ liệu nguồn)
+    rng = np.random.default_rng(42)
+    start = pd.Timestamp('2022-01-01').value
+    end = pd.Timestamp('2025-12-31').value
+    ts = pd.Series(pd.to_datetime(rng.integers(start, end, args.rows)))
+    print(f"Đã sinh {len(ts):,} timestamp.")
+
+    timings = {}
+    for name, func in [('Ghép chuỗi (cũ)', date_key_strings), ('Số học nguyên', date_key)]:
+        best = float('inf')
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            result = func(ts)
+            best = min(best, time.perf_counter() - t0)
+        timings[name] = (best, result)
+        print(f"{name:18s} {best:8.3f}s  ({len(ts) / best:,.0f} dòng/s)")
+
+    old_keys = timings['Ghép chuỗi (cũ)'][1].to_numpy()
+    new_keys = timings['Số học nguyên'][1].to_numpy()
+    print(f"Tăng tốc:          {timings['Ghép chuỗi (cũ)'][0] / timings['Số học nguyên'][0]:8.1f}x")
+    if not np.array_equal(old_keys, new_keys):
+        print("*** SAI KHÁC: Date_Key của 2 cách không trùng nhau! ***")
+        sys.exit(1)
+    print("Date_Key trùng khớp 100%.")
+
+    # Sinh lịch Dim_Date theo giờ cho cả khoảng mặc định
+    t0 = time.perf_counter()
+    dim_date = build_dim_date()
+    print(f"\nSinh Dim_Date: {len(dim_date):,} dòng trong {time.perf_counter() - t0:.3f}s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,301 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+
+import pandas as pd
+import sqlalchemy
+
+# Cho phép import các module trong thư mục etl_pipeline/
+ETL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl_pipeline')
+sys.path.insert(0, ETL_DIR)
+
+import backends
+import customer_features
+import etl
+import fact_loader
+import instrumentation
+import watermark
+from benchmark_categorizer import load_mcc_mapping
+from generate_data import DEFAULT_BATCH_SIZE, generate, parse_rows
+from keymap import KeyStore
+from sources import ParallelSqlSource, SqlSource
+
+# ==============================================================================
+# BENCHMARK: toàn bộ ETL trên dữ liệu giả lập, đo riêng từng giai đoạn
+# ==============================================================================
+# Mỗi quy mô (--rows 1M 10M 50M) chạy trong 1 tiến trình riêng để peak RSS không bị
+# lẫn giữa các lần đo. Database nguồn giả lập được giữ lại trong --work-dir và dùng lại
+# (chỉ xóa các bảng kho) nên các lần đo sau chỉ tốn thời gian ETL.
+# ETL được chạy bằng chính etl.run_pipeline (FULL REFRESH); thời gian từng giai đoạn là tổng
+# các bước do instrumentation ghi nhận. Kết quả ghi ra JSON (kèm commit) -> --compare <file cũ>
+# để so sánh giữa 2 commit.
+
+# Giai đoạn -> các bước (instrumentation) của etl.py
+STAGE_GROUPS = {
+    'extract': ['extract_customers_accounts', 'extract_mcc_mapping', 'extract_transactions'],
+    'clean': ['clean_customers_accounts', 'clean_transactions'],
+    'dimension_prep': ['prepare_customer_account_dims', 'prepare_location_dim', 'prepare_merchant_dim'],
+    'categorization': ['categorize_merchants'],
+    # --transform-workers > 1: thời gian thực của transform song song (clean / categorization khi đó
+    # là tổng thời gian của các tiến trình con)
+    'parallel_transform': ['transform_shards'],
+    'key_mapping': ['build_fact_table'],
+    'load': ['load_dim_date', 'load_customer_account_dims', 'load_transaction_dims', 'load_fact'],
+    'aggregates': ['update_aggregates', 'update_customer_features'],
+}
+STAGES = list(STAGE_GROUPS)
+
+# Bước đọc dữ liệu không có số dòng vào -> dùng số dòng ra
+EXTRACT_STAGES = set(STAGE_GROUPS['extract'])
+
+WAREHOUSE_TABLES = ['Fact_Spending', 'Dim_Date', 'Dim_Customer', 'Dim_Account', 'Dim_Merchant', 'Dim_Location',
+                    'Agg_Monthly_Spending', 'Agg_Category_Monthly', 'Agg_AgeGroup_Monthly']
+
+DEFAULT_WORK_DIR = '.benchmark'
+DEFAULT_RESULTS_DIR = 'benchmark_results'
+
+
+def peak_rss_mb():
+    # ru_maxrss: KB trên Linux, byte trên macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ETL_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def stage_summary(totals):
+    # Số liệu cộng dồn theo bước của instrumentation -> số liệu theo giai đoạn
+    stages = {}
+    for name, steps in STAGE_GROUPS.items():
+        seconds = sum(totals[step]['wall_seconds'] for step in steps if step in totals)
+        rows = sum(totals[step]['rows_out' if step in EXTRACT_STAGES else 'rows_in']
+                   for step in steps if step in totals)
+        stages[name] = {'seconds': seconds, 'rows': rows, 'rows_per_s': rows / seconds if seconds else None}
+    return stages
+
+
+def reset_warehouse(engine):
+    # Xóa dữ liệu kho (giữ nguyên bảng nguồn giả lập) để mỗi lần đo bắt đầu từ kho trống
+    with engine.begin() as conn:
+        for table_name in WAREHOUSE_TABLES:
+            conn.execute(sqlalchemy.text(f"DELETE FROM {table_name}"))
+        conn.execute(sqlalchemy.text("UPDATE Agg_Watermark SET Last_Transaction_Key = 0"))
+    if customer_features.available(engine):
+        with engine.begin() as conn:
+            for table_name in (customer_features.FEATURES_TABLE, customer_features.CATEGORY_TABLE):
+                conn.execute(sqlalchemy.text(f"DELETE FROM {table_name}"))
+            conn.execute(sqlalchemy.text(
+                f"UPDATE {customer_features.WATERMARK_TABLE} SET Last_Transaction_Key = 0"))
+
+
+def run_etl(engine, args, csv_path, keymap_file, state_file):
+    # FULL REFRESH bằng đúng etl.run_pipeline, trả về (giao dịch đã đọc, dòng Fact đã nạp, số liệu từng bước)
+    metrics = instrumentation.start_run()
+    # etl.extract đọc file mapping theo đường dẫn cố định của etl.py -> trỏ sang file trong --work-dir
+    etl.CSV_PATH = csv_path
+    state = watermark.empty_state()
+    with engine.connect() as conn:
+        if args.workers > 1:
+            source = ParallelSqlSource(conn, engine, args.workers, pushdown=args.pushdown)
+        else:
+            source = SqlSource(conn, pushdown=args.pushdown)
+        df_customers, df_accounts, df_mcc_mapping, changes = etl.extract(source, state, True)
+        keystore = KeyStore(keymap_file)
+        etl.run_pipeline(engine, source, df_customers, df_accounts, df_mcc_mapping, changes, state, True,
+                         args.chunk_size, state_file, keystore,
+                         loader=fact_loader.FactLoader(engine, args.fact_batch_size, args.load_workers or args.workers),
+                         transform_workers=args.transform_workers)
+    totals = metrics.totals
+    transactions = totals.get('extract_transactions', {}).get('rows_out', 0)
+    facts = totals.get('load_fact', {}).get('rows_out', 0)
+    return transactions, facts, totals
+
+
+def run_scale(args, n_rows):
+    os.makedirs(args.work_dir, exist_ok=True)
+    database = os.path.join(args.work_dir, f"synthetic_{n_rows}_{args.seed}.{args.backend}")
+    csv_path = os.path.join(args.work_dir, 'tbl_MCC_Mapping.csv')
+    df_mcc_mapping = load_mcc_mapping(args.mcc)
+    df_mcc_mapping.to_csv(csv_path, index=False)
+
+    generate_seconds = None
+    if not os.path.exists(database):
+        print(f"Đang sinh dữ liệu giả lập: {n_rows:,} giao dịch -> '{database}'...")
+        # Sinh vào file tạm rồi đổi tên: bị ngắt giữa chừng thì lần sau sinh lại từ đầu
+        tmp_database = database + '.tmp'
+        engine = etl.create_engine(backend=args.backend, database=tmp_database)
+        backends.create_schema(engine)
+        t0 = time.perf_counter()
+        generate(engine, n_rows, df_mcc_mapping, seed=args.seed, batch_size=args.batch_size)
+        generate_seconds = time.perf_counter() - t0
+        engine.dispose()
+        os.replace(tmp_database, database)
+    else:
+        print(f"Dùng lại dữ liệu giả lập '{database}'.")
+
+    engine = etl.create_engine(pool_size=max(args.workers, args.load_workers or args.workers) + 1,
+                               backend=args.backend, database=database)
+    reset_warehouse(engine)
+    keymap_file = os.path.join(args.work_dir, 'keymap.pkl')
+    state_file = os.path.join(args.work_dir, 'etl_state.json')
+    for path in (keymap_file, state_file):
+        if os.path.exists(path):
+            os.remove(path)
+
+    print(f"Đang chạy ETL ({n_rows:,} giao dịch, khối {args.chunk_size or 'toàn bộ'})...")
+    # Bỏ bớt log chi tiết của etl.py để không ảnh hưởng phép đo (--verbose để xem)
+    log = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    t0 = time.perf_counter()
+    with log:
+        total_rows, total_facts, totals = run_etl(engine, args, csv_path, keymap_file, state_file)
+    total_seconds = time.perf_counter() - t0
+
+    return {
+        'rows': n_rows,
+        'seed': args.seed,
+        'backend': args.backend,
+        'chunk_size': args.chunk_size,
+        'pushdown': args.pushdown,
+        'workers': args.workers,
+        'transform_workers': args.transform_workers,
+        'fact_batch_size': args.fact_batch_size,
+        'generate_seconds': generate_seconds,
+        'transactions_read': total_rows,
+        'facts_loaded': total_facts,
+        'total_seconds': total_seconds,
+        'rows_per_s': total_rows / total_seconds if total_seconds else None,
+        'peak_rss_mb': peak_rss_mb(),
+        'stages': stage_summary(totals),
+        'pipeline_stages': totals,
+    }
+
+
+def print_run(run):
+    print(f"\n=== {run['rows']:,} giao dịch ({run['backend']}) ===")
+    for name, s in run['stages'].items():
+        rate = f"{s['rows_per_s']:,.0f} dòng/s" if s['rows_per_s'] else '-'
+        print(f"{name:18s} {s['seconds']:9.2f}s  {rate:>18s}")
+    print(f"{'TỔNG':18s} {run['total_seconds']:9.2f}s  {run['rows_per_s']:>13,.0f} dòng/s")
+    print(f"Peak RSS: {run['peak_rss_mb']:,.0f} MB | Fact nạp: {run['facts_loaded']:,}/{run['transactions_read']:,}")
+
+
+def compare(results, baseline_path):
+    # So sánh thời gian từng giai đoạn với 1 file kết quả cũ (cùng quy mô, cùng backend)
+    with open(baseline_path, encoding='utf-8') as f:
+        baseline = json.load(f)
+    old_runs = {(r['rows'], r['backend']): r for r in baseline['runs']}
+    print(f"\n--- So sánh với commit {baseline.get('commit')} ({baseline_path}) ---")
+    for run in results['runs']:
+        old = old_runs.get((run['rows'], run['backend']))
+        if old is None:
+            print(f"{run['rows']:,} giao dịch: không có trong file cũ.")
+            continue
+        print(f"{run['rows']:,} giao dịch:")
+        for name in STAGES + ['total']:
+            new_s = run['total_seconds'] if name == 'total' else run['stages'][name]['seconds']
+            old_s = old['total_seconds'] if name == 'total' else old['stages'].get(name, {}).get('seconds')
+            if old_s:
+                print(f"   {name:16s} {old_s:9.2f}s -> {new_s:9.2f}s  ({new_s / old_s:5.2f}x)")
+        print(f"   {'peak_rss_mb':16s} {old['peak_rss_mb']:9.0f}  -> {run['peak_rss_mb']:9.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark ETL theo từng giai đoạn trên dữ liệu giả lập')
+    parser.add_argument('--rows', nargs='+', default=['1M'],
+                        help='Các quy mô cần đo, ví dụ: --rows 1M 10M 50M')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--backend', choices=['sqlite', 'duckdb'], default='sqlite')
+    parser.add_argument('--chunk-size', type=int, default=1_000_000,
+                        help='Xử lý tbl_Transactions theo khối N dòng (0 = cả bảng 1 lần)')
+    parser.add_argument('--pushdown', action='store_true',
+                        help='Lọc dữ liệu lỗi logic trên server (giống etl.py --pushdown)')
+    parser.add_argument('--workers', type=int, default=1,
+                        help='Số luồng đọc song song (giống etl.py --workers)')
+    parser.add_argument('--transform-workers', type=int, default=1,
+                        help='Số tiến trình làm sạch + phân loại giao dịch (giống etl.py --transform-workers)')
+    parser.add_argument('--fact-batch-size', type=int, default=fact_loader.DEFAULT_BATCH_SIZE,
+                        help='Số dòng mỗi lô khi nạp Fact_Spending (giống etl.py --fact-batch-size)')
+    parser.add_argument('--load-workers', type=int, default=None,
+                        help='Số luồng nạp song song các lô Fact (mặc định: bằng --workers)')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Số giao dịch sinh mỗi lô khi tạo dữ liệu giả lập')
+    parser.add_argument('--mcc', default=os.path.join(ETL_DIR, 'tbl_MCC_Mapping.csv'))
+    parser.add_argument('--work-dir', default=DEFAULT_WORK_DIR,
+                        help='Thư mục chứa database giả lập (được dùng lại giữa các lần đo)')
+    parser.add_argument('--output', default=None,
+                        help=f'File JSON kết quả (mặc định: {DEFAULT_RESULTS_DIR}/etl_<commit>.json)')
+    parser.add_argument('--compare', default=None,
+                        help='File JSON kết quả cũ để so sánh')
+    parser.add_argument('--verbose', action='store_true', help='In log chi tiết của etl.py')
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    args.chunk_size = args.chunk_size or None
+
+    if args.child:
+        # Tiến trình con: đo 1 quy mô, trả kết quả qua stdout (dòng cuối)
+        run = run_scale(args, parse_rows(args.rows[0]))
+        print(json.dumps(run))
+        return
+
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'created_at': pd.Timestamp.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+        'cpu_count': os.cpu_count(),
+        'runs': [],
+    }
+    for rows in args.rows:
+        cmd = [sys.executable, os.path.abspath(__file__), '--child', '--rows', rows] + \
+            _without_option(sys.argv[1:], '--rows')
+        proc = subprocess.run(cmd, stdout=subprocess.PIPE, text=True)
+        output = proc.stdout.strip().splitlines()
+        print('\n'.join(output[:-1]))
+        if proc.returncode != 0:
+            print(f"*** Lỗi khi đo quy mô {rows} ***")
+            sys.exit(proc.returncode)
+        run = json.loads(output[-1])
+        results['runs'].append(run)
+        print_run(run)
+
+    output_path = args.output or os.path.join(DEFAULT_RESULTS_DIR, f"etl_{commit or 'unknown'}.json")
+    os.makedirs(os.path.dirname(output_path) or '.', exist_ok=True)
+    with open(output_path, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"\nĐã lưu kết quả: {output_path}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+def _without_option(argv, option):
+    # Bỏ "--rows a b c" khỏi danh sách tham số khi gọi tiến trình con
+    result, skipping = [], False
+    for arg in argv:
+        if arg == option:
+            skipping = True
+            continue
+        if skipping and not arg.startswith('--'):
+            continue
+        skipping = False
+        result.append(arg)
+    return result
+
+
+if __name__ == '__main__':
+    main()
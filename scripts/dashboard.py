@@ -1,12 +1,28 @@
 from matplotlib import ticker
-import pandas as pd
+import argparse
 import sqlalchemy
-import pyodbc
+import sys
 import urllib.parse
 import matplotlib.pyplot as plt
 import seaborn as sns
 import os
 
+# Cho phép import các module trong thư mục etl_pipeline/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl_pipeline'))
+import backends
+import query_cache
+
+parser = argparse.ArgumentParser(description='Vẽ dashboard từ kho dữ liệu')
+parser.add_argument('--backend', choices=backends.BACKENDS, default='mssql',
+                    help='Kho dữ liệu: SQL Server (mặc định) hoặc engine nhúng sqlite / duckdb')
+parser.add_argument('--database', default=None,
+                    help='File database cho backend sqlite / duckdb')
+parser.add_argument('--no-cache', action='store_true',
+                    help='Luôn truy vấn lại kho, không dùng cache kết quả')
+parser.add_argument('--cache-dir', default=query_cache.DEFAULT_CACHE_DIR,
+                    help='Thư mục chứa cache kết quả truy vấn')
+args = parser.parse_args()
+
 # ==============================================================================
 # 1. KẾT NỐI SQL SERVER (Copy y hệt từ etl.py sang)
 # ==============================================================================
@@ -16,9 +32,14 @@ DATABASE_NAME = 'DW_Bank'
 USERNAME = 'sa'
 PASSWORD = 'pass'  # <--- Kiểm tra lại mật khẩu của bạn
 
-connection_string = f"DRIVER={DRIVER};SERVER={SERVER_NAME};DATABASE={DATABASE_NAME};UID={USERNAME};PWD={PASSWORD};Encrypt=no;"
-quoted_conn_str = urllib.parse.quote_plus(connection_string)
-engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={quoted_conn_str}")
+if args.backend == 'mssql':
+    connection_string = f"DRIVER={DRIVER};SERVER={SERVER_NAME};DATABASE={DATABASE_NAME};UID={USERNAME};PWD={PASSWORD};Encrypt=no;"
+    quoted_conn_str = urllib.parse.quote_plus(connection_string)
+    engine = sqlalchemy.create_engine(f"mssql+pyodbc:///?odbc_connect={quoted_conn_str}")
+else:
+    # Engine nhúng SQLite / DuckDB (file do etl.py --backend ... tạo ra)
+    engine = backends.create_embedded_engine(args.backend, args.database)
+dialect = engine.dialect.name
 
 # Tạo thư mục để chứa ảnh (nếu chưa có)
 if not os.path.exists('charts'):
@@ -29,43 +50,52 @@ print("--- Đang kết nối DW và lấy dữ liệu... ---")
 # ==============================================================================
 # 2. TRUY VẤN DỮ LIỆU (Data Query)
 # ==============================================================================
+# Các truy vấn viết bằng T-SQL; translate_sql dịch TOP / ghép chuỗi cho SQLite, DuckDB
+# Đọc từ các bảng tổng hợp Agg_* do ETL cộng dồn (vài trăm dòng), không quét Fact_Spending
 
 # Query 1: Xu hướng chi tiêu theo Thời gian (Tháng)
 sql_trend = """
 SELECT 
-    d.Year, d.Month, 
-    CAST(d.Year AS VARCHAR) + '-' + RIGHT('0' + CAST(d.Month AS VARCHAR), 2) as YearMonth,
-    SUM(f.Amount_Spent) as Total_Spent
-FROM Fact_Spending f
-JOIN Dim_Date d ON f.Date_Key = d.Date_Key
-GROUP BY d.Year, d.Month
-ORDER BY d.Year, d.Month
+    a.Year, a.Month, 
+    CAST(a.Year AS VARCHAR) + '-' + RIGHT('0' + CAST(a.Month AS VARCHAR), 2) as YearMonth,
+    a.Total_Spent
+FROM Agg_Monthly_Spending a
+ORDER BY a.Year, a.Month
 """
-df_trend = pd.read_sql(sql_trend, engine)
 
 # Query 2: Top Hạng mục chi tiêu
 sql_category = """
 SELECT TOP 5
-    m.Category,
-    SUM(f.Amount_Spent) as Total_Spent
-FROM Fact_Spending f
-JOIN Dim_Merchant m ON f.Merchant_Key = m.Merchant_Key
-GROUP BY m.Category
+    a.Category,
+    SUM(a.Total_Spent) as Total_Spent
+FROM Agg_Category_Monthly a
+GROUP BY a.Category
 ORDER BY Total_Spent DESC
 """
-df_category = pd.read_sql(sql_category, engine)
 
 # Query 3: Chi tiêu theo Nhóm tuổi
 sql_age = """
 SELECT 
-    c.Age_Group,
-    SUM(f.Amount_Spent) as Total_Spent
-FROM Fact_Spending f
-JOIN Dim_Customer c ON f.Customer_Key = c.Customer_Key
-GROUP BY c.Age_Group
+    a.Age_Group,
+    SUM(a.Total_Spent) as Total_Spent
+FROM Agg_AgeGroup_Monthly a
+GROUP BY a.Age_Group
 ORDER BY Total_Spent DESC
 """
-df_age = pd.read_sql(sql_age, engine)
+
+# Chạy các truy vấn: lấy từ cache nếu kho chưa đổi, truy vấn còn thiếu thì chạy song song
+cache = None
+if not args.no_cache:
+    if query_cache.available():
+        cache = query_cache.QueryCache(args.cache_dir)
+    else:
+        print("(Chưa cài pyarrow -> không dùng cache kết quả)")
+
+queries = {name: backends.translate_sql(sql, dialect)
+           for name, sql in [('trend', sql_trend), ('category', sql_category), ('age', sql_age)]}
+results, executed = query_cache.run_queries(engine, queries, cache)
+df_trend, df_category, df_age = results['trend'], results['category'], results['age']
+print(f"--- Truy vấn kho: {', '.join(executed) if executed else 'không (dùng cache)'} ---")
 
 print("--- Đã lấy dữ liệu xong. Bắt đầu vẽ biểu đồ... ---")
 
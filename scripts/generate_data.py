@@ -0,0 +1,233 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+import sqlalchemy
+
+# Cho phép import các module trong thư mục etl_pipeline/
+ETL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl_pipeline')
+sys.path.insert(0, ETL_DIR)
+
+import backends
+from benchmark_categorizer import SAMPLE_DESCRIPTIONS, UNMAPPED_MERCHANTS, load_mcc_mapping
+
+# ==============================================================================
+# Sinh dữ liệu nguồn giả lập (tbl_Customers, tbl_Accounts, tbl_Transactions) ở quy mô lớn
+# ==============================================================================
+# Dữ liệu được sinh theo seed cố định (chạy lại cho kết quả giống hệt) và có cùng các
+# loại lỗi logic như dữ liệu nguồn thật để ETL phải làm sạch:
+#   - Tài khoản mở TRƯỚC ngày sinh của khách hàng (--invalid-account-rate)
+#   - Giao dịch xảy ra TRƯỚC ngày mở tài khoản (--invalid-transaction-rate)
+# Giao dịch POS dùng các merchant trong tbl_MCC_Mapping.csv (+ vài merchant không có trong
+# bảng mapping), giao dịch P2P dùng nội dung chuyển khoản không dấu giống dữ liệu nguồn.
+# Tỉ lệ giống data_source/: 1 khách hàng ~ 1.5 tài khoản ~ 15 giao dịch.
+
+DEFAULT_BATCH_SIZE = 500_000
+
+FIRST_ACCOUNT_ID = 1001
+TRANSACTION_START = '2022-01-01'
+TRANSACTION_END = '2025-12-31'
+
+LAST_NAMES = ['Nguyễn', 'Trần', 'Lê', 'Phạm', 'Hoàng', 'Huỳnh', 'Phan', 'Vũ', 'Võ', 'Đặng',
+              'Bùi', 'Đỗ', 'Hồ', 'Ngô', 'Dương', 'Lý', 'Trịnh', 'Đinh', 'Lâm', 'Mai']
+MIDDLE_NAMES = ['Văn', 'Thị', 'Minh', 'Ngọc', 'Đức', 'Thùy', 'Gia', 'Bảo', 'Hoàng', 'Thanh', 'Quốc', 'Mỹ']
+GIVEN_NAMES = ['Hùng', 'Lan', 'Tú', 'Trúc', 'Dũng', 'Cường', 'Thảo', 'Cúc', 'Hiếu', 'Linh', 'Huy',
+               'Thư', 'Anh', 'Nam', 'Hà', 'Phương', 'Long', 'Tâm', 'Vy', 'Khoa', 'Quân', 'Nhi']
+
+# Hồ Chí Minh / Hà Nội chiếm phần lớn khách hàng như dữ liệu nguồn
+CITIES = ['Hồ Chí Minh', 'Hà Nội', 'Đà Nẵng', 'Hải Phòng', 'Cần Thơ', 'Huế', 'Khánh Hòa', 'Thanh Hóa',
+          'Nghệ An', 'Quảng Ninh', 'Đồng Nai', 'Lâm Đồng', 'Bình Định', 'Cà Mau', 'Kiên Giang', 'Thái Nguyên']
+CITY_WEIGHTS = np.array([10, 9] + [1.5] * (len(CITIES) - 2))
+
+# Giao dịch POS ở nước ngoài (khoảng 1.5%)
+FOREIGN_COUNTRIES = ['Thái Lan', 'Singapore', 'Nhật Bản', 'Hàn Quốc', 'Mỹ']
+FOREIGN_RATE = 0.015
+POS_RATE = 0.6
+
+# Nội dung chuyển khoản P2P: cụm từ gốc + hậu tố tùy ý (nhiều giá trị khác nhau như thực tế)
+P2P_PHRASES = [d for d in SAMPLE_DESCRIPTIONS if d] + [
+    'an toi', 'thanh toan tien cho', 'goi xe', 'rua xe', 'dong hoc phi', 'ck tien xe om',
+    'tien dien', 'tien nuoc', 'tien nha', 'tien wifi', 'mua quan ao', 'mua giay', 'tra sua',
+    'an pho', 'com trua', 'tien ship', 've xem phim', 'hat karaoke', 'di sieu thi', 'tien hoc them',
+]
+P2P_SUFFIXES = [''] * 6 + [f' thang {m}' for m in range(1, 13)] + [' nhe', ' nha', ' a', ' e oi', ' nhe ban']
+
+
+def parse_rows(text):
+    # '1M' -> 1_000_000, '500k' -> 500_000, '2000' -> 2000
+    text = str(text).strip().upper().replace('_', '')
+    multiplier = {'K': 1_000, 'M': 1_000_000}.get(text[-1:], 1)
+    return int(float(text[:-1] if multiplier > 1 else text) * multiplier)
+
+
+def table_sizes(n_transactions):
+    n_accounts = max(n_transactions // 10, 100)
+    return max(n_accounts * 2 // 3, 50), n_accounts
+
+
+def _random_dates(rng, start, end, n):
+    start, end = pd.Timestamp(start).value, pd.Timestamp(end).value
+    return pd.to_datetime(rng.integers(start, end, n)).floor('s')
+
+
+def _pick(rng, values, n, p=None):
+    values = np.array(values, dtype=object)
+    return values[rng.choice(len(values), n, p=p)]
+
+
+def _full_names(rng, n):
+    names = pd.Series(_pick(rng, LAST_NAMES, n)) + ' ' + _pick(rng, MIDDLE_NAMES, n) + ' ' + _pick(rng, GIVEN_NAMES, n)
+    return names.to_numpy(dtype=object)
+
+
+def make_customers(rng, n_customers):
+    first_names = pd.Series(_pick(rng, MIDDLE_NAMES, n_customers)) + ' ' + _pick(rng, GIVEN_NAMES, n_customers)
+    return pd.DataFrame({
+        'CustomerID': np.arange(1, n_customers + 1),
+        'FirstName': first_names,
+        'LastName': _pick(rng, LAST_NAMES, n_customers),
+        'BirthDate': _random_dates(rng, '1950-01-01', '2005-12-31', n_customers).normalize(),
+        'Gender': _pick(rng, ['Male', 'Female'], n_customers),
+        'City': _pick(rng, CITIES, n_customers, p=CITY_WEIGHTS / CITY_WEIGHTS.sum()),
+        'Country': 'Việt Nam',
+    })
+
+
+def make_accounts(rng, df_customers, n_accounts, invalid_rate):
+    customer_idx = rng.integers(0, len(df_customers), n_accounts)
+    birth = df_customers['BirthDate'].to_numpy()[customer_idx]
+    last_open = pd.Timestamp(TRANSACTION_START).to_datetime64()
+
+    # Hợp lệ: mở trong khoảng (ngày sinh, trước khi có giao dịch). Lỗi: mở trước ngày sinh 1 - 3650 ngày
+    open_date = birth + ((last_open - birth) * rng.uniform(0.3, 1.0, n_accounts)).astype('timedelta64[s]')
+    is_invalid = rng.random(n_accounts) < invalid_rate
+    days_before = rng.integers(1, 3650, n_accounts).astype('timedelta64[D]')
+    open_date = np.where(is_invalid, birth - days_before, open_date)
+
+    return pd.DataFrame({
+        'AccountID': np.arange(FIRST_ACCOUNT_ID, FIRST_ACCOUNT_ID + n_accounts),
+        'CustomerID': df_customers['CustomerID'].to_numpy()[customer_idx],
+        'AccountType': _pick(rng, ['Debit', 'Credit'], n_accounts),
+        'OpenDate': pd.to_datetime(open_date).floor('s'),
+    })
+
+
+def make_transactions(rng, df_accounts, merchants, first_id, n_rows, invalid_rate):
+    # 1 khối giao dịch TransactionID liên tiếp, trộn POS / P2P
+    account_idx = rng.integers(0, len(df_accounts), n_rows)
+    timestamps = _random_dates(rng, TRANSACTION_START, TRANSACTION_END, n_rows).to_numpy()
+
+    # Giao dịch lỗi: xảy ra trước ngày mở tài khoản 1 giờ - 365 ngày
+    open_date = df_accounts['OpenDate'].to_numpy()[account_idx]
+    is_invalid = rng.random(n_rows) < invalid_rate
+    seconds_before = rng.integers(3600, 365 * 86400, n_rows).astype('timedelta64[s]')
+    timestamps = np.where(is_invalid, open_date - seconds_before, timestamps)
+
+    is_pos = rng.random(n_rows) < POS_RATE
+    is_foreign = is_pos & (rng.random(n_rows) < FOREIGN_RATE)
+    descriptions = pd.Series(_pick(rng, P2P_PHRASES, n_rows)) + _pick(rng, P2P_SUFFIXES, n_rows)
+
+    # Số tiền (VNĐ, làm tròn đến đồng): phân phối log-normal quanh ~500.000đ
+    amount = np.round(np.exp(rng.normal(13.1, 0.9, n_rows)))
+
+    return pd.DataFrame({
+        'TransactionID': np.arange(first_id, first_id + n_rows, dtype=np.int64),
+        'AccountID': df_accounts['AccountID'].to_numpy()[account_idx],
+        'MerchantName': np.where(is_pos, _pick(rng, merchants, n_rows), None),
+        'Amount': amount,
+        'TransactionTimestamp': pd.to_datetime(timestamps),
+        'TransactionCountry': np.where(is_foreign, _pick(rng, FOREIGN_COUNTRIES, n_rows), 'Việt Nam'),
+        'BeneficiaryName': np.where(is_pos, None, _full_names(rng, n_rows)),
+        'TransactionDescription': np.where(is_pos, None, descriptions.to_numpy(dtype=object)),
+    })
+
+
+def write_frame(engine, df, table_name):
+    if engine.dialect.name == 'duckdb':
+        # DuckDB đọc thẳng DataFrame (dạng cột) thay vì executemany từng dòng
+        columns = ', '.join(df.columns)
+        with engine.begin() as conn:
+            raw = conn.connection.driver_connection
+            raw.register('synthetic_frame', df)
+            raw.execute(f"INSERT INTO {table_name} ({columns}) SELECT {columns} FROM synthetic_frame")
+            raw.unregister('synthetic_frame')
+    else:
+        df.to_sql(table_name, engine, if_exists='append', index=False, chunksize=50_000)
+
+
+def source_row_count(engine):
+    with engine.connect() as conn:
+        return sum(conn.execute(sqlalchemy.text(f"SELECT COUNT(*) FROM {t}")).scalar()
+                   for t in ['tbl_Customers', 'tbl_Accounts', 'tbl_Transactions'])
+
+
+def generate(engine, n_transactions, df_mcc_mapping, seed=42, batch_size=DEFAULT_BATCH_SIZE,
+             invalid_account_rate=0.05, invalid_transaction_rate=0.02):
+    # Ghi dữ liệu giả lập vào các bảng nguồn (đang trống). Trả về số dòng từng bảng.
+    rng = np.random.default_rng(seed)
+    n_customers, n_accounts = table_sizes(n_transactions)
+
+    df_customers = make_customers(rng, n_customers)
+    df_accounts = make_accounts(rng, df_customers, n_accounts, invalid_account_rate)
+    write_frame(engine, df_customers, 'tbl_Customers')
+    write_frame(engine, df_accounts, 'tbl_Accounts')
+    print(f"   - tbl_Customers: {n_customers:,} dòng, tbl_Accounts: {n_accounts:,} dòng")
+
+    merchants = list(df_mcc_mapping['MerchantName'].dropna().unique()) + UNMAPPED_MERCHANTS
+    t0 = time.perf_counter()
+    for first_id in range(1, n_transactions + 1, batch_size):
+        n_rows = min(batch_size, n_transactions - first_id + 1)
+        df = make_transactions(rng, df_accounts, merchants, first_id, n_rows, invalid_transaction_rate)
+        write_frame(engine, df, 'tbl_Transactions')
+        done = first_id + n_rows - 1
+        elapsed = time.perf_counter() - t0
+        print(f"   - tbl_Transactions: {done:,}/{n_transactions:,} dòng ({done / max(elapsed, 1e-9):,.0f} dòng/s)")
+
+    return {'tbl_Customers': n_customers, 'tbl_Accounts': n_accounts, 'tbl_Transactions': n_transactions}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Sinh dữ liệu nguồn giả lập cho ETL (1M / 10M / 50M giao dịch)')
+    parser.add_argument('--rows', default='1M',
+                        help='Số giao dịch cần sinh, ví dụ 1M, 10M, 50M, 250k')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help='Số giao dịch sinh và ghi mỗi lô')
+    parser.add_argument('--invalid-account-rate', type=float, default=0.05,
+                        help='Tỉ lệ tài khoản mở trước ngày sinh')
+    parser.add_argument('--invalid-transaction-rate', type=float, default=0.02,
+                        help='Tỉ lệ giao dịch xảy ra trước ngày mở tài khoản')
+    parser.add_argument('--mcc', default=os.path.join(ETL_DIR, 'tbl_MCC_Mapping.csv'))
+    parser.add_argument('--backend', choices=backends.BACKENDS, default='sqlite',
+                        help='Database đích: engine nhúng sqlite / duckdb (mặc định) hoặc SQL Server')
+    parser.add_argument('--database', default=None,
+                        help='File database cho backend sqlite / duckdb')
+    parser.add_argument('--reset', action='store_true',
+                        help='Tạo lại toàn bộ schema (XÓA dữ liệu cũ) trước khi sinh - chỉ cho engine nhúng')
+    args = parser.parse_args()
+
+    from etl import create_engine
+    engine = create_engine(backend=args.backend, database=args.database)
+    if args.backend != 'mssql':
+        if args.reset:
+            backends.create_schema(engine)
+        elif backends.ensure_schema(engine):
+            print(f"Đã tạo schema (schema.sql) trên database {args.backend} mới.")
+
+    if source_row_count(engine):
+        print("*** Các bảng nguồn đã có dữ liệu: dùng --reset (sqlite / duckdb) hoặc chạy lại schema.sql ***")
+        sys.exit(1)
+
+    n_transactions = parse_rows(args.rows)
+    print(f"Đang sinh {n_transactions:,} giao dịch (seed={args.seed})...")
+    t0 = time.perf_counter()
+    generate(engine, n_transactions, load_mcc_mapping(args.mcc), seed=args.seed, batch_size=args.batch_size,
+             invalid_account_rate=args.invalid_account_rate, invalid_transaction_rate=args.invalid_transaction_rate)
+    print(f"\nHoàn tất trong {time.perf_counter() - t0:.2f}s.")
+
+
+if __name__ == '__main__':
+    main()
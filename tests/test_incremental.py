@@ -0,0 +1,90 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+import pytest
+
+ETL_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl_pipeline')
+sys.path.insert(0, ETL_DIR)
+import backends
+
+# Khách hàng 1: tài khoản duy nhất mở trước ngày sinh -> bị loại ở lần chạy đầu
+# Khách hàng 3: ngày sinh sai (sau ngày mở tài khoản 12) -> cả 2 bị loại ở lần chạy đầu
+CUSTOMERS = [
+    (1, 'Van', 'A', '1990-01-01', 'Nam', 'Hà Nội', 'Việt Nam'),
+    (2, 'Thi', 'B', '1985-05-05', 'Nữ', 'Hà Nội', 'Việt Nam'),
+    (3, 'Van', 'C', '2010-01-01', 'Nam', 'Huế', 'Việt Nam'),
+]
+ACCOUNTS = [
+    (10, 2, 'Thanh toán', '2015-01-01 00:00:00'),
+    (11, 1, 'Thanh toán', '1980-01-01 00:00:00'),
+    (12, 3, 'Thanh toán', '2005-01-01 00:00:00'),
+]
+MCC_MAPPING = "MerchantName,Category\nHighlands Coffee,Ăn uống & Cà phê\n"
+TRANSACTION_SQL = "INSERT INTO tbl_Transactions VALUES (?, ?, 'Highlands Coffee', 50000, ?, 'Việt Nam', NULL, NULL)"
+
+
+def run_etl(database, tmp_path, *extra):
+    # etl.py đọc tbl_MCC_Mapping.csv trong thư mục hiện tại -> chạy trong tmp_path
+    (tmp_path / 'tbl_MCC_Mapping.csv').write_text(MCC_MAPPING, encoding='utf-8')
+    cmd = [sys.executable, os.path.join(ETL_DIR, 'etl.py'), '--backend', 'sqlite', '--database', str(database),
+           '--state-file', str(tmp_path / 'state.json'), '--keymap-file', str(tmp_path / 'keymap.pkl'), *extra]
+    proc = subprocess.run(cmd, cwd=tmp_path, capture_output=True, text=True)
+    assert proc.returncode == 0, proc.stdout[-3000:] + proc.stderr[-3000:]
+    return proc.stdout
+
+
+def create_source(tmp_path):
+    database = tmp_path / 'dw.sqlite'
+    backends.create_schema(backends.create_embedded_engine('sqlite', str(database)))
+    conn = sqlite3.connect(database)
+    conn.executemany("INSERT INTO tbl_Customers VALUES (?, ?, ?, ?, ?, ?, ?)", CUSTOMERS)
+    conn.executemany("INSERT INTO tbl_Accounts VALUES (?, ?, ?, ?)", ACCOUNTS)
+    conn.execute(TRANSACTION_SQL, (1, 10, '2024-03-01 10:00:00'))
+    conn.commit()
+    return database, conn
+
+
+def test_incremental_loads_customers_and_accounts_that_become_valid(tmp_path):
+    database, conn = create_source(tmp_path)
+    run_etl(database, tmp_path)
+
+    # Khách hàng 1 mở tài khoản hợp lệ; ngày sinh của khách hàng 3 được sửa -> tài khoản 12 hợp lệ
+    conn.execute("INSERT INTO tbl_Accounts VALUES (99999, 1, 'Thanh toán', '2020-01-01 00:00:00')")
+    conn.execute("UPDATE tbl_Customers SET BirthDate = '1980-01-01' WHERE CustomerID = 3")
+    conn.execute(TRANSACTION_SQL, (99999, 99999, '2024-03-02 10:00:00'))
+    conn.execute(TRANSACTION_SQL, (100000, 12, '2024-03-02 11:00:00'))
+    conn.commit()
+    run_etl(database, tmp_path)
+
+    customers = {row[0] for row in conn.execute("SELECT CustomerID_Source FROM Dim_Customer")}
+    accounts = {row[0] for row in conn.execute("SELECT AccountID_Source FROM Dim_Account")}
+    facts = {row[0] for row in conn.execute("SELECT TransactionID_Source FROM Fact_Spending")}
+    assert customers == {1, 2, 3}
+    assert accounts == {10, 12, 99999}
+    assert facts == {1, 99999, 100000}
+
+
+@pytest.mark.parametrize('extra', [[], ['--pushdown']])
+def test_incremental_retries_transactions_with_missing_account(tmp_path, extra):
+    database, conn = create_source(tmp_path)
+    run_etl(database, tmp_path, *extra)
+
+    # Giao dịch 2 tới trước tài khoản 13 -> bị loại, High-water mark không được vượt qua nó
+    conn.execute(TRANSACTION_SQL, (2, 13, '2024-03-02 10:00:00'))
+    conn.execute(TRANSACTION_SQL, (3, 10, '2024-03-02 11:00:00'))
+    conn.commit()
+    run_etl(database, tmp_path, *extra)
+    state = json.loads((tmp_path / 'state.json').read_text(encoding='utf-8'))
+    assert state['last_transaction_id'] == 1
+
+    conn.execute("INSERT INTO tbl_Accounts VALUES (13, 2, 'Thanh toán', '2020-01-01 00:00:00')")
+    conn.commit()
+    run_etl(database, tmp_path, *extra)
+
+    facts = [row[0] for row in conn.execute("SELECT TransactionID_Source FROM Fact_Spending ORDER BY 1")]
+    assert facts == [1, 2, 3]
+    state = json.loads((tmp_path / 'state.json').read_text(encoding='utf-8'))
+    assert state['last_transaction_id'] == 3
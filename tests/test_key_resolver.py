@@ -0,0 +1,24 @@
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Cho phép import các module trong thư mục etl_pipeline/
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'etl_pipeline'))
+from key_resolver import KeyIndex, MISSING_KEY
+
+
+def test_take_all_null_categorical():
+    # Khối chỉ có giao dịch P2P: MerchantName toàn NULL, category rỗng
+    index = KeyIndex(['Shop A', 'Shop B'], [1, 2])
+    column = pd.Series([None, None, None], dtype='category')
+    assert column.cat.categories.empty
+    np.testing.assert_array_equal(index.take(column), [MISSING_KEY] * 3)
+
+
+def test_take_categorical_with_unused_and_unknown_categories():
+    index = KeyIndex(['Shop A', 'Shop B'], [1, 2])
+    column = pd.Series(pd.Categorical(['Shop B', None, 'Shop X', 'Shop A'],
+                                      categories=['Shop A', 'Shop B', 'Shop X', 'Shop Unused']))
+    np.testing.assert_array_equal(index.take(column), [2, MISSING_KEY, MISSING_KEY, 1])